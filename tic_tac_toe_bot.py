@@ -0,0 +1,126 @@
+#! /usr/bin/python3
+
+# Import the time module to time the moves
+import time
+# Import the random module to pick the moves
+import random
+# Import the client the bot is built on
+from tic_tac_toe_client import TTTClientGame
+# Import the framing and message codec shared with the server
+from tic_tac_toe_protocol import PROTOCOL_VERSION
+
+# Seconds to wait for the server before giving up
+TIMEOUT = 30
+
+
+class BotClient(TTTClientGame):
+    """BotClient is a headless TTTClientGame for scripts and load tests. It
+    never prompts nor sleeps, plays random moves and records the round trip
+    time of every move it makes."""
+
+    def __init__(self, player_name, seed=None):
+        """Initializes the bot with its player name."""
+        TTTClientGame.__init__(self)
+        self.player_name = player_name
+        self.random = random.Random(seed)
+        # Seconds between sending each move and receiving it back
+        self.move_times = []
+        self.games_played = 0
+
+    def connect(self, address, port_number):
+        """Connects to the server, says hello and receives the lobby. Raises
+        an error instead of asking what to do if it fails. Heartbeats keep
+        the connection from being dropped while the bot waits."""
+        self.client_socket.settimeout(TIMEOUT)
+        self.address = (address, int(port_number))
+        self.client_socket.connect(self.address)
+        self.s_sendCommand("H", PROTOCOL_VERSION, self.player_name)
+        self.s_recvBoard()
+        self.start_heartbeats()
+
+    def __connect_failed__(self):
+        """(Private) Raises an error instead of asking what to do."""
+        raise ConnectionError("Could not connect to the server")
+
+    def displayLobby(self):
+        """Bots do not display anything"""
+        pass
+
+    def open_games(self):
+        """Returns the games of the last lobby seen waiting for a second
+        player"""
+        return [game for game in self.game_list.values()
+                if game.Player2 == 'Waiting for player']
+
+    def find_game(self, host_name):
+        """Refreshes the lobby and returns the GameID of the game waiting for
+        a second player hosted by the given player, or None"""
+        self.updateLobby()
+        for game in self.open_games():
+            if game.Player1 == host_name:
+                return game.GameID
+        return None
+
+    def create_game(self, rows=3, columns=3, k=3):
+        """Creates a new game on a board of the given rows and columns, won
+        with k in a row, waits for a second player and plays it. Returns the
+        result: W, L or D"""
+        self.s_sendCommand("n", rows, columns, k)
+        return self.play_game()
+
+    def play_bot(self, difficulty):
+        """Plays a game against a bot of the server of the given difficulty
+        (0~2). Returns the result: W, L or D"""
+        self.s_sendCommand("b", difficulty)
+        return self.play_game()
+
+    def join_game(self, game_id):
+        """Joins the game with the given GameID and plays it. Returns the
+        result: W, L or D, or None if the game could not be joined"""
+        self.s_sendCommand("j", game_id)
+        if self.s_recvCommand("J") != 1:
+            return None
+        return self.play_game()
+
+    def play_game(self):
+        """Confirms the match info, then plays random moves until the game
+        is over. Returns the result: W, L or D"""
+        self.player_id = self.s_recvCommand("A")
+        self.s_sendCommand("c", 1)
+        self.role = self.s_recvCommand("R")
+        self.s_sendCommand("c", 2)
+        self.match_id = self.s_recvCommand("O")
+        self.s_sendCommand("c", 3)
+        self.s_recvSnapshot()
+
+        while True:
+            command = self.s_recvTurn()
+            if command == "Y":
+                position = self.choose_move(str(self.board))
+                sent = time.perf_counter()
+                self.sendMove(position)
+                # The move sent back as a delta closes its round trip
+                self.s_recvDelta()
+                self.move_times.append(time.perf_counter() - sent)
+            elif command == "N":
+                self.s_recvDelta()
+            else:
+                if command in ("W", "L"):
+                    self.s_recvCommand("P")
+                self.in_game = False
+                self.games_played += 1
+                return command
+
+    def choose_move(self, board):
+        """Returns a random empty position (1 being the first) of the board
+        string"""
+        return self.random.choice([i + 1 for i, cell in enumerate(board) if cell == " "])
+
+    def chat(self, text):
+        """Sends a chat message to everyone"""
+        self.s_sendCommand(">", text)
+
+    def exit(self):
+        """Leaves the server and closes the connection"""
+        self.s_sendCommand("e")
+        self.close()
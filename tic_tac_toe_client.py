@@ -2,14 +2,43 @@
 
 # Import the socket module
 import socket
+# Import the selectors module to wait on the user and the server at once
+import selectors
 # Import command line arguments
 from sys import argv
 import sys
+# Import the os module to tell Windows apart
 import os
-import pickle
 import time
-
-clearScreen = lambda: os.system('cls')
+# Import multi-threading module for the heartbeat thread
+import threading
+# Import the deque keeping the latest chat lines
+from collections import deque
+# Import the framing and message codec shared with the server
+from tic_tac_toe_protocol import FrameReader, PROTOCOL_VERSION, RECV_SIZE, encode, decode
+# Import the board of the game engine, the client keeps its own copy
+from tic_tac_toe_engine import Board, ROWS, COLUMNS, K, path_positions, supported
+# Import the screen the lobby and the boards are drawn on
+from tic_tac_toe_screen import Screen
+
+# The most chat messages asked for at once, the most kept for display, and
+# the number shown in the lobby
+CHAT_PAGE = 50
+CHAT_LINES = 200
+CHAT_SHOWN = 5
+# The messages the server pushes to subscribed clients at any time, and the
+# session token it sends after the hello
+PUSHES = ("U", "T", "G", "K")
+# How long to keep trying to resume a game after losing the connection, and
+# the pause between two tries, in seconds
+RESUME_TIME = 30
+RESUME_DELAY = 1
+# How often the client tells the server it is still there, in seconds, so
+# that the connection is not dropped while it waits in the lobby or for a
+# second player
+HEARTBEAT_INTERVAL = 15
+# The number of scoreboard entries shown at once
+STATS_PAGE = 10
 
 
 class TTTClient:
@@ -19,6 +48,40 @@ class TTTClient:
         """Initializes the client and create a client socket."""
         # Create a TCP/IP socket
         self.client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        # Send the commands and chat messages right away rather than waiting
+        # for the previous ones to be acknowledged
+        self.client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        # Buffers the frames received from the server
+        self.frames = FrameReader()
+        # The games in the lobby by GameID, as of the last lobby version seen
+        self.game_list = {}
+        self.lobby_version = 0
+        # Whether the server pushes the lobby changes and chat messages
+        self.subscribed = False
+        # The latest chat lines, up to the last chat sequence number seen
+        self.chat_lines = deque(maxlen=CHAT_LINES)
+        self.chat_seq = 0
+        # The board of the game being played, and the sequence number of the
+        # last move applied to it
+        self.board = Board()
+        self.game_seq = 0
+        # The address of the server, and the token of the session resumed
+        # with it after losing the connection in the middle of a game
+        self.address = None
+        self.session = None
+        # Whether a game is played, the number of its messages received from
+        # the board snapshot on, and the move sent and not played yet, as its
+        # sequence number and position
+        self.in_game = False
+        self.game_frames = 0
+        self.pending_move = None
+        # Set once a delta arrives out of sequence, until the snapshot of the
+        # board asked for replaces it
+        self.resyncing = False
+        # Keeps the heartbeats from being sent in the middle of a message
+        self.send_lock = threading.Lock()
+        # Draws the lobby and the boards, redrawing only what changed
+        self.screen = Screen()
 
     def connect(self, address, port_number):
         """Keeps repeating connecting to the server and returns True if
@@ -29,7 +92,8 @@ class TTTClient:
                 # Connection time out 10 seconds
                 self.client_socket.settimeout(1000)
                 # Connect to the specified host and port
-                self.client_socket.connect((address, int(port_number)))
+                self.address = (address, int(port_number))
+                self.client_socket.connect(self.address)
                 # Return True if connected successfully
                 print("Connected!")
                 return True
@@ -50,95 +114,253 @@ class TTTClient:
             address = input("Please enter the address: ")
             port_number = input("Please enter the port: ")
 
-    def s_sendCommand(self, command_type, msg):
+    def s_sendCommand(self, command_type, *values):
         """Sends a message to the server with an agreed command type token
         to ensure the message is delivered safely."""
-        # A 1 byte command_type character is put at the front of the message
-        # as a communication convention
+        # The command type is sent as the type byte of the message frame
         try:
-            self.client_socket.send((command_type + msg).encode())
+            with self.send_lock:
+                self.client_socket.sendall(encode(command_type, *values))
         except:
+            # A game being played is resumed on a new connection, the move
+            # sent last being sent again on it
+            if self.resume():
+                return
             # If any error occurred, the connection might be lost
             self.__connection_lost()
 
-    def s_send(self, msg):
+    def s_recvMessage(self):
+        """Receives the next message from the server, as its command type
+        token and its values. The updates pushed by the server in between
+        are applied."""
+        while True:
+            try:
+                command_type, payload = self.frames.read_from(self.client_socket)
+                values = decode(command_type, payload)
+            except:
+                # A game being played is resumed on a new connection, the
+                # messages missed being sent again on it
+                if self.resume():
+                    continue
+                # If any error occurred, the connection might be lost
+                self.__connection_lost()
+            if command_type not in PUSHES:
+                if self.in_game:
+                    self.game_frames += 1
+                return self.__check_quit__(command_type, values)
+            self.applyPush(command_type, values)
+
+    def s_recvPushes(self):
+        """Receives what the server sent, once the socket is readable, and
+        applies the updates pushed in it. Returns True if any was
+        applied."""
         try:
-            self.client_socket.send(msg.encode())
+            data = self.client_socket.recv(RECV_SIZE)
         except:
-            # If any error occurred, the connection might be lost
+            data = None
+        if not data:
             self.__connection_lost()
-
-    def s_recvCommand(self, size, expected_type):
-        """Receives a packet with specified size from the server and check
-        its integrity by comparing its command type token with the expected
-        one."""
-        try:
-            msg = self.client_socket.recv(size).decode()
-            # If received a quit signal from the server
-            if msg[0] == "Q":
-                why_quit = ""
-                try:
-                    # Try receiving the whole reason why quit
-                    why_quit = self.client_socket.recv(1024).decode()
-                except:
-                    pass
-                # Print the reason
-                print(msg[1:] + why_quit)
-                # Throw an error
-                raise Exception
-            # If received an echo signal from the server
-            elif msg[0] == "E":
-                # Echo the message back to the server
-                self.s_sendCommand("e", msg[1:])
-                # Recursively retrieve the desired message
-                return self.s_recvCommand(size, expected_type)
-            # If the command type token is not the expected type
-            elif msg[0] != expected_type:
-                print("The received command type \"" + msg[0] + "\" does not " +
-                      "match the expected type \"" + expected_type + "\".")
-                # Connection lost
+        self.frames.feed(data)
+        pushed = False
+        while True:
+            try:
+                frame = self.frames.next_frame()
+                if frame is None:
+                    return pushed
+                command_type, values = frame[0], decode(*frame)
+            except:
                 self.__connection_lost()
-            # If received an integer from the server
-            elif msg[0] == "I":
-                # Return the integer
-                return int(msg[1:])
-            # In other case
+            self.__check_quit__(command_type, values)
+            if command_type in PUSHES:
+                self.applyPush(command_type, values)
+                pushed = True
             else:
-                # Return the message
-                return msg[1:]
-            # Simply return the raw message if anything unexpected happened
-            # because it shouldn't matter any more
-            return msg
-        except:
-            # If any error occurred, the connection might be lost
-            self.__connection_lost()
-        return None
-
-    def s_recv(self, size):
-        """Receives a packet with specified size from the server and check
-        its integrity by comparing its command type token with the expected
-        one."""
-        try:
-            msg = self.client_socket.recv(size).decode()
-            return msg
-        except:
-            # If any error occurred, the connection might be lost
+                print("Error: unexpected message \"" + command_type + "\" from the server")
+
+    def __check_quit__(self, command_type, values):
+        """(Private) Raises an error if the message is a quit signal from the
+        server, and returns the message otherwise."""
+        # If received a quit signal from the server
+        if command_type == "Q":
+            # Print the reason
+            print(values[0])
+            # Throw an error
+            raise Exception
+        return command_type, values
+
+    def subscribe(self):
+        """Asks the server to push the lobby changes and chat messages to
+        this client as they happen"""
+        self.s_sendCommand("u", self.lobby_version, self.chat_seq)
+        self.subscribed = True
+
+    def applyPush(self, command_type, values):
+        """Applies an update pushed by the server"""
+        if command_type == "U":
+            self.applyLobby(*values)
+        elif command_type == "T":
+            self.applyChat(*values)
+        elif command_type == "G":
+            game_id, player_name = values
+            self.screen.status(player_name + " joined your game " + str(game_id) + "!")
+        elif command_type == "K":
+            self.session = values[0]
+
+    def resume(self):
+        """Reconnects to the server after losing the connection in the
+        middle of a game and resumes its session, trying for up to
+        RESUME_TIME seconds. The server sends the messages of the game missed
+        again, and the move not played yet is sent again. Returns True if
+        the game is resumed."""
+        if not (self.in_game and self.session):
+            return False
+        self.screen.status("Connection lost, reconnecting...")
+        timeout = self.client_socket.gettimeout()
+        deadline = time.monotonic() + RESUME_TIME
+        while time.monotonic() < deadline:
+            try:
+                # No heartbeat may be sent on the new connection before the
+                # session is resumed
+                with self.send_lock:
+                    self.client_socket.close()
+                    self.client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                    self.client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                    self.client_socket.settimeout(timeout)
+                    self.frames = FrameReader()
+                    self.client_socket.connect(self.address)
+                    self.client_socket.sendall(encode("k", PROTOCOL_VERSION, self.game_frames, self.session))
+                    command_type, payload = self.frames.read_from(self.client_socket)
+                    if command_type == "K" and self.pending_move is not None:
+                        self.client_socket.sendall(encode("i", *self.pending_move))
+                    if command_type == "K" and self.resyncing:
+                        self.client_socket.sendall(encode("z"))
+            except:
+                time.sleep(RESUME_DELAY)
+                continue
+            if command_type != "K":
+                # The server no longer keeps the game
+                print(decode(command_type, payload)[0])
+                return False
+            self.screen.status("Reconnected.")
+            return True
+        return False
+
+    def start_heartbeats(self):
+        """Sends a heartbeat to the server every HEARTBEAT_INTERVAL seconds
+        from a thread of its own, until the client is closed"""
+        threading.Thread(target=self.__heartbeat_loop, daemon=True).start()
+
+    def __heartbeat_loop(self):
+        """(Private) Sends the heartbeats. A lost connection is left to the
+        main thread to find out."""
+        while True:
+            time.sleep(HEARTBEAT_INTERVAL)
+            try:
+                with self.send_lock:
+                    if self.client_socket.fileno() < 0:
+                        return
+                    self.client_socket.sendall(encode("h"))
+            except:
+                pass
+
+    def s_recvCommand(self, expected_type):
+        """Receives the next message from the server and check its integrity
+        by comparing its command type token with the expected one."""
+        command_type, values = self.s_recvMessage()
+        # A snapshot asked for again after resuming may be sent twice, the
+        # one not waited for replacing the board as well
+        while command_type == "B" and expected_type != "B" and self.in_game:
+            self.applySnapshot(*values)
+            command_type, values = self.s_recvMessage()
+        # If the command type token is not the expected type
+        if command_type != expected_type:
+            print("The received command type \"" + command_type + "\" does not " +
+                  "match the expected type \"" + expected_type + "\".")
+            # Connection lost
             self.__connection_lost()
+        # Return the value of the message, or its values if there are many
+        return values[0] if len(values) == 1 else values
 
     def s_recvBoard(self):
-        """Receive the list of names from the server"""
-        try:
-            return pickle.loads(self.client_socket.recv(4096))
-        except:
-            self.__connection_lost()
-            return None
+        """Receive a lobby update from the server and apply it to the list
+        of games"""
+        self.applyLobby(*self.s_recvCommand("L"))
+
+    def applyLobby(self, version, full, removed, records):
+        """Apply a lobby update to the list of games, unless it is older
+        than the list"""
+        if version < self.lobby_version:
+            # Pushed before the lobby was last refreshed
+            return
+        self.lobby_version = version
+        if full:
+            # A full snapshot replaces the whole list
+            self.game_list = {}
+        for game_id in removed:
+            self.game_list.pop(game_id, None)
+        for record in records:
+            game = gameDetails()
+            (game.GameID, game.Player1ID, game.Player2ID, game.Rows, game.Columns, game.K,
+             game.Player1, game.Player2) = record
+            self.game_list[game.GameID] = game
+
+    def s_recvSnapshot(self):
+        """Receive a snapshot of the game board from the server, starting
+        the game"""
+        self.applySnapshot(*self.s_recvCommand("B"))
+        # The messages of the game are counted from the snapshot on
+        self.in_game = True
+        self.game_frames = 1
+        self.pending_move = None
+
+    def applySnapshot(self, seq, rows, columns, k, x, o):
+        """Replace the board with a snapshot received from the server"""
+        self.game_seq = seq
+        self.board = Board(x, o, rows, columns, k)
+        self.resyncing = False
+
+    def s_recvTurn(self):
+        """Receive whose turn it is, or the result of the game, from the
+        server. The snapshot asked for after a delta out of sequence is
+        applied before the player moves."""
+        command = self.s_recvCommand("C")
+        if command == "Y" and self.resyncing:
+            self.applySnapshot(*self.s_recvCommand("B"))
+        return command
+
+    def sendMove(self, position):
+        """Sends the position moved to, keeping the move to be sent again if
+        the game is resumed before it is played"""
+        self.pending_move = (self.game_seq + 1, position)
+        self.s_sendCommand("i", *self.pending_move)
+
+    def s_recvDelta(self):
+        """Receive the next move of the game from the server and apply it to
+        the board. Returns the position moved to."""
+        return self.applyDelta(*self.s_recvCommand("D"))
+
+    def applyDelta(self, seq, position, role):
+        """Apply a move of the game received from the server to the board.
+        Returns the position moved to. Playing a game, a move out of
+        sequence has the server asked for a snapshot of the board, the
+        moves received until it arrives being left out."""
+        self.pending_move = None
+        if self.in_game and not self.resyncing and seq != self.game_seq + 1:
+            print("Expected move " + str(self.game_seq + 1) + " but received move " + str(seq) + ".")
+            # The board can no longer be trusted until replaced
+            self.resyncing = True
+            self.s_sendCommand("z")
+        if not self.resyncing:
+            self.game_seq = seq
+            self.board.place(role, position)
+        return position
 
     def __connection_lost(self):
         """(Private) This function will be called when the connection is lost."""
         print("Error: connection lost.")
         try:
             # Try and send a message back to the server to notify connection lost
-            self.client_socket.send("q".encode())
+            self.client_socket.send(encode("q", ""))
         except:
             pass
         # Raise an error to finish
@@ -161,27 +383,29 @@ class TTTClientGame(TTTClient):
 
     def start_game(self):
         """Starts the game and gets basic game information from the server."""
-        print("Waiting for second player...")
+        self.screen.status("Waiting for second player...")
         # Receive the player's ID from the server
-        self.player_id = int(self.s_recvCommand(128, "A"))
+        self.player_id = self.s_recvCommand("A")
         # Confirm the ID has been received
-        self.s_sendCommand("c", "1")
+        self.s_sendCommand("c", 1)
 
         # Tell the user that connection has been established
         self.__connected__()
 
         # Receive the assigned role from the server
-        self.role = str(self.s_recvCommand(2, "R"))
+        self.role = self.s_recvCommand("R")
         # Confirm the assigned role has been received
-        self.s_sendCommand("c", "2")
+        self.s_sendCommand("c", 2)
 
         # Receive the mactched player's ID from the server
-        self.match_id = int(self.s_recvCommand(128, "I"))
+        self.match_id = self.s_recvCommand("O")
         # Confirm the mactched player's ID has been received
-        self.s_sendCommand("c", "3")
+        self.s_sendCommand("c", 3)
 
-        print(("You are now matched against player " + str(self.match_id)
-               + "\nYou are the symbol \"" + self.role + "\""))
+        self.screen.status("You are now matched against player " + str(self.match_id)
+                           + "\nYou are the symbol \"" + self.role + "\"")
+        # Receive the board the moves of the game are applied to
+        self.s_recvSnapshot()
         time.sleep(3)
         # Start the main loop
         self.__main_loop()
@@ -190,27 +414,27 @@ class TTTClientGame(TTTClient):
         """(Private) This function is called when the client is successfully
         connected to the server."""
         # Welcome the user
-        clearScreen()
-        print("Welcome to Tic Tac Toe online, player " + str(self.player_id))
+        self.screen.draw("Welcome to Tic Tac Toe online, player " + str(self.player_id))
 
     def __main_loop(self):
         """The main game loop."""
         while True:
-            # Get the board content from the server
-            board_content = self.s_recvCommand(10, "B")
             # Get the command from the server
-            command = self.s_recvCommand(2, "C")
-            # Update the board
+            command = self.s_recvTurn()
+            # Update the board, every move has been applied to it
+            board_content = str(self.board)
             self.__update_board__(command, board_content)
 
             if command == "Y":
                 # If it's this player's turn to move
                 self.__player_move__(board_content)
+                # Get the move back from the server once it is played
+                self.s_recvDelta()
             elif command == "N":
                 # If the player needs to just wait
                 self.__player_wait__()
                 # Get the move the other player made from the server
-                move = self.s_recvCommand(2, "I")
+                move = self.s_recvDelta()
                 self.__opponent_move_made__(move)
             elif command == "D":
                 # If the result is a draw
@@ -220,7 +444,7 @@ class TTTClientGame(TTTClient):
                 # If this player wins
                 print("You WIN!")
                 # Draw winning path
-                self.__draw_winning_path__(self.s_recvCommand(4, "P"))
+                self.__draw_winning_path__(self.s_recvCommand("P"))
                 time.sleep(3)
                 # Break the loop and finish
                 break
@@ -228,7 +452,7 @@ class TTTClientGame(TTTClient):
                 # If this player loses
                 print("You lose.")
                 # Draw winning path
-                self.__draw_winning_path__(self.s_recvCommand(4, "P"))
+                self.__draw_winning_path__(self.s_recvCommand("P"))
                 time.sleep(3)
                 # Break the loop and finish
                 break
@@ -238,23 +462,25 @@ class TTTClientGame(TTTClient):
                 print("Error: unknown message was sent from the server")
                 # And finish
                 break
+        self.in_game = False
         # Display the updated lobby after the game finishes
         self.updateLobby()
         self.displayLobby()
 
     def __update_board__(self, command, board_string):
-        """(Private) Updates the board."""
-        clearScreen()
+        """(Private) Updates the board, in a single frame. The status line,
+        such as the move the opponent made last, stays below it."""
+        status = self.screen.status_line
         if command == "Y":
-            # If it's this player's turn to move, print out the current
-            # board with " " converted to the corresponding position number
-            print("Current board: \n" + self.format_board(
-                self.show_board_pos(board_string)))
-            print("Your symbol: " + str(self.role))
+            # If it's this player's turn to move, draw the current board
+            # with " " converted to the corresponding position number
+            self.screen.draw("Current board: \n" + self.format_board(self.show_board_pos(board_string))
+                             + str(self.board.k) + " in a row wins\n"
+                             + "Your symbol: " + str(self.role), status)
         else:
-            # Print out the current board
-            print("Current board:\n" + self.format_board(board_string))
-            print("Your symbol: " + str(self.role))
+            # Draw the current board
+            self.screen.draw("Current board:\n" + self.format_board(board_string)
+                             + "Your symbol: " + str(self.role), status)
 
     def __player_move__(self, board_string):
         """(Private) Lets the user input the move and sends it back to the
@@ -262,14 +488,15 @@ class TTTClientGame(TTTClient):
         while True:
             # Prompt the user to enter a position
             try:
-                position = int(input('Please enter the position (1~9):'))
+                self.screen.prompt('Please enter the position (1~' + str(self.board.cells) + '):')
+                position = int(input())
             except:
                 print("Invalid input.")
                 continue
 
             # Ensure user-input data is valid
-            if 1 <= position <= 9:
-                # If the position is between 1 and 9
+            if 1 <= position <= self.board.cells:
+                # If the position is on the board
                 if board_string[position - 1] != " ":
                     # If the position is already been taken,
                     # Print out a warning
@@ -279,101 +506,189 @@ class TTTClientGame(TTTClient):
                     # If the user input is valid, break the loop
                     break
             else:
-                print("Please enter a value between 1 and 9 that" +
+                print("Please enter a value between 1 and " + str(self.board.cells) + " that" +
                       "corresponds to the position on the grid board.")
         # Loop until the user enters a valid value
 
         # Send the position back to the server
-        self.s_sendCommand("i", str(position))
+        self.sendMove(position)
 
     def __player_wait__(self):
         """(Private) Lets the user know it's waiting for the other player to
         make a move."""
-        print("Waiting for the other player to make a move...")
+        self.screen.status("Waiting for the other player to make a move...")
 
     def __opponent_move_made__(self, move):
         """(Private) Shows the user the move that the other player has taken."""
-        print("Your opponent took up number " + str(move))
+        self.screen.status("Your opponent took up number " + str(move))
 
     def __draw_winning_path__(self, winning_path):
         """(Private) Shows to the user the path that has caused the game to win or lose."""
-        # Generate a new human readable path string
+        # Generate a new human readable path string from its first and last
+        # positions
         readable_path = ""
-        for c in winning_path:
-            readable_path += str(int(c) + 1) + ", "
+        for position in path_positions(winning_path, self.board.columns):
+            readable_path += str(position) + ", "
 
         print("The path is: " + readable_path[:-2])
 
     def show_board_pos(self, s):
-        """(Static) Converts the empty positions " " (a space) in the board
-        string to its corresponding position index number."""
+        """Converts the empty positions " " (a space) in the board string to
+        its corresponding position index number, returning a list of
+        cells."""
 
-        new_s = list("123456789")
-        for i in range(0, 9):
+        new_s = [str(i + 1) for i in range(len(s))]
+        for i in range(len(s)):
             if (s[i] != " "):
                 new_s[i] = s[i]
-        return "".join(new_s)
+        return new_s
 
     def format_board(self, s):
-        """(Static) Formats the grid board."""
+        """Formats the grid board, given the string or list of its cells."""
 
-        # If the length of the string is not 9
-        if len(s) != 9:
+        # If the number of cells does not match the board
+        if len(s) != self.board.cells:
             # Then print out an error message
-            print("Error: there should be 9 symbols.")
+            print("Error: there should be " + str(self.board.cells) + " symbols.")
             # Throw an error
             raise Exception
 
-        # Draw the grid board
+        # Draw the grid board, one row per line, every cell as wide as the
+        # widest one
         # print("|1|2|3|");
         # print("|4|5|6|");
         # print("|7|8|9|");
-        return ("|" + s[0] + "|" + s[1] + "|" + s[2] + "|\n"
-                + "|" + s[3] + "|" + s[4] + "|" + s[5] + "|\n"
-                + "|" + s[6] + "|" + s[7] + "|" + s[8] + "|\n")
+        width = max(len(cell) for cell in s)
+        columns = self.board.columns
+        return "".join("|" + "|".join(cell.rjust(width) for cell in s[row:row + columns]) + "|\n"
+                       for row in range(0, len(s), columns))
 
     def displayLobby(self):
         """Displays the lobby to the client"""
-        global game_list
-        # Clear the screen first, displays new lobby information
-        clearScreen()
+        # Draw the new lobby information as a frame of its own
         lobbyHeader1 = '\n'
         lobbyHeader2 = '              Tic-Tac-Toe Game Lobby           '
         lobbyHeader3 = '\n'
-        lobbyHeader4 = 'Game ID        Player 1        Player 2        '
-        lobbyHeader5 = '-----------------------------------------------'
+        lobbyHeader4 = 'Game ID        Player 1        Player 2        Board           '
+        lobbyHeader5 = '---------------------------------------------------------------'
 
-        lobbyFooter1 = '-----------------------------------------------'
+        lobbyFooter1 = '---------------------------------------------------------------'
         lobbyFooter2 = '\n'
-        lobbyFooter3 = 'Options:\nType \"N\" to create a new game\nType ' \
-                       '\"R\" to refresh the lobby\nType \"S\" to get the scoreboard\nType \"E\" to exit\nType \"C\" to view the chat\nType a Game' \
+        lobbyFooter3 = 'Options:\nType \"N\" to create a new game\nType \"B\" to play against a bot\nType ' \
+                       '\"R\" to refresh the lobby\nType \"S\" to get the scoreboard\nType \"E\" to exit\nType \"C\" to view the chat\nType \"W\" to watch a game\nType \"Y\" to watch the replay of a finished game\nType a Game' \
                        'ID# to join an existing game\nOr send a chat to everyone by starting your message with \">\"'
         lobbyFooter4 = '\n\n'
 
         # Display updated lobby
         # ----------------------------------------
-        print(lobbyHeader1)
-        print(lobbyHeader2)
-        print(lobbyHeader3)
-        print(lobbyHeader4)
-        print(lobbyHeader5)
-
-        if len(game_list) == 0:
-            print('\nThere are no active games\n')
-        else:
-            for gameDetails in game_list:
-                print(gameDetails)
+        frame = [lobbyHeader1, lobbyHeader2, lobbyHeader3, lobbyHeader4, lobbyHeader5]
 
-        print(lobbyFooter1)
-        print(lobbyFooter2)
-        print(lobbyFooter3)
-        print(lobbyFooter4)
+        if len(self.game_list) == 0:
+            frame.append('\nThere are no active games\n')
+        else:
+            for gameDetails in self.game_list.values():
+                frame.append(str(gameDetails))
+
+        frame.append(lobbyFooter1)
+        if self.chat_lines:
+            # The latest chat lines, kept up to date by the server
+            frame += ['Chat:'] + list(self.chat_lines)[-CHAT_SHOWN:] + [lobbyFooter1]
+        frame += [lobbyFooter2, lobbyFooter3, lobbyFooter4]
+        self.screen.draw("\n".join(frame))
+
+    def updateChat(self):
+        """Fetch the chat messages sent since the last one seen, a page at a
+        time, and returns the latest chat lines"""
+        while True:
+            self.s_sendCommand("v", self.chat_seq, CHAT_PAGE)
+            latest, messages = self.s_recvCommand("M")
+            if latest < self.chat_seq:
+                # The server has restarted, start over
+                self.chat_seq = 0
+                self.chat_lines.clear()
+                continue
+            self.applyChat(latest, messages)
+            if self.chat_seq >= latest or not messages:
+                return "\n".join(self.chat_lines)
+
+    def applyChat(self, latest, messages):
+        """Adds the chat messages not seen yet to the chat lines"""
+        for seq, player_name, text in messages:
+            if seq > self.chat_seq:
+                self.chat_lines.append(player_name + ": " + text)
+                self.chat_seq = seq
+
+    def waitInput(self, prompt):
+        """Prompts the user and returns the line entered. When the server
+        pushes updates and the user is at a terminal, they are applied while
+        waiting, and the lobby is redrawn. On Windows, where only sockets can
+        be selected, they are applied once the line is entered."""
+        if not (self.subscribed and self.screen.ansi and sys.stdin.isatty() and os.name != "nt"):
+            return input(prompt)
+        with selectors.DefaultSelector() as selector:
+            selector.register(sys.stdin, selectors.EVENT_READ)
+            selector.register(self.client_socket, selectors.EVENT_READ)
+            self.screen.prompt(prompt)
+            while True:
+                for key, events in selector.select():
+                    if key.fileobj is sys.stdin:
+                        line = sys.stdin.readline()
+                        if not line:
+                            raise EOFError
+                        return line.rstrip("\n")
+                    if self.s_recvPushes():
+                        self.displayLobby()
+                        self.screen.prompt(prompt)
+
+    def updateStats(self, offset):
+        """Fetch a page of the scoreboard from the given rank on (0 being the
+        first) and returns it as text"""
+        self.s_sendCommand("s", offset, STATS_PAGE)
+        players, rank, won, lost, entries = self.s_recvCommand("S")
+        stats = "You are ranked " + str(rank) + " of " + str(players) + " players, with " + str(
+            won) + " games won and " + str(lost) + " games lost\n\n"
+        for gamesWon, gamesLost, player_name in entries:
+            offset += 1
+            stats += str(offset) + ". " + str(player_name) + " has won " + str(gamesWon) + " games and lost " + str(
+                gamesLost) + " games\n"
+        return stats
+
+    def watchGame(self, game_id, command_type="w"):
+        """Watch the game with the given GameID until it is over, or its
+        replay with the "y" command type"""
+        self.s_sendCommand(command_type, game_id)
+        response = self.s_recvCommand("W")
+        if response == -1:
+            print("That game has not started yet")
+            return
+        elif response == -2:
+            print("Unfortunately a game with that GameID# does not exist")
+            return
+        self.screen.status("Waiting for the game...")
+        while True:
+            command_type, values = self.s_recvMessage()
+            if command_type == "B":
+                # The board as of the time the game was joined
+                self.applySnapshot(*values)
+            elif command_type == "D":
+                self.applyDelta(*values)
+            elif command_type == "F":
+                outcome = values[0]
+                break
+            self.screen.draw("Watching game " + str(game_id) + ", move " + str(self.game_seq) + ":\n"
+                             + self.format_board(str(self.board)))
+        if outcome == "D":
+            print("It's a draw.")
+        elif outcome == "-":
+            print("The game was abandoned.")
+        else:
+            print(outcome + " wins!")
 
     def updateLobby(self):
         """Update the lobby when the client requests it"""
-        global game_list
-        self.s_sendCommand("r", "")
-        game_list = self.s_recvBoard()
+        # Only the changes since the last lobby version seen are sent back
+        self.s_sendCommand("r", self.lobby_version)
+        self.s_recvBoard()
         self.displayLobby()
 
 
@@ -386,10 +701,14 @@ class gameDetails:
         self.Player2 = 'Waiting for player'
         self.Player1ID = 0
         self.Player2ID = 1
+        self.Rows = ROWS
+        self.Columns = COLUMNS
+        self.K = K
 
     def __str__(self):
         # return str(self.GameID) + ', ' + self.Player1 + ', ' + self.Player2
-        return str(self.GameID) + '              ' + self.Player1 + '           ' + self.Player2
+        return (str(self.GameID) + '              ' + self.Player1 + '           ' + self.Player2
+                + '           ' + str(self.Rows) + 'x' + str(self.Columns) + ', ' + str(self.K) + ' in a row')
 
     def __repr__(self):
         return str(self)
@@ -397,23 +716,24 @@ class gameDetails:
 
 def gameLobby(client):
     """Handles the display of the lobby and taking input from the client"""
-    global game_list
-    game_list = client.s_recvBoard()
+    client.s_recvBoard()
+    if not client.subscribed:
+        # The lobby and the chat are kept up to date by the server from now on
+        client.subscribe()
     client.displayLobby()
     while True:
-        player_input = input("What do you want to do: ")
+        player_input = client.waitInput("What do you want to do: ")
         if player_input[0] == '>':
-            client.s_send(player_input)
+            client.s_sendCommand(">", player_input[1:])
             player_input = 'c'
         player_input = player_input.lower()
-        # Check for correct letter input
-        if len(player_input) != 1:
+        # Check for correct letter input, or a Game ID# of any length
+        if len(player_input) != 1 and not player_input.isnumeric():
             print("You need to type 1 character, try again...")
             continue
         # Type 'C' to view the chat
         elif player_input == 'c':
-            client.s_sendCommand("c", "")
-            print(client.s_recv(4096))
+            print(client.updateChat())
             while True:
                 player_input_for_stats = input("Type \"C\" to continue: ").lower()
                 if player_input_for_stats != 'c':
@@ -421,34 +741,64 @@ def gameLobby(client):
                 else:
                     break
             client.displayLobby()
+        # Type "W" to watch a game, or "Y" to watch a replay
+        elif player_input in ('w', 'y'):
+            game_id = input("Please enter the GameID# to watch: ")
+            if game_id.isnumeric():
+                client.watchGame(int(game_id), player_input)
+            else:
+                print("That's not a GameID#...")
+            input("Press enter to continue...")
+            client.updateLobby()
+
         # Type "R" to refresh the lobby
         elif player_input == 'r':
-            print("About to receive new player data...")
+            client.screen.status("About to receive new player data...")
             client.updateLobby()
 
         # Type "N" to create a new game
         elif player_input == 'n':
-            clearScreen()
-            print("Creating new game...")
-            client.s_sendCommand("n", "")
+            board = input("Please enter the rows, columns and number in a row that wins, " +
+                          "or press enter for " + str(ROWS) + " " + str(COLUMNS) + " " + str(K) + ": ")
+            try:
+                rows, columns, k = [int(value) for value in board.split()] if board else (ROWS, COLUMNS, K)
+            except:
+                rows = columns = k = 0
+            if not supported(rows, columns, k):
+                print("Games cannot be played on that board...")
+                continue
+            client.screen.draw("Creating new game...")
+            client.s_sendCommand("n", rows, columns, k)
             client.start_game()
 
+        # Type "B" to play against a bot of the server
+        elif player_input == 'b':
+            difficulty = input("Please choose the bot: [E]asy, [M]edium or [H]ard: ").lower()
+            if difficulty in ('e', 'm', 'h'):
+                client.screen.draw("Starting a game against the bot...")
+                client.s_sendCommand("b", 'emh'.index(difficulty))
+                client.start_game()
+            else:
+                print("That's not a difficulty...")
+
         # Type "E" to exit
         elif player_input == 'e':
-            print("Exiting session...")
-            client.s_sendCommand("e", "")
+            client.screen.status("Exiting session...")
+            client.s_sendCommand("e")
             client.close()
             sys.exit()
 
         # Player requests stats
         elif player_input == 's':
-            print("Requesting stats...")
-            client.s_sendCommand("s", "")
-            stats = client.s_recv(4096)
-            print("Stats:\n" + stats)
+            client.screen.status("Requesting stats...")
+            offset = 0
+            print("Stats:\n" + client.updateStats(offset))
             while True:
-                player_input_for_stats = input("Type \"C\" to continue: ").lower()
-                if player_input_for_stats != 'c':
+                player_input_for_stats = input("Type \"N\" for the next page or \"C\" to continue: ").lower()
+                if player_input_for_stats == 'n':
+                    offset += STATS_PAGE
+                    print("Stats:\n" + client.updateStats(offset))
+                elif player_input_for_stats != 'c':
                     print("That's not the correct format...")
                 else:
                     break
@@ -456,11 +806,11 @@ def gameLobby(client):
 
         # Enter a Game ID# to join an existing game
         elif player_input.isnumeric():
-            client.client_socket.send(player_input.encode())
-            response = client.s_recv(4096)
-            if response == str(-1):
+            client.s_sendCommand("j", int(player_input))
+            response = client.s_recvCommand("J")
+            if response == -1:
                 print("Unfortunately that game is already full")
-            elif response == str(-2):
+            elif response == -2:
                 print("Unfortunately a game with that GameID# does not exist")
             else:
                 client.start_game()
@@ -472,9 +822,6 @@ def gameLobby(client):
 # Define the main program
 def main():
     """Starts client connection and lobby input"""
-    global game_list
-    game_list = []
-
     # If there are more than 3 arguments
     if len(argv) >= 3:
         # Set the address to argument 1, and port number to argument 2
@@ -485,10 +832,11 @@ def main():
         address = input("Please enter the address: ")
         port_number = input("Please enter the port: ")
 
-    # Prepare the window for client data
-    clearScreen()
+    # Initialize the client object
+    client = TTTClientGame()
 
-    print("Welcome to Tic-Tac-Toe! Game created by Network Noggins!")
+    # Prepare the window for client data
+    client.screen.draw("Welcome to Tic-Tac-Toe! Game created by Network Noggins!")
 
     # Ask the user to enter their name and check for empty name...
     while True:
@@ -499,17 +847,17 @@ def main():
         else:
             break
 
-    # Initialize the client object
-    client = TTTClientGame()
     # Connect to the server
     client.connect(address, port_number)
 
     try:
-        # Encode the player name to the server
-        client.client_socket.send(player_name.encode())
+        # Say hello to the server with the protocol version and player name
+        client.client_socket.send(encode("H", PROTOCOL_VERSION, player_name))
     except:
         # If any error occurred, the connection might be lost
         client.__connect_failed__()
+    # Keep the connection from being dropped while idle
+    client.start_heartbeats()
 
     while True:
         gameLobby(client)
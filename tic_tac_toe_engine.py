@@ -0,0 +1,198 @@
+#! /usr/bin/python3
+
+# The standard board: 3 rows of 3 columns, 3 in a row to win. Every cell
+# of a board is one bit, position 1 being bit 0
+ROWS = 3
+COLUMNS = 3
+K = 3
+CELLS = ROWS * COLUMNS
+# All the cells taken
+FULL = (1 << CELLS) - 1
+# The largest number of rows or columns a board may have
+MAX_SIDE = 32
+# The winning path of a board that is not won
+NO_PATH = (0, 0)
+
+# The lines that win the standard game, and the mask of their cells
+WIN_LINES = ("012", "345", "678", "036", "147", "258", "048", "246")
+WIN_MASKS = tuple((path, sum(1 << int(c) for c in path)) for path in WIN_LINES)
+
+# The winning path, as its first and last positions (1~9), of every possible
+# set of cells taken by one side of the standard game, or None if those cells
+# do not win, so that checking a win is a single lookup
+WIN_TABLE = tuple(next(((int(path[0]) + 1, int(path[-1]) + 1) for path, mask in WIN_MASKS
+                        if cells & mask == mask), None)
+                  for cells in range(1 << CELLS))
+
+# The directions of the lines through a cell, as (row, column) steps
+DIRECTIONS = ((0, 1), (1, 0), (1, 1), (1, -1))
+
+
+def supported(rows, columns, k):
+    """Returns True if games can be played on a board of the given rows and
+    columns, won with k in a row."""
+    return 3 <= rows <= MAX_SIDE and 3 <= columns <= MAX_SIDE and 3 <= k <= max(rows, columns)
+
+
+def path_positions(path, columns):
+    """Returns the positions of the winning path given by its first and last
+    positions, on a board of the given columns."""
+    first, last = path
+    row, column = divmod(first - 1, columns)
+    last_row, last_column = divmod(last - 1, columns)
+    length = max(abs(last_row - row), abs(last_column - column))
+    if length == 0:
+        return [first]
+    step = (last - first) // length
+    return [first + i * step for i in range(length + 1)]
+
+
+class Board:
+    """Board is a board of some rows and columns, won with k in a row,
+    storing the cells taken by each side as an integer of one bit per
+    cell."""
+
+    __slots__ = ("x", "o", "rows", "columns", "k", "cells", "full", "last")
+
+    def __init__(self, x=0, o=0, rows=ROWS, columns=COLUMNS, k=K):
+        """Initializes the board with the cells taken by X and by O, its rows
+        and columns and the number in a row that wins."""
+        self.x = x
+        self.o = o
+        self.rows = rows
+        self.columns = columns
+        self.k = k
+        self.cells = rows * columns
+        self.full = (1 << self.cells) - 1
+        # The position of the last move, the only one that can win
+        self.last = 0
+
+    def is_legal(self, position):
+        """Returns True if the position (1 being the first) is on the board
+        and empty."""
+        return 1 <= position <= self.cells and not (self.x | self.o) >> (position - 1) & 1
+
+    def place(self, role, position):
+        """Takes the position (1 being the first) for the role "X" or "O".
+        Returns False, leaving the board untouched, if the move is not
+        legal."""
+        if not self.is_legal(position):
+            return False
+        if role == "X":
+            self.x |= 1 << (position - 1)
+        else:
+            self.o |= 1 << (position - 1)
+        self.last = position
+        return True
+
+    def result(self, role):
+        """Checks if the role wins the game with the last move. Returns 1 and
+        the winning path if it wins, 0 if it's a draw, -1 if there's no
+        result yet."""
+        cells = self.x if role == "X" else self.o
+        if self.cells == CELLS and self.k == K:
+            path = WIN_TABLE[cells]
+        else:
+            path = self.line_through(cells, self.last)
+        if path is not None:
+            return 1, path
+        # If there's no empty position left, draw
+        if self.x | self.o == self.full:
+            return 0, NO_PATH
+        # The result cannot be determined yet
+        return -1, NO_PATH
+
+    def line_through(self, cells, position):
+        """Returns the winning path through the position, as its first and
+        last positions, if the cells have k in a row through it, or None.
+        Only the k - 1 cells each way along the four lines through the
+        position are checked."""
+        if not position:
+            return None
+        row, column = divmod(position - 1, self.columns)
+        for row_step, column_step in DIRECTIONS:
+            # Count the cells taken behind the position, then ahead of it
+            run = [0, 0]
+            for side, sign in enumerate((-1, 1)):
+                r, c = row + sign * row_step, column + sign * column_step
+                while (run[side] < self.k - 1 and 0 <= r < self.rows and 0 <= c < self.columns
+                       and cells >> (r * self.columns + c) & 1):
+                    run[side] += 1
+                    r += sign * row_step
+                    c += sign * column_step
+            if run[0] + run[1] + 1 >= self.k:
+                first = position - run[0] * (row_step * self.columns + column_step)
+                return first, first + (self.k - 1) * (row_step * self.columns + column_step)
+        return None
+
+    def masks(self):
+        """Returns the cells taken by X and by O, as sent on the wire."""
+        return self.x, self.o
+
+    def dimensions(self):
+        """Returns the rows, columns and number in a row that wins."""
+        return self.rows, self.columns, self.k
+
+    def best_moves(self):
+        """Returns the positions (1~9) of the best moves for the side to
+        move on the standard board, looked up in the solved game."""
+        return solve()[self.x | self.o << CELLS][1]
+
+    def empty(self):
+        """Returns the empty positions (1 being the first)."""
+        return [i + 1 for i in range(self.cells) if not (self.x | self.o) >> i & 1]
+
+    def __str__(self):
+        """Returns the board as a string of one symbol per cell, " " being
+        empty."""
+        return board_string(self.x, self.o, self.cells)
+
+
+def board_string(x, o, cells=CELLS):
+    """Returns the board with the cells taken by X and by O as a string of
+    one symbol per cell, " " being empty."""
+    return "".join("X" if x >> i & 1 else "O" if o >> i & 1 else " "
+                   for i in range(cells))
+
+
+# The solved standard game, filled in by solve(): for every position
+# reachable by legal play that is not over, keyed by X's cells | O's cells << 9, the
+# outcome for the side to move with perfect play (1 win, 0 draw, -1 loss)
+# and the positions (1~9) of the moves reaching it
+SOLVED = {}
+
+
+def solve():
+    """Solves every reachable position, once, so that the best moves of any
+    position are a single lookup. Returns the table."""
+    if not SOLVED:
+        __solve(0, 0)
+    return SOLVED
+
+
+def __solve(x, o):
+    """Solves a position that is not over and returns its outcome for the
+    side to move."""
+    key = x | o << CELLS
+    if key in SOLVED:
+        return SOLVED[key][0]
+    x_to_move = bin(x).count("1") == bin(o).count("1")
+    best, moves = -2, []
+    for i in range(CELLS):
+        cell = 1 << i
+        if (x | o) & cell:
+            continue
+        if WIN_TABLE[(x if x_to_move else o) | cell] is not None:
+            outcome = 1
+        elif x | o | cell == FULL:
+            outcome = 0
+        elif x_to_move:
+            outcome = -__solve(x | cell, o)
+        else:
+            outcome = -__solve(x, o | cell)
+        if outcome > best:
+            best, moves = outcome, [i + 1]
+        elif outcome == best:
+            moves.append(i + 1)
+    SOLVED[key] = (best, tuple(moves))
+    return best
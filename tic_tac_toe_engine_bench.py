@@ -0,0 +1,104 @@
+#! /usr/bin/python3
+
+# Import the time module to time the engines
+import time
+# Import the random module to generate the games played
+import random
+# Import command line arguments
+from sys import argv
+
+# Import the bitboard game engine
+from tic_tac_toe_engine import Board
+
+
+class ListBoard:
+    """ListBoard is the board that Game used before the bitboard engine: a
+    list of 9 symbols, checked for a win with a set per line."""
+
+    def __init__(self):
+        """Initializes an empty board."""
+        self.board_content = list("         ")
+
+    def place(self, role, position):
+        """Takes the position (1~9) for the role if it is empty."""
+        if self.board_content[position - 1] != " ":
+            return False
+        self.board_content[position - 1] = role
+        return True
+
+    def result(self, role):
+        """Checks if the role wins the game, the way check_winner did."""
+        s = self.board_content
+        for a, b, c in ((0, 1, 2), (3, 4, 5), (6, 7, 8), (0, 3, 6),
+                        (1, 4, 7), (2, 5, 8), (0, 4, 8), (2, 4, 6)):
+            if len({s[a], s[b], s[c], role}) == 1:
+                return 1, str(a) + str(b) + str(c)
+        if " " not in s:
+            return 0, ""
+        return -1, ""
+
+    def masks(self):
+        """Returns the board as it was sent on the wire."""
+        return "".join(self.board_content)
+
+
+def random_games(count, seed):
+    """Returns the move orders of the given number of random games."""
+    generator = random.Random(seed)
+    games = []
+    for i in range(count):
+        positions = list(range(1, 10))
+        generator.shuffle(positions)
+        games.append(positions)
+    return games
+
+
+def play(board_class, games):
+    """Plays the games on boards of the given class the way Game.move does,
+    encoding the board for both players before every move and once more at
+    the end. Returns the number of moves played."""
+    moves = 0
+    for positions in games:
+        board = board_class()
+        role = "X"
+        for position in positions:
+            board.masks()
+            board.masks()
+            board.place(role, position)
+            moves += 1
+            result, winning_path = board.result(role)
+            if result >= 0:
+                board.masks()
+                board.masks()
+                break
+            role = "O" if role == "X" else "X"
+    return moves
+
+
+def bench(board_class, games, repeat):
+    """Returns the best moves per second of playing the games."""
+    best = 0
+    for i in range(repeat):
+        start = time.perf_counter()
+        moves = play(board_class, games)
+        best = max(best, moves / (time.perf_counter() - start))
+    return best
+
+
+def main():
+    """Prints the moves per second of the list board and the bitboard"""
+    # The optional argument 1 is the number of games played per run
+    count = int(argv[1]) if len(argv) >= 2 else 100000
+    games = random_games(count, 0)
+    print("Playing " + str(count) + " random games, best of 5 runs")
+    before = bench(ListBoard, games, 5)
+    after = bench(Board, games, 5)
+    print("List board: %10.0f moves/s" % before)
+    print("Bitboard:   %10.0f moves/s" % after)
+    print("Speedup:    %10.2fx" % (after / before))
+
+
+if __name__ == "__main__":
+    # If this script is running as a standalone program,
+    # start the main program.
+    main()
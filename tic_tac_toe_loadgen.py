@@ -0,0 +1,104 @@
+#! /usr/bin/python3
+
+# Import the os module to name the bots after this process
+import os
+# Import the time module to time the load
+import time
+# Import multi-threading module, every bot runs on its own thread
+import threading
+# Import command line arguments
+from sys import argv
+
+# Import the headless bot client
+from tic_tac_toe_bot import BotClient
+
+
+def percentile(samples, fraction):
+    """Returns the given fraction (0~1) percentile of sorted samples"""
+    if not samples:
+        return 0
+    return samples[min(len(samples) - 1, int(fraction * len(samples)))]
+
+
+def run_bot(bot, partner, hosting, games, address, port_number, connected, started, errors):
+    """Connects the bot, waits for all the bots to be connected, then plays
+    the given number of games against its partner, hosting them or joining
+    them. Every game is followed by a chat message and a scoreboard
+    request."""
+    try:
+        bot.connect(address, port_number)
+    except:
+        errors.append(bot.player_name + " could not connect")
+    connected.wait()
+    started.wait()
+    try:
+        for i in range(games):
+            if hosting:
+                bot.create_game()
+            else:
+                # Keep refreshing the lobby until the partner's game is there
+                while True:
+                    game_id = bot.find_game(partner)
+                    if game_id is not None and bot.join_game(game_id) is not None:
+                        break
+                    time.sleep(0.001)
+            bot.chat("gg " + partner)
+            bot.updateStats(0)
+        bot.updateChat()
+        bot.exit()
+    except:
+        errors.append(bot.player_name + " failed after " + str(bot.games_played) + " games")
+
+
+def main():
+    """Runs bots in pairs against a server and reports its performance"""
+    # Arguments: address, port, number of bots (rounded up to an even
+    # number) and number of games played by each pair
+    address = argv[1] if len(argv) >= 2 else "127.0.0.1"
+    port_number = argv[2] if len(argv) >= 3 else input("Please enter the port: ")
+    count = int(argv[3]) if len(argv) >= 4 else 100
+    games = int(argv[4]) if len(argv) >= 5 else 10
+    count += count % 2
+
+    names = ["bot" + str(os.getpid()) + "-" + str(i) for i in range(count)]
+    bots = [BotClient(name, i) for i, name in enumerate(names)]
+    # Every connected bot waits on the first barrier, then on the second
+    # one so that playing starts once the connections have been timed
+    connected = threading.Barrier(count + 1)
+    started = threading.Barrier(count + 1)
+    errors = []
+    threads = []
+    for i, bot in enumerate(bots):
+        # Even bots host the games of the pair, odd bots join them
+        partner = names[i ^ 1]
+        threads.append(threading.Thread(target=run_bot, args=(
+            bot, partner, i % 2 == 0, games, address, port_number, connected, started, errors)))
+
+    print("Connecting " + str(count) + " bots to " + address + ":" + str(port_number))
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    connected.wait()
+    connect_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    started.wait()
+    for thread in threads:
+        thread.join()
+    play_time = time.perf_counter() - start
+
+    matches = sum(bot.games_played for bot in bots) // 2
+    move_times = sorted(t for bot in bots for t in bot.move_times)
+    print("Connected %d bots in %.2f s: %.0f connections/s" % (count, connect_time, count / connect_time))
+    print("Played %d matches in %.2f s: %.1f matches/s" % (matches, play_time, matches / play_time))
+    print("Move round trip over %d moves: p50 %.2f ms, p99 %.2f ms" % (
+        len(move_times), percentile(move_times, 0.5) * 1000, percentile(move_times, 0.99) * 1000))
+    print("Errors: " + str(len(errors)))
+    for error in errors[:10]:
+        print("  " + error)
+
+
+if __name__ == "__main__":
+    # If this script is running as a standalone program,
+    # start the main program.
+    main()
@@ -0,0 +1,203 @@
+#! /usr/bin/python3
+
+# Import the sys module to write to the standard output
+import sys
+# Import the os module to follow the processes forked
+import os
+# Import multi-threading module for the writer thread
+import threading
+# Import the time module to date the records and refill the rate limits
+import time
+# Import the queue between the threads logging and the writer thread
+from queue import SimpleQueue, Empty
+# Import the counter sampling the records of a category
+from itertools import count
+# Import the finalizers run when the process exits
+from multiprocessing.util import Finalize
+
+# The levels of the records, records below the level of the logger being
+# dropped as soon as they are logged
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+LEVELS = {"debug": DEBUG, "info": INFO, "warning": WARNING, "error": ERROR}
+LEVEL_NAMES = {level: name.upper() for name, level in LEVELS.items()}
+# The most records queued for the writer thread. Records logged faster than
+# the output takes them are dropped beyond it, and counted.
+MAX_QUEUED = 10000
+
+
+class Rule:
+    """Rule is the sampling and rate limit of the debug and info records of a
+    category."""
+
+    __slots__ = ("every", "seen", "rate", "burst", "tokens", "stamp", "dropped")
+
+    def __init__(self, every=1, rate=None, burst=None):
+        """Initializes the rule keeping one record in every given number, and
+        at most rate records a second, with bursts of up to burst records
+        (rate by default). A rate of None does not limit them."""
+        self.every = every
+        self.seen = count()
+        self.rate = rate
+        self.burst = burst if burst is not None else rate
+        self.tokens = self.burst
+        self.stamp = time.monotonic()
+        # The records dropped since the last one kept
+        self.dropped = 0
+
+    def admit(self):
+        """Returns the number of records dropped since the last one kept if
+        a record is to be kept, or None if it is dropped. The rule is not
+        locked, the threads logging at once may only keep a record more or
+        less than they should."""
+        if self.every > 1 and next(self.seen) % self.every:
+            self.dropped += 1
+            return None
+        if self.rate is not None:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+            self.stamp = now
+            if self.tokens < 1:
+                self.dropped += 1
+                return None
+            self.tokens -= 1
+        dropped, self.dropped = self.dropped, 0
+        return dropped
+
+
+class Logger:
+    """Logger writes leveled, structured records: a category, a message and
+    fields, one line each. Logging a record only checks its level and the
+    rule of its category and queues it, and the writer thread formats and
+    writes the records in batches, so that logging never waits on the
+    output."""
+
+    def __init__(self, level=INFO, out=None, **fields):
+        """Initializes the logger keeping the records of the given level and
+        above, written to the given output, the standard output by default,
+        with the given fields added to every record, and starts its writer
+        thread."""
+        self.level = level
+        self.out = sys.stdout if out is None else out
+        self.fields = fields
+        self.rules = {}
+        self.queue = SimpleQueue()
+        # The records dropped for being logged faster than they are written
+        self.lost = 0
+        self.closed = False
+        self.start()
+        # A process forked from this one, such as the broker of the worker
+        # processes, logs from a writer thread of its own
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self.__forked)
+
+    def start(self):
+        """Starts the writer thread"""
+        self.writer = threading.Thread(target=self.__write_loop, daemon=True)
+        self.writer.start()
+        # Write the records still queued when the process exits
+        Finalize(self, self.close, exitpriority=5)
+
+    def sample(self, category, every):
+        """Keeps one record in every given number of the category"""
+        self.__rule(category).every = every
+
+    def limit(self, category, rate, burst=None):
+        """Keeps at most rate records of the category a second, with bursts
+        of up to burst records"""
+        rule = self.__rule(category)
+        rule.rate = rate
+        rule.burst = rule.tokens = burst if burst is not None else rate
+
+    def log(self, level, category, message, **fields):
+        """Queues a record of the given level and category to be written.
+        Warnings and errors are never sampled nor rate limited."""
+        if level < self.level:
+            return
+        rule = self.rules.get(category) if level < WARNING else None
+        if rule is not None:
+            dropped = rule.admit()
+            if dropped is None:
+                return
+            if dropped:
+                fields["dropped"] = dropped
+        if self.queue.qsize() >= MAX_QUEUED:
+            self.lost += 1
+            return
+        self.queue.put((time.time(), level, category, message, fields))
+
+    def debug(self, category, message, **fields):
+        """Queues a debug record"""
+        self.log(DEBUG, category, message, **fields)
+
+    def info(self, category, message, **fields):
+        """Queues an info record"""
+        self.log(INFO, category, message, **fields)
+
+    def warning(self, category, message, **fields):
+        """Queues a warning record"""
+        self.log(WARNING, category, message, **fields)
+
+    def error(self, category, message, **fields):
+        """Queues an error record"""
+        self.log(ERROR, category, message, **fields)
+
+    def close(self):
+        """Writes the records still queued and stops the writer thread"""
+        self.closed = True
+        if self.writer.is_alive():
+            self.queue.put(None)
+            self.writer.join()
+
+    def format(self, record):
+        """Returns the line of a record"""
+        stamp, level, category, message, fields = record
+        parts = [time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(stamp)) + ".%03d" % (stamp % 1 * 1000),
+                 LEVEL_NAMES.get(level, str(level)), category, message]
+        for fields in (self.fields, fields):
+            for name, value in fields.items():
+                value = str(value)
+                if not value or " " in value or "=" in value or "\n" in value:
+                    value = repr(value)
+                parts.append(name + "=" + value)
+        return " ".join(parts) + "\n"
+
+    def __forked(self):
+        """(Private) Starts the writer thread again in a forked process,
+        unless the logger is closed. The records queued before the fork are
+        left to the parent process."""
+        if not self.closed:
+            self.queue = SimpleQueue()
+            self.start()
+
+    def __rule(self, category):
+        """(Private) Returns the rule of a category, adding it if need be."""
+        return self.rules.setdefault(category, Rule())
+
+    def __write_loop(self):
+        """(Private) Writes the queued records, the records queued while a
+        batch is written going into the next one."""
+        running = True
+        while running:
+            lines = []
+            item = self.queue.get()
+            while True:
+                if item is None:
+                    running = False
+                    break
+                lines.append(self.format(item))
+                try:
+                    item = self.queue.get_nowait()
+                except Empty:
+                    break
+            if self.lost:
+                lost, self.lost = self.lost, 0
+                lines.append(self.format((time.time(), WARNING, "log", "Records lost", {"count": lost})))
+            try:
+                self.out.write("".join(lines))
+                self.out.flush()
+            except:
+                # Nowhere is left to say so
+                pass
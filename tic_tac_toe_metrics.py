@@ -0,0 +1,187 @@
+#! /usr/bin/python3
+
+# Import multi-threading module to guard the metric values
+import threading
+# Import the binary search finding the bucket of an observation
+from bisect import bisect_left
+# Import the HTTP server the metrics are scraped from
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# The default histogram buckets, in seconds
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+           0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+# Every metric created, in the order they are exported
+METRICS = []
+
+
+class Metric:
+    """Metric is the base of the counters, gauges and histograms, exported
+    in the Prometheus text format. A metric with a label keeps a child metric
+    for each value of the label."""
+
+    kind = "untyped"
+
+    def __init__(self, name, help_text, label=None):
+        """Initializes the metric with its name, help text and label name.
+        Child metrics have no name."""
+        self.name = name
+        self.help = help_text
+        self.label = label
+        self.lock = threading.Lock()
+        self.children = {}
+        if name is not None:
+            METRICS.append(self)
+
+    def child(self):
+        """Returns a new child metric"""
+        return type(self)(None, None)
+
+    def labels(self, value):
+        """Returns the child metric for the given value of the label"""
+        try:
+            return self.children[value]
+        except KeyError:
+            with self.lock:
+                return self.children.setdefault(value, self.child())
+
+    def render(self):
+        """Returns the lines exporting the metric"""
+        lines = ["# HELP " + self.name + " " + self.help,
+                 "# TYPE " + self.name + " " + self.kind]
+        if self.label is None:
+            lines += self.samples(self.name, "")
+        else:
+            for value, child in sorted(self.children.items()):
+                lines += child.samples(self.name, self.label + '="' + str(value) + '"')
+        return lines
+
+    def samples(self, name, labels):
+        """Returns the sample lines of the metric with the given labels"""
+        return [sample(name, labels, self.value)]
+
+
+def sample(name, labels, value):
+    """Returns a sample line"""
+    if labels:
+        return name + "{" + labels + "} " + str(value)
+    return name + " " + str(value)
+
+
+class Counter(Metric):
+    """Counter is a count that only goes up."""
+
+    kind = "counter"
+
+    def __init__(self, name, help_text, label=None):
+        Metric.__init__(self, name, help_text, label)
+        self.value = 0
+
+    def inc(self, amount=1):
+        """Adds to the count"""
+        with self.lock:
+            self.value += amount
+
+
+class Gauge(Metric):
+    """Gauge is a value that goes up and down, or a function read whenever
+    the metrics are scraped."""
+
+    kind = "gauge"
+
+    def __init__(self, name, help_text, label=None, function=None):
+        Metric.__init__(self, name, help_text, label)
+        self.value = 0
+        self.function = function
+
+    def set(self, value):
+        """Sets the value"""
+        self.value = value
+
+    def inc(self, amount=1):
+        """Adds to the value"""
+        with self.lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        """Subtracts from the value"""
+        with self.lock:
+            self.value -= amount
+
+    def samples(self, name, labels):
+        if self.function is not None:
+            return [sample(name, labels, self.function())]
+        return Metric.samples(self, name, labels)
+
+
+class Histogram(Metric):
+    """Histogram counts observations in buckets, along with their sum."""
+
+    kind = "histogram"
+
+    def __init__(self, name, help_text, label=None, buckets=BUCKETS):
+        Metric.__init__(self, name, help_text, label)
+        self.buckets = buckets
+        # The last count is for the observations above every bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def child(self):
+        return Histogram(None, None, buckets=self.buckets)
+
+    def observe(self, value):
+        """Records an observation"""
+        i = bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+    def samples(self, name, labels):
+        with self.lock:
+            counts = list(self.counts)
+            total, count = self.sum, self.count
+        lines = []
+        cumulative = 0
+        prefix = labels + "," if labels else ""
+        for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+            cumulative += bucket_count
+            lines.append(sample(name + "_bucket", prefix + 'le="' + str(bound) + '"', cumulative))
+        lines.append(sample(name + "_sum", labels, total))
+        lines.append(sample(name + "_count", labels, count))
+        return lines
+
+
+def render():
+    """Returns every metric in the Prometheus text format"""
+    lines = []
+    for metric in METRICS:
+        lines += metric.render()
+    return "\n".join(lines) + "\n"
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """MetricsHandler answers every GET request with the metrics."""
+
+    def do_GET(self):
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes are not logged
+        pass
+
+
+def serve(port_number, logger):
+    """Exports the metrics over HTTP on the given local port, from a
+    background thread, and returns the HTTP server. The port is logged to
+    the given logger."""
+    server = ThreadingHTTPServer(("127.0.0.1", int(port_number)), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info("server", "Exporting metrics", port=port_number)
+    return server
@@ -0,0 +1,217 @@
+#! /usr/bin/python3
+
+# Import the socket module for the sends that never block
+import socket
+# Import the selectors module to wait for the sockets to take more bytes
+import selectors
+# Import the select module to check a socket takes more bytes where sends
+# cannot be told not to block
+import select
+# Import multi-threading module for the writer thread
+import threading
+# Import the deque the queued bytes are kept in
+from collections import deque
+
+# The bytes queued for a connection from which it is congested, and to which
+# they must drain for it to no longer be, so that it does not flip with
+# every send
+HIGH_WATERMARK = 64 << 10
+LOW_WATERMARK = 16 << 10
+# The most bytes queued for a connection, as a multiple of its high
+# watermark. A client reading so slowly that more would be queued is dropped.
+LIMIT_FACTOR = 4
+# The flag of the sends that never block, which Windows lacks. There the
+# socket is checked to be writable before each send, of at most CHUNK_SIZE
+# bytes so that the send buffer takes it at once.
+DONTWAIT = getattr(socket, "MSG_DONTWAIT", 0)
+CHUNK_SIZE = 4096
+
+
+class QueueFull(ConnectionError):
+    """QueueFull is raised when a connection is dropped for having more
+    bytes queued than its limit."""
+    pass
+
+
+class Outbox:
+    """Outbox is the bounded queue of the bytes waiting to be sent on a
+    socket. Bytes are sent right away as far as the socket takes them without
+    blocking, and the rest is queued and sent by the writer thread once the
+    socket takes more, so that a client reading slowly never blocks the
+    thread sending to it."""
+
+    def __init__(self, sock, writer, high=HIGH_WATERMARK, low=LOW_WATERMARK, on_drained=None):
+        """Initializes the outbox of a socket, sent from by the given
+        OutboxWriter, congested between the given watermarks, in bytes. The
+        on_drained callback is called once it is no longer congested."""
+        self.sock = sock
+        self.writer = writer
+        self.high = high
+        self.low = low
+        self.limit = high * LIMIT_FACTOR
+        self.on_drained = on_drained
+        self.lock = threading.Lock()
+        # Notified when the outbox is no longer congested, is empty or is
+        # closed
+        self.drained = threading.Condition(self.lock)
+        self.queue = deque()
+        self.size = 0
+        self.congested = False
+        self.closed = False
+
+    def write(self, data):
+        """Sends the bytes, queuing what the socket does not take at once.
+        Raises QueueFull, dropping the connection, if more than the limit
+        would be queued, and OSError if the connection is lost."""
+        with self.lock:
+            if self.closed:
+                raise ConnectionError("Connection closed")
+            if self.size + len(data) > self.limit:
+                self.__close()
+                try:
+                    # Wake up whatever reads from the client
+                    self.sock.shutdown(socket.SHUT_RDWR)
+                except:
+                    pass
+                raise QueueFull("Client too slow")
+            if not self.queue:
+                data = data[self.__send(data):]
+                if not data:
+                    return
+                self.writer.watch(self)
+            self.queue.append(data)
+            self.size += len(data)
+            if self.size >= self.high:
+                self.congested = True
+
+    def flush(self):
+        """Sends as many of the queued bytes as the socket takes without
+        blocking, from the writer thread"""
+        with self.lock:
+            try:
+                while self.queue:
+                    data = self.queue[0]
+                    sent = self.__send(data)
+                    self.size -= sent
+                    if sent < len(data):
+                        self.queue[0] = data[sent:]
+                        break
+                    self.queue.popleft()
+            except OSError:
+                # The client thread finds out the connection is lost
+                self.__close()
+                return
+            drained = self.congested and self.size <= self.low
+            if drained:
+                self.congested = False
+            if not self.queue:
+                self.writer.unwatch(self)
+            if drained or not self.queue:
+                self.drained.notify_all()
+        if drained and self.on_drained is not None:
+            self.on_drained()
+
+    def wait_drained(self, timeout, empty=False):
+        """Waits up to the timeout, in seconds, until the outbox is no longer
+        congested, or is empty if asked to. Returns False if it is not, or
+        the outbox is closed."""
+        with self.lock:
+            self.drained.wait_for(lambda: self.closed or not (self.queue if empty else self.congested),
+                                  timeout)
+            return not self.closed and not (self.queue if empty else self.congested)
+
+    def close(self):
+        """Drops the bytes still queued, and stops sending"""
+        with self.lock:
+            self.__close()
+
+    def __send(self, data):
+        """(Private) Sends what the socket takes of the bytes without
+        blocking, and returns the number of bytes sent."""
+        if DONTWAIT:
+            try:
+                return self.sock.send(data, DONTWAIT)
+            except BlockingIOError:
+                return 0
+        data = memoryview(data)
+        sent = 0
+        while sent < len(data) and select.select([], [self.sock], [], 0)[1]:
+            sent += self.sock.send(data[sent:sent + CHUNK_SIZE])
+        return sent
+
+    def __close(self):
+        """(Private) Closes the outbox, with the lock held."""
+        self.closed = True
+        self.queue.clear()
+        self.size = 0
+        self.writer.unwatch(self)
+        self.drained.notify_all()
+
+
+class OutboxWriter:
+    """OutboxWriter sends the bytes queued in the outboxes of a process,
+    from a thread of its own, as soon as their sockets take more. Only the
+    outboxes with bytes queued are watched, so clients keeping up cost it
+    nothing."""
+
+    def __init__(self):
+        """Initializes the writer, watching no outbox."""
+        self.lock = threading.Lock()
+        self.watched = set()
+        # Wakes up the writer thread when an outbox is watched
+        self.wake_reader, self.wake_writer = socket.socketpair()
+        self.wake_reader.setblocking(False)
+        self.wake_writer.setblocking(False)
+        self.thread = None
+
+    def start(self):
+        """Starts the writer thread"""
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.__write_loop, daemon=True)
+            self.thread.start()
+
+    def watch(self, outbox):
+        """Sends the bytes queued in the outbox once its socket takes more"""
+        with self.lock:
+            self.watched.add(outbox)
+        try:
+            self.wake_writer.send(b"\0")
+        except BlockingIOError:
+            # The writer thread has yet to read the earlier wake ups
+            pass
+
+    def unwatch(self, outbox):
+        """Stops watching the outbox"""
+        with self.lock:
+            self.watched.discard(outbox)
+
+    def __write_loop(self):
+        """(Private) Flushes the watched outboxes whose sockets take more
+        bytes."""
+        selector = selectors.DefaultSelector()
+        selector.register(self.wake_reader, selectors.EVENT_READ)
+        registered = set()
+        while True:
+            with self.lock:
+                watched = set(self.watched)
+            # The sockets of the outboxes no longer watched may be closed
+            # already, and their numbers reused
+            for outbox in registered - watched:
+                selector.unregister(outbox.sock)
+            registered &= watched
+            for outbox in watched - registered:
+                try:
+                    selector.register(outbox.sock, selectors.EVENT_WRITE, outbox)
+                    registered.add(outbox)
+                except (ValueError, KeyError, OSError):
+                    # The socket is closed
+                    outbox.close()
+            for key, events in selector.select():
+                if key.data is None:
+                    try:
+                        while self.wake_reader.recv(4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                else:
+                    key.data.flush()
@@ -0,0 +1,72 @@
+#! /usr/bin/python3
+
+# Import the socket module to pass connections between worker processes
+import socket
+# Import the os module to check that the platform can fork
+import os
+# Import pickle to send the details of a connection along with it
+import pickle
+# Import the multiprocessing module to run the broker and the workers
+import multiprocessing
+from multiprocessing.managers import BaseManager
+
+# Worker processes are forked, so they inherit the listening socket, the
+# handoff sockets and the proxies to the broker
+FORK = multiprocessing.get_context("fork") if hasattr(os, "fork") else None
+# The largest handoff message: the details of a player and of its game
+HANDOFF_SIZE = 65536
+
+
+def supported():
+    """Returns True if the platform can fork worker processes and pass
+    connections between them."""
+    return FORK is not None and hasattr(socket, "send_fds")
+
+
+def reuse_port_supported():
+    """Returns True if every worker process can bind its own socket to the
+    port, letting the kernel spread the connections between them."""
+    return hasattr(socket, "SO_REUSEPORT")
+
+
+class StateManager(BaseManager):
+    """StateManager runs the broker process holding the state shared by the
+    worker processes. Each shared object lives in the broker, and the workers
+    call its methods through a proxy."""
+
+
+class Handoff:
+    """Handoff passes client connections from one worker process to another,
+    over a datagram socket pair per worker created before the workers are
+    forked."""
+
+    def __init__(self, workers):
+        """Initializes a socket pair for each of the given number of workers,
+        the first socket receiving and the second sending."""
+        self.channels = [socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+                         for i in range(workers)]
+
+    def send(self, worker, fileno, details):
+        """Passes the connection with the given file descriptor, along with
+        its details, to the worker. The connection stays open in this
+        process until it is closed here."""
+        socket.send_fds(self.channels[worker][1], [pickle.dumps(details)], [fileno])
+
+    def receive(self, worker):
+        """Waits for a connection passed to the worker, and returns it along
+        with its details."""
+        data, fds, flags, address = socket.recv_fds(self.channels[worker][0], HANDOFF_SIZE, 1)
+        return socket.socket(fileno=fds[0]), pickle.loads(data)
+
+
+def start_workers(count, target, *args):
+    """Forks the given number of worker processes, each of them running
+    target(worker, handoff, *args) with its worker number, and returns
+    them."""
+    handoff = Handoff(count)
+    workers = []
+    for worker in range(count):
+        process = FORK.Process(target=target, args=(worker, handoff) + args, daemon=True)
+        process.start()
+        workers.append(process)
+    return workers
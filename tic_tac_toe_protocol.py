@@ -0,0 +1,348 @@
+#! /usr/bin/python3
+
+# Import the struct module to pack the message payloads
+import struct
+
+# The version of the protocol, the client sends it in its hello message. It
+# only changes from one release to the next.
+PROTOCOL_VERSION = 1
+
+# Every message is sent as a frame: a header made of the payload length and
+# the message type byte, followed by the payload
+FRAME_HEADER = struct.Struct("!IB")
+# The largest payload a frame may carry
+MAX_PAYLOAD = 1 << 20
+# How many bytes to ask the socket for at once, a single read may hold many
+# frames
+RECV_SIZE = 65536
+
+
+class ProtocolError(Exception):
+    """Raised when the other side breaks the protocol."""
+
+
+class Schema:
+    """Schema describes the payload of a message type: fixed fields packed
+    with a struct, optionally followed by a utf-8 text that takes up the rest
+    of the payload."""
+
+    def __init__(self, fmt="!", text=False):
+        """Initializes the schema with a struct format for the fixed fields."""
+        self.struct = struct.Struct(fmt)
+        self.text = text
+
+    def pack(self, values):
+        """Packs the values of a message into a payload."""
+        fixed = values[:-1] if self.text else values
+        # Strings in fixed fields are sent as ascii bytes
+        payload = self.struct.pack(*[v.encode() if isinstance(v, str) else v
+                                     for v in fixed])
+        if self.text:
+            payload += values[-1].encode()
+        return payload
+
+    def unpack(self, payload):
+        """Unpacks a payload into the values of a message."""
+        values = [v.decode() if isinstance(v, bytes) else v
+                  for v in self.struct.unpack_from(payload)]
+        if self.text:
+            values.append(bytes(payload[self.struct.size:]).decode())
+        elif len(payload) != self.struct.size:
+            raise ProtocolError("Unexpected payload size")
+        return tuple(values)
+
+
+class RecordSchema:
+    """RecordSchema describes a payload made of some header fields and a list
+    of records, each of them fixed fields packed with a struct followed by
+    some strings."""
+
+    # Record count and string length prefixes
+    COUNT = struct.Struct("!I")
+    LENGTH = struct.Struct("!H")
+
+    def __init__(self, fmt, strings, header="!"):
+        """Initializes the schema with a struct format for the fixed fields
+        and the number of strings of each record, and a struct format for the
+        header fields."""
+        self.struct = struct.Struct(fmt)
+        self.strings = strings
+        self.header = struct.Struct(header)
+
+    def pack(self, values):
+        """Packs the header fields followed by a list of records (tuples of
+        the fixed fields then the strings) into a payload."""
+        records = values[-1]
+        parts = [self.header.pack(*values[:-1]), self.COUNT.pack(len(records))]
+        fixed = len(records[0]) - self.strings if records else 0
+        for record in records:
+            parts.append(self.struct.pack(*record[:fixed]))
+            for string in record[fixed:]:
+                data = string.encode()
+                parts.append(self.LENGTH.pack(len(data)))
+                parts.append(data)
+        return b"".join(parts)
+
+    def unpack(self, payload, offset=0):
+        """Unpacks a payload, from the given offset, into the header fields
+        followed by a list of records."""
+        payload = memoryview(payload)
+        header = self.header.unpack_from(payload, offset)
+        offset += self.header.size
+        count, = self.COUNT.unpack_from(payload, offset)
+        offset += self.COUNT.size
+        records = []
+        for i in range(count):
+            record = list(self.struct.unpack_from(payload, offset))
+            offset += self.struct.size
+            for j in range(self.strings):
+                length, = self.LENGTH.unpack_from(payload, offset)
+                offset += self.LENGTH.size
+                record.append(bytes(payload[offset:offset + length]).decode())
+                offset += length
+            records.append(tuple(record))
+        return header + (records,)
+
+
+class BoardSchema:
+    """BoardSchema describes a board snapshot: some header fields followed by
+    the cells taken by X and by O as two bit masks of the same size, only as
+    many bytes as the cells taken need."""
+
+    def __init__(self, header):
+        """Initializes the schema with a struct format for the header
+        fields."""
+        self.header = struct.Struct(header)
+
+    def pack(self, values):
+        """Packs the header fields and the two masks into a payload."""
+        x, o = values[-2:]
+        size = (max(x.bit_length(), o.bit_length()) + 7) // 8
+        return self.header.pack(*values[:-2]) + x.to_bytes(size, "big") + o.to_bytes(size, "big")
+
+    def unpack(self, payload):
+        """Unpacks a payload into the header fields and the two masks."""
+        masks = payload[self.header.size:]
+        if len(masks) % 2:
+            raise ProtocolError("Unexpected payload size")
+        size = len(masks) // 2
+        return self.header.unpack_from(payload) + (int.from_bytes(masks[:size], "big"),
+                                                   int.from_bytes(masks[size:], "big"))
+
+
+class LobbySchema:
+    """LobbySchema describes a lobby update: the lobby version, whether the
+    update is a full snapshot, the GameIDs of the removed games and the added
+    or updated games as records."""
+
+    # Lobby version, full snapshot flag and removed game count
+    HEADER = struct.Struct("!IBI")
+    GAME_ID = struct.Struct("!I")
+
+    def __init__(self):
+        """Initializes the schema with the game record schema: GameID, player
+        1 ID, player 2 ID, board rows, columns and number in a row that wins,
+        player 1 name and player 2 name."""
+        self.records = RecordSchema("!IIIBBB", 2)
+
+    def pack(self, values):
+        """Packs a lobby update into a payload."""
+        version, full, removed, records = values
+        return (self.HEADER.pack(version, full, len(removed))
+                + b"".join(self.GAME_ID.pack(game_id) for game_id in removed)
+                + self.records.pack((records,)))
+
+    def unpack(self, payload):
+        """Unpacks a payload into a lobby update."""
+        version, full, count = self.HEADER.unpack_from(payload)
+        offset = self.HEADER.size
+        removed = []
+        for i in range(count):
+            removed.append(self.GAME_ID.unpack_from(payload, offset)[0])
+            offset += self.GAME_ID.size
+        records, = self.records.unpack(payload, offset)
+        return version, bool(full), removed, records
+
+
+# The schema of each message type. The type byte is the command type token
+# character used since the first version of the game
+SCHEMAS = {
+    # Client to server
+    # Hello: protocol version and player name
+    "H": Schema("!B", text=True),
+    # Resume the session of a game after losing the connection: protocol
+    # version, the number of messages of the game received, from the board
+    # snapshot on, and the session token
+    "k": Schema("!BI", text=True),
+    # Create a new game on a board of these rows and columns, won with this
+    # number in a row
+    "n": Schema("!BBB"),
+    # Join the game with this GameID
+    "j": Schema("!I"),
+    # Watch the game with this GameID
+    "w": Schema("!I"),
+    # Watch the replay of the game recorded with this GameID
+    "y": Schema("!I"),
+    # Play against a bot of the server, of this difficulty: 0 easy, 1
+    # medium, 2 hard
+    "b": Schema("!B"),
+    # Refresh the lobby with the changes since the last lobby version seen
+    "r": Schema("!I"),
+    # Subscribe to the lobby changes and chat messages after this lobby
+    # version and chat sequence number, pushed as they happen
+    "u": Schema("!II"),
+    # Get a page of at most this many scoreboard entries from this rank on
+    # (0 being the first)
+    "s": Schema("!IH"),
+    # View a page of at most this many chat messages after this sequence
+    # number
+    "v": Schema("!IH"),
+    # Send a chat message to everyone
+    ">": Schema(text=True),
+    # Exit
+    "e": Schema(),
+    # Heartbeat, sent while idle to keep the connection from being dropped
+    "h": Schema(),
+    # Confirm a step of the match info
+    "c": Schema("!B"),
+    # The position the player moves to, with the sequence number of the
+    # move, so that a move sent again after resuming a session is played
+    # once
+    "i": Schema("!IH"),
+    # Ask for a snapshot of the board of the game played, once the deltas
+    # received no longer follow each other
+    "z": Schema(),
+    # Quit, with the reason why
+    "q": Schema(text=True),
+
+    # Server to client
+    # The session token, sent after the hello and when a session is resumed
+    "K": Schema(text=True),
+    # Lobby update
+    "L": LobbySchema(),
+    # Scoreboard page: the number of players, then the rank (1 being the
+    # first), games won and games lost of the requesting player, then the
+    # games won, games lost and name of each player of the page
+    "S": RecordSchema("!II", 1, header="!IIII"),
+    # Chat page: the latest sequence number, then the sequence number, sender
+    # and text of each message
+    "M": RecordSchema("!I", 2, header="!I"),
+    # Lobby changes pushed to subscribed clients, as a lobby update
+    "U": LobbySchema(),
+    # Chat messages pushed to subscribed clients, as a chat page
+    "T": RecordSchema("!I", 2, header="!I"),
+    # Pushed to a subscribed client when the game it created is joined: the
+    # GameID and the name of the player joining
+    "G": Schema("!I", text=True),
+    # Result of joining a game: 1 joined, -1 full, -2 no such game
+    "J": Schema("!b"),
+    # Result of watching a game or a replay: 1 watching, -1 not started yet,
+    # -2 no such game. Spectators are then sent a board snapshot and the
+    # deltas
+    "W": Schema("!b"),
+    # Game over, sent to spectators: the winning role X or O, D for a draw,
+    # or - if the game was abandoned
+    "F": Schema("!1s"),
+    # The player ID sent with the match info
+    "A": Schema("!I"),
+    # The assigned role
+    "R": Schema("!1s"),
+    # The matched player's ID
+    "O": Schema("!I"),
+    # Board snapshot, sent when a game starts: the number of moves played,
+    # the board rows, columns and number in a row that wins, and the cells
+    # taken by X and by O as bit masks
+    "B": BoardSchema("!IBBB"),
+    # Board delta, sent to both players after every move: the move's
+    # sequence number (1 being the first), position and role
+    "D": Schema("!IH1s"),
+    # Turn or result: Y, N, D, W or L
+    "C": Schema("!1s"),
+    # Winning path: its first and last positions
+    "P": Schema("!HH"),
+    # Quit, with the reason why
+    "Q": Schema(text=True),
+}
+
+
+def encode(msg_type, *values):
+    """Returns the frame of a message with the given type and values."""
+    payload = SCHEMAS[msg_type].pack(values)
+    return FRAME_HEADER.pack(len(payload), ord(msg_type)) + payload
+
+
+def decode(msg_type, payload):
+    """Returns the values of a message with the given type and payload."""
+    try:
+        return SCHEMAS[msg_type].unpack(payload)
+    except KeyError:
+        raise ProtocolError("Unknown message type " + repr(msg_type))
+    except (struct.error, UnicodeDecodeError):
+        raise ProtocolError("Malformed " + repr(msg_type) + " message")
+
+
+def decode_hello(frame):
+    """Checks the frame a client starts with, a hello ("H") or the
+    resumption of a session ("k"), and returns its type and its values
+    following the protocol version."""
+    msg_type, payload = frame
+    if msg_type not in ("H", "k"):
+        raise ProtocolError("Expected a hello message")
+    values = decode(msg_type, payload)
+    if values[0] != PROTOCOL_VERSION:
+        raise ProtocolError("Unsupported protocol version " + str(values[0]))
+    return msg_type, values[1:]
+
+
+class FrameReader:
+    """FrameReader buffers the bytes received from a connection and splits
+    them into frames, so that a single read can yield many messages and a
+    message split over many reads is put back together."""
+
+    def __init__(self):
+        """Initializes the reader with an empty buffer."""
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        """Appends received bytes to the buffer."""
+        self.buffer += data
+
+    def next_frame(self):
+        """Returns the next complete frame in the buffer as a message type and
+        payload, or None if more bytes are needed."""
+        if len(self.buffer) < FRAME_HEADER.size:
+            return None
+        length, msg_type = FRAME_HEADER.unpack_from(self.buffer)
+        if length > MAX_PAYLOAD:
+            raise ProtocolError("Frame too large")
+        end = FRAME_HEADER.size + length
+        if len(self.buffer) < end:
+            return None
+        payload = bytes(self.buffer[FRAME_HEADER.size:end])
+        # Deleting from the front of a bytearray does not copy the rest
+        del self.buffer[:end]
+        return chr(msg_type), payload
+
+    def read_from(self, sock):
+        """Returns the next frame, receiving from a blocking socket until it
+        is complete."""
+        frame = self.next_frame()
+        while frame is None:
+            data = sock.recv(RECV_SIZE)
+            if not data:
+                raise ConnectionError("Connection closed")
+            self.feed(data)
+            frame = self.next_frame()
+        return frame
+
+    async def read_from_stream(self, stream_reader):
+        """Returns the next frame, reading from an asyncio stream until it is
+        complete."""
+        frame = self.next_frame()
+        while frame is None:
+            data = await stream_reader.read(RECV_SIZE)
+            if not data:
+                raise ConnectionError("Connection closed")
+            self.feed(data)
+            frame = self.next_frame()
+        return frame
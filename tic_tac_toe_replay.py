@@ -0,0 +1,319 @@
+#! /usr/bin/python3
+
+# Import the os module to list and size the log segments
+import os
+# Import the mmap module to read the segments without loading them
+import mmap
+# Import the struct module to pack the game records
+import struct
+# Import multi-threading module for the writer thread
+import threading
+# Import the time module to print the dates of the games
+import time
+# Import the queue between the game threads and the writer thread
+from queue import SimpleQueue
+# Import the array the record locations are indexed in
+from array import array
+# Import the finalizers run when the process exits
+from multiprocessing.util import Finalize
+# Import command line arguments
+from sys import argv
+
+# Every game is a record: a header, the names of the players X and O, then
+# each move as its position and the milliseconds since the previous move.
+# The header holds the record length, GameID, start and end times (seconds
+# since the epoch), result (X, O, D or - if abandoned), winning path as its
+# first and last positions, board rows, columns and number in a row that
+# wins, and the move count and name lengths
+HEADER = struct.Struct("!IIdd1sHHBBBHBB")
+MOVE = struct.Struct("!HH")
+# The start of the header: the record length and GameID
+RECORD_START = struct.Struct("!II")
+# A new segment file is started once the current one is this large
+SEGMENT_SIZE = 64 << 20
+
+
+class GameRecord:
+    """GameRecord is a finished game as kept in the replay log."""
+
+    __slots__ = ("game_id", "started", "ended", "result", "path", "dimensions", "player_x", "player_o",
+                 "moves")
+
+    def __init__(self, game_id, started, ended, result, path, dimensions, player_x, player_o, moves):
+        """Initializes the record with the GameID, start and end times, the
+        result, winning path as its first and last positions ((0, 0) if
+        none), the board rows, columns and number in a row that wins, the
+        names of players X and O and the moves as (position, milliseconds
+        since the previous move)."""
+        self.game_id = game_id
+        self.started = started
+        self.ended = ended
+        self.result = result
+        self.path = path
+        self.dimensions = dimensions
+        self.player_x = player_x
+        self.player_o = player_o
+        self.moves = moves
+
+    def encode(self):
+        """Returns the record as bytes"""
+        x = self.player_x.encode()[:255]
+        o = self.player_o.encode()[:255]
+        length = HEADER.size + len(x) + len(o) + MOVE.size * len(self.moves)
+        return b"".join([HEADER.pack(length, self.game_id, self.started, self.ended,
+                                     self.result.encode(), *self.path, *self.dimensions,
+                                     len(self.moves), len(x), len(o)), x, o]
+                         + [MOVE.pack(position, min(delay, 0xFFFF)) for position, delay in self.moves])
+
+    def __str__(self):
+        return "%d %s %dx%d, %d in a row, %s (X) vs %s (O): %s%s in %d moves" % (
+            self.game_id, time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.started)),
+            *self.dimensions, self.player_x, self.player_o,
+            {"X": "X wins", "O": "O wins", "D": "draw", "-": "abandoned"}.get(self.result, self.result),
+            " from %d to %d" % self.path if self.path[0] else "", len(self.moves))
+
+
+def segments(directory):
+    """Returns the paths of the log segments in the directory, oldest
+    first for each writer"""
+    try:
+        names = sorted(name for name in os.listdir(directory) if name.endswith(".log"))
+    except FileNotFoundError:
+        return []
+    return [os.path.join(directory, name) for name in names]
+
+
+def decode_record(data, offset):
+    """Returns the GameRecord at the offset of the data, or None if it is
+    cut short"""
+    if offset + HEADER.size > len(data):
+        return None
+    (length, record_id, started, ended, record_result, first, last,
+     rows, columns, k, count, x_length, o_length) = HEADER.unpack_from(data, offset)
+    if length < HEADER.size or offset + length > len(data):
+        return None
+    names = offset + HEADER.size
+    player_x = bytes(data[names:names + x_length]).decode()
+    player_o = bytes(data[names + x_length:names + x_length + o_length]).decode()
+    moves = list(MOVE.iter_unpack(data[names + x_length + o_length:offset + length]))
+    return GameRecord(record_id, started, ended, record_result.decode(),
+                      (first, last), (rows, columns, k), player_x, player_o, moves)
+
+
+class ReplayIndex:
+    """ReplayIndex keeps where the record of every GameID is in the segments
+    of a replay log, so that a game is read without scanning the log. The
+    locations are packed in an array indexed by GameID, the GameIDs being
+    handed out in order across the runs of the server."""
+
+    # The bits of a location holding the offset in the segment, the others
+    # holding the number of the segment in the index
+    OFFSET_BITS = 40
+
+    def __init__(self, directory):
+        """Indexes the records already in the log in the directory, reading
+        their lengths and GameIDs only."""
+        self.lock = threading.Lock()
+        # The paths of the segments, and their numbers in the index
+        self.paths = []
+        self.numbers = {}
+        # The location of every GameID, -1 if it has no record
+        self.locations = array("q")
+        for path in segments(directory):
+            if os.path.getsize(path) == 0:
+                continue
+            entries = []
+            with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                offset = 0
+                while offset + HEADER.size <= len(data):
+                    length, game_id = RECORD_START.unpack_from(data, offset)
+                    if length < HEADER.size or offset + length > len(data):
+                        # A record cut short by a crash ends the segment
+                        break
+                    entries.append((game_id, offset))
+                    offset += length
+            self.add(path, entries)
+
+    def add(self, path, entries):
+        """Indexes the records written to a segment, as (GameID, offset)
+        pairs. A GameID recorded more than once is found at the record
+        indexed last."""
+        with self.lock:
+            number = self.numbers.get(path)
+            if number is None:
+                number = self.numbers[path] = len(self.paths)
+                self.paths.append(path)
+            for game_id, offset in entries:
+                if game_id >= len(self.locations):
+                    self.locations.extend([-1] * (game_id + 1 - len(self.locations)))
+                self.locations[game_id] = number << self.OFFSET_BITS | offset
+
+    def find(self, game_id):
+        """Returns the path of the segment and the offset of the record of
+        the given GameID, or None"""
+        with self.lock:
+            if not 0 <= game_id < len(self.locations) or self.locations[game_id] < 0:
+                return None
+            location = self.locations[game_id]
+            return self.paths[location >> self.OFFSET_BITS], location & ((1 << self.OFFSET_BITS) - 1)
+
+    def last_id(self):
+        """Returns the highest GameID recorded, 0 if none"""
+        with self.lock:
+            return max(len(self.locations) - 1, 0)
+
+
+class ReplayLog:
+    """ReplayLog appends finished games to segment files in a directory.
+    Games are queued and written by a thread of its own, so recording a game
+    never waits on the disk."""
+
+    def __init__(self, directory, writer_name="games", index=None):
+        """Opens the log in the directory, creating it if needed. Each
+        process writing to the directory needs its own writer name. The
+        games written are added to the given ReplayIndex, shared by the
+        writers of the directory."""
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.writer_name = writer_name
+        self.index = index
+        self.queue = SimpleQueue()
+        self.writer = threading.Thread(target=self.__write_loop, daemon=True)
+        self.writer.start()
+        # Write the games still queued when the process exits
+        Finalize(self, self.close, exitpriority=10)
+
+    def record(self, game):
+        """Queues a GameRecord to be written"""
+        self.queue.put((game.game_id, game.encode()))
+
+    def find(self, game_id):
+        """Returns the game recorded with the given GameID, or None"""
+        location = self.index.find(game_id) if self.index is not None else None
+        if location is None:
+            return None
+        return ReplayReader(self.directory).read(*location)
+
+    def close(self):
+        """Writes the games still queued and stops the writer thread"""
+        if self.writer.is_alive():
+            self.queue.put(None)
+            self.writer.join()
+
+    def __segment(self):
+        """(Private) Opens a new segment of this writer, unless its latest
+        one is empty. A record cut short by a crash thus only ends the
+        segment it was written to."""
+        prefix = self.writer_name + "-"
+        mine = [path for path in segments(self.directory) if os.path.basename(path).startswith(prefix)]
+        number = int(mine[-1][-10:-4]) if mine else 0
+        if mine and os.path.getsize(mine[-1]) > 0:
+            number += 1
+        return open(os.path.join(self.directory, "%s%06d.log" % (prefix, number)), "ab")
+
+    def __write_loop(self):
+        """(Private) Appends the queued games, all the games queued at once
+        in a single write."""
+        segment = self.__segment()
+        while True:
+            items = [self.queue.get()]
+            while not self.queue.empty():
+                items.append(self.queue.get())
+            if items[-1] is None:
+                items.pop()
+                done = True
+            else:
+                done = False
+            offset = segment.tell()
+            entries = []
+            for game_id, record in items:
+                entries.append((game_id, offset))
+                offset += len(record)
+            segment.write(b"".join(record for game_id, record in items))
+            segment.flush()
+            if self.index is not None and entries:
+                self.index.add(segment.name, entries)
+            if segment.tell() >= SEGMENT_SIZE:
+                segment.close()
+                segment = self.__segment()
+            if done:
+                break
+        segment.close()
+
+
+class ReplayReader:
+    """ReplayReader streams the games of a replay log, memory-mapping one
+    segment at a time and only decoding the records that pass the filters."""
+
+    def __init__(self, directory):
+        """Initializes the reader of the log in the directory."""
+        self.directory = directory
+
+    def games(self, player=None, result=None, since=None, until=None, game_id=None):
+        """Yields the GameRecords of the games played by the given player,
+        with the given result, started between the given times (seconds since
+        the epoch) or with the given GameID"""
+        for path in segments(self.directory):
+            if os.path.getsize(path) == 0:
+                continue
+            with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                yield from self.__scan(data, player, result, since, until, game_id)
+
+    def __scan(self, data, player, result, since, until, game_id):
+        """(Private) Yields the records of a segment that pass the filters."""
+        result = result.encode() if result else None
+        offset = 0
+        while offset + HEADER.size <= len(data):
+            (length, record_id, started, ended, record_result, first, last,
+             rows, columns, k, count, x_length, o_length) = HEADER.unpack_from(data, offset)
+            if length < HEADER.size or offset + length > len(data):
+                # A record cut short by a crash ends the segment
+                break
+            record = offset
+            offset += length
+            # Check the header fields before decoding anything
+            if ((game_id is not None and record_id != game_id)
+                    or (result is not None and record_result != result)
+                    or (since is not None and started < since)
+                    or (until is not None and started >= until)):
+                continue
+            if player is not None:
+                names = record + HEADER.size
+                if player.encode() not in (bytes(data[names:names + x_length]),
+                                           bytes(data[names + x_length:names + x_length + o_length])):
+                    continue
+            yield decode_record(data, record)
+
+    def read(self, path, offset):
+        """Returns the game recorded at the offset of a segment, or None if
+        its record is cut short"""
+        with open(path, "rb") as f:
+            f.seek(offset)
+            start = f.read(RECORD_START.size)
+            if len(start) < RECORD_START.size:
+                return None
+            length, game_id = RECORD_START.unpack(start)
+            return decode_record(start + f.read(max(length - RECORD_START.size, 0)), 0)
+
+
+def main():
+    """Prints the games of a replay log, filtered by player, result and
+    dates"""
+    # Arguments: the log directory, then the optional filters player, result
+    # (X, O, D or -) and first and last dates (YYYY-MM-DD), "" for any
+    directory = argv[1] if len(argv) >= 2 else "tic_tac_toe_replays"
+    player, result, since, until = [value or None for value in (argv[2:6] + [""] * 4)[:4]]
+    since = time.mktime(time.strptime(since, "%Y-%m-%d")) if since else None
+    # The last date is included
+    until = time.mktime(time.strptime(until, "%Y-%m-%d")) + 86400 if until else None
+    count = 0
+    for game in ReplayReader(directory).games(player, result, since, until):
+        print(game)
+        count += 1
+    print(str(count) + " games")
+
+
+if __name__ == "__main__":
+    # If this script is running as a standalone program,
+    # start the main program.
+    main()
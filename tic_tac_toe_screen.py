@@ -0,0 +1,166 @@
+#! /usr/bin/python3
+
+# Import the sys module to write to the standard output
+import sys
+# Import the shutil module to get the size of the terminal
+import shutil
+# Import the os module to tell Windows apart
+import os
+
+# ANSI escape sequences: move the cursor home and clear the screen, move the
+# cursor to a row and column (1 being the first), and erase to the end of
+# the line or of the screen
+CLEAR = "\x1b[H\x1b[2J"
+MOVE = "\x1b[%d;%dH"
+ERASE_LINE = "\x1b[K"
+ERASE_BELOW = "\x1b[J"
+# The rows below a frame kept for a prompt and the line entered after it
+PROMPT_ROWS = 2
+
+
+def vt_supported(out):
+    """Returns True if the terminal of the output processes the ANSI escape
+    sequences, turning it on in the Windows consoles that have it"""
+    if os.name != "nt":
+        return True
+    try:
+        # Import the Windows console API
+        import ctypes
+        from msvcrt import get_osfhandle
+        kernel32 = ctypes.windll.kernel32
+        handle = get_osfhandle(out.fileno())
+        mode = ctypes.c_uint32()
+        if not kernel32.GetConsoleMode(handle, ctypes.byref(mode)):
+            return False
+        # ENABLE_VIRTUAL_TERMINAL_PROCESSING, which legacy consoles lack
+        return bool(kernel32.SetConsoleMode(handle, mode.value | 0x0004))
+    except:
+        return False
+
+
+class TrackedOutput:
+    """TrackedOutput stands in for the standard output, noting whenever
+    anything is printed to it, as that may scroll the frame drawn."""
+
+    def __init__(self, out):
+        """Initializes the output forwarding the writes to the given one."""
+        self.out = out
+        self.written = False
+
+    def write(self, text):
+        if text:
+            self.written = True
+        return self.out.write(text)
+
+    def __getattr__(self, name):
+        return getattr(self.out, name)
+
+
+class Screen:
+    """Screen draws frames of text on the terminal from this process, with
+    ANSI escape sequences. It keeps the last frame drawn and only redraws
+    the cells that changed since, in a single write per frame. A frame is
+    drawn on a cleared screen instead when anything else was printed since
+    the last one, or when it does not fit on the terminal along with a
+    prompt, as the terminal has then scrolled. Frames are written as plain
+    text when the output is not a terminal, or is a console that does not
+    process escape sequences."""
+
+    def __init__(self, out=None):
+        """Initializes the screen writing to the given output, the standard
+        output by default."""
+        self.out = sys.stdout if out is None else out
+        self.ansi = self.out.isatty() and vt_supported(self.out)
+        # What is printed to the standard output besides the frames is
+        # tracked, the frames being written to it directly
+        self.tracked = None
+        if self.ansi and self.out is sys.stdout:
+            if not isinstance(sys.stdout, TrackedOutput):
+                sys.stdout = TrackedOutput(sys.stdout)
+            self.tracked = sys.stdout
+            self.out = self.tracked.out
+        # The lines of the last frame drawn, None until a frame is drawn on
+        # a cleared screen
+        self.lines = None
+        # The text of the last frame drawn and the status line shown below
+        # it
+        self.text = None
+        self.status_line = ""
+
+    def clear(self):
+        """Forgets the last frame, so that the next one is drawn on a cleared
+        screen"""
+        self.lines = None
+
+    def draw(self, text, status=""):
+        """Draws a frame, with a status line below it if given. Anything
+        printed below the last frame, such as prompts, is erased, and the
+        cursor is left below the new frame."""
+        self.text = text
+        self.status_line = status
+        if status:
+            text += "\n" + status
+        lines = text.split("\n")
+        if not self.ansi:
+            data = text + "\n"
+        elif self.lines is None or self.__scrolled(lines):
+            data = CLEAR + text + "\n"
+        else:
+            data = self.__diff(self.lines, lines)
+        self.lines = lines
+        if self.tracked is not None:
+            self.tracked.written = False
+        self.out.write(data)
+        self.out.flush()
+
+    def status(self, text):
+        """Shows a status line below the last frame drawn, in place of the
+        last one, as part of the frame. It is written on a line of its own
+        when frames are written as plain text, or none is drawn yet."""
+        if self.ansi and self.text is not None:
+            self.draw(self.text, text)
+            return
+        self.status_line = text
+        self.out.write(text + "\n")
+        self.out.flush()
+
+    def prompt(self, text):
+        """Prints a prompt below the last frame, which the next frame drawn
+        erases"""
+        self.out.write(text)
+        self.out.flush()
+
+    def __scrolled(self, lines):
+        """(Private) Returns True if the terminal may have scrolled since the
+        last frame, or would while drawing the given one."""
+        if self.tracked is not None and self.tracked.written:
+            return True
+        return max(len(self.lines), len(lines)) + PROMPT_ROWS > shutil.get_terminal_size().lines
+
+    def __diff(self, old_lines, lines):
+        """(Private) Returns the escape sequences and text turning the old
+        frame into the new one."""
+        parts = []
+        for row, line in enumerate(lines, 1):
+            if row > len(old_lines):
+                # The row may hold a prompt printed below the old frame
+                parts.append(MOVE % (row, 1) + line + ERASE_LINE)
+                continue
+            old = old_lines[row - 1]
+            if line == old:
+                continue
+            # Skip the cells that are the same at the start of the line, and
+            # at its end if its length is the same
+            start = 0
+            while start < len(line) and start < len(old) and line[start] == old[start]:
+                start += 1
+            if len(line) == len(old):
+                end = len(line)
+                while line[end - 1] == old[end - 1]:
+                    end -= 1
+                parts.append(MOVE % (row, start + 1) + line[start:end])
+            else:
+                parts.append(MOVE % (row, start + 1) + line[start:] + ERASE_LINE)
+        # Erase the rest of the old frame and what was printed below it
+        parts.append(MOVE % (len(lines) + 1, 1) + ERASE_BELOW)
+        return "".join(parts)
@@ -2,13 +2,110 @@
 
 # Import the socket module
 import socket
+# Import the asyncio module for the single event loop server engine
+import asyncio
 # Import multi-threading module
 import threading
-# Import the time module
+# Import the time module to time the turns and lobby requests
 import time
-# Import command line arguments
-from sys import argv
-import pickle
+# Import the random module to pick the moves of the weaker bots
+import random
+# Import the secrets module to generate the session tokens
+import secrets
+# Import the deque used as the lobby change log
+from collections import deque
+# Import the queue feeding each spectator of the threaded engine
+from queue import SimpleQueue
+# Import the counter handing out player IDs
+from itertools import count
+# Import the binary search used to keep the scoreboard ranked
+from bisect import bisect_left, insort
+# Import the parser of the command line options
+import argparse
+# Import the framing and message codec shared with the client
+from tic_tac_toe_protocol import FrameReader, ProtocolError, encode, decode, decode_hello
+# Import the bitboard game engine
+from tic_tac_toe_engine import Board, NO_PATH, ROWS, COLUMNS, K, solve, supported
+# Import the worker processes, their broker and the connection handoff
+import tic_tac_toe_prefork as prefork
+# Import the metrics exported over HTTP
+import tic_tac_toe_metrics as metrics
+# Import the store persisting the scoreboard
+from tic_tac_toe_store import StatsStore
+# Import the log of the finished games
+from tic_tac_toe_replay import GameRecord, ReplayLog, ReplayIndex
+# Import the timer wheel dropping the idle connections
+from tic_tac_toe_timers import TimerWheel
+# Import the bounded queues of the bytes sent to the clients
+from tic_tac_toe_outbox import Outbox, OutboxWriter, QueueFull, HIGH_WATERMARK, LOW_WATERMARK, LIMIT_FACTOR
+# Import the structured logger writing from a thread of its own
+from tic_tac_toe_log import Logger, LEVELS
+
+# The file the scoreboard is kept in unless another one is given
+STATS_FILE = "tic_tac_toe_stats.db"
+# The directory the finished games are logged to unless another one is given
+REPLAY_DIRECTORY = "tic_tac_toe_replays"
+# The longest pause between two moves of a replay, in milliseconds
+REPLAY_DELAY = 1000
+# The bots played against on the server, by difficulty, and the chance of
+# each of their moves being a best move rather than a random one
+BOT_NAMES = ("Bot (easy)", "Bot (medium)", "Bot (hard)")
+BOT_SKILL = (0, 0.6, 1)
+# How often the worker processes check the lobby and the chat they share for
+# changes made by the other workers to push to their players, in seconds
+PUSH_INTERVAL = 0.05
+# How long the seat of a player losing its connection in the middle of a
+# game is kept for the client to resume its session, in seconds
+GRACE_PERIOD = 30
+# How long a connection may stay idle in each state before it is dropped, in
+# seconds: before saying hello, in the lobby and while hosting a game waiting
+# for a second player, where the heartbeats the clients send every 15
+# seconds keep it alive, and on its turn to move, where only the move does
+IDLE_TIMEOUTS = {"hello": 10, "lobby": 60, "host": 60, "turn": 120}
+# The level of the records logged unless another one is given, the records
+# of every lobby request being debug records
+LOG_LEVEL = "info"
+# The categories of records sampled, one record in every so many being
+# logged, and rate limited, to so many records a second
+LOG_SAMPLING = {"lobby": 10}
+LOG_RATE_LIMITS = {"connection": 100, "chat": 20, "game": 100}
+# How long a client reading too slowly is waited for to catch up before it
+# is dropped, in seconds
+DRAIN_TIMEOUT = 30
+
+# Histograms of the time taken by the turns, the time created games wait
+# for a second player and the time taken to answer lobby requests
+TURN_SECONDS = metrics.Histogram("ttt_turn_seconds", "Time from sending the board to a player to applying its move")
+MATCH_SECONDS = metrics.Histogram("ttt_time_to_match_seconds", "Time a created game waits for a second player")
+LOBBY_SECONDS = metrics.Histogram("ttt_lobby_request_seconds", "Time taken to answer a lobby request", label="type")
+# Counters of the connections accepted and lost
+CONNECTIONS = metrics.Counter("ttt_connections_total", "Connections accepted")
+DISCONNECTS = metrics.Counter("ttt_disconnects_total", "Connections lost while serving a player")
+RESUMES = metrics.Counter("ttt_resumes_total", "Sessions of games resumed on a new connection")
+TIMED_OUT = metrics.Counter("ttt_timeouts_total", "Connections dropped for being idle", label="state")
+SLOW_CLIENTS = metrics.Counter("ttt_slow_clients_total", "Pushes held back, spectators skipping moves and "
+                               "connections dropped for reading too slowly", label="action")
+# Gauges read when the metrics are scraped
+metrics.Gauge("ttt_connected_players", "Players connected to this process", function=lambda: players.size())
+metrics.Gauge("ttt_open_games", "Games waiting for a second player", function=lambda: lobby.counts()[0])
+metrics.Gauge("ttt_games_in_progress", "Games being played", function=lambda: lobby.counts()[1])
+metrics.Gauge("ttt_threads", "Threads of this process", function=threading.active_count)
+
+
+def drop(connection):
+    """Shuts a connection down, waking up whatever waits on it"""
+    try:
+        connection.shutdown(socket.SHUT_RDWR)
+    except:
+        pass
+
+
+def buffered_frames(buffered):
+    """Returns a frame reader holding the bytes received but not yet read
+    from a connection passed by another worker process"""
+    frames = FrameReader()
+    frames.feed(buffered)
+    return frames
 
 
 class TTTServer:
@@ -19,19 +116,23 @@ class TTTServer:
         # Create a TCP/IP socket
         self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
 
-    def bind(self, port_number):
+    def bind(self, port_number, reuse_port=False):
         """Binds the server with the designated port and start listening to
-        the binded address."""
+        the binded address. With reuse_port, other sockets may be bound to
+        the same port, the kernel spreading the connections between them."""
         while True:
             try:
+                if reuse_port:
+                    self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
                 # Bind to an address with the designated port
                 # The empty string "" is a symbolic name
                 # meaning all available interfaces
                 self.server_socket.bind(("", int(port_number)))
-                print("Reserved port " + str(port_number))
-                # Start listening to the binded address
-                self.server_socket.listen(1)
-                print("Listening to port " + str(port_number))
+                logger.debug("server", "Port reserved", port=port_number)
+                # Start listening to the binded address, with the largest
+                # backlog the system allows so bursts of clients are queued
+                self.server_socket.listen(socket.SOMAXCONN)
+                logger.info("server", "Listening", port=port_number)
                 # Break the while loop if no error is caught
                 break
             except:
@@ -52,237 +153,840 @@ class TTTServer:
 class TTTServerGame(TTTServer):
     """TTTServerGame deals with the game logic on the server side."""
 
+    # The lobby requests waiting on a game, a spectator stream or a replay,
+    # served by a method each engine waits in its own way
+    WAITING_REQUESTS = {"n": "create_game", "b": "play_bot", "j": "request_join",
+                        "w": "request_watch", "y": "watch_replay"}
+
     def __init__(self):
         """Initializes the server game object."""
         TTTServer.__init__(self)
+        # The classes used to play a matched game, and to play the bots
+        self.game_class = Game
+        self.bot_class = BotPlayer
+        # The number of this worker process, and the handoff passing players
+        # to the other workers, when running in worker processes
+        self.worker = 0
+        self.handoff = None
 
     def start(self):
         """Starts the server and let it accept clients."""
-        # Use a simple lock to synchronize access when matching players
-        self.lock_matching = threading.Lock()
+        self.start_handoff()
+        notifier.start(self.push)
+        timers.start()
+        outbox_writer.start()
         # Start the main loop
         self.__main_loop()
 
+    def push(self, player, data):
+        """Sends a player the updates pushed by the notifier thread"""
+        player.push(data)
+
+    def start_handoff(self):
+        """Starts taking in the players passed by the other worker
+        processes, if running in worker processes"""
+        if self.handoff is not None:
+            threading.Thread(target=self.__handoff_loop, daemon=True).start()
+
+    def __handoff_loop(self):
+        """(Private) Takes in the players passed by the other worker
+        processes."""
+        while True:
+            connection, details = self.handoff.receive(self.worker)
+            try:
+                self.adopt(connection, details)
+            except:
+                logger.error("handoff", "Failed to take in a player from another worker")
+                connection.close()
+
+    def adopt(self, connection, details):
+        """Takes in a player passed by another worker process to play or
+        watch a game hosted here, and keeps serving the player from then
+        on"""
+        if details[0] == "k":
+            # A client resuming the session of a player served here
+            msg_type, buffered, received, session = details
+            self.resume_session(connection, buffered_frames(buffered), received, session)
+            return
+        player_id, player_name, buffered, game, msg_type, subscription, session = details
+        player = Player(connection, player_name, buffered_frames(buffered), player_id, session)
+        player.subscribe(subscription)
+        players.attach(player, self.worker)
+        threading.Thread(target=self.__adopted_thread, args=(player, game, msg_type)).start()
+
+    def hand_off(self, player, game, msg_type):
+        """Passes a player that has claimed the second seat of ("j"), or
+        wants to watch ("w"), a game hosted on another worker process to
+        that worker, once what is queued for it has been sent. A client
+        not reading it in time is passed with its connection shut down, so
+        that the game it joined ends at once."""
+        if not player.await_drained(empty=True):
+            drop(player.connection)
+        self.pass_player(player, game, msg_type)
+
+    def pass_player(self, player, game, msg_type):
+        """Passes a player to the worker process hosting the game, which
+        reads from and writes to the connection from then on"""
+        logger.info("handoff", "Passing a player", player=player.id, to_worker=game.Worker)
+        self.handoff.send(game.Worker, player.fileno(),
+                          (player.id, player.player_name, bytes(player.frames.buffer), game, msg_type,
+                           player.subscription(), player.session))
+        # The connection is only closed in this process
+        player.moved = True
+        player.is_waiting = False
+
+    def hosted_elsewhere(self, game):
+        """Returns True if the game is played by the worker process of its
+        host, which is not this one"""
+        return game is not None and game.Worker != self.worker
+
+    def forget(self, player):
+        """Forgets a player that left, or that moved to another worker
+        process, keeping its name taken"""
+        if player.moved:
+            players.detach(player)
+        else:
+            players.unregister(player)
+
     def __main_loop(self):
         """(Private) The main loop."""
         # Loop to infinitely accept new clients
         while True:
             # Accept a connection from a client
-            print("Waiting for new client...")
             connection, client_address = self.server_socket.accept()
-            print("Received connection from " + str(client_address))
-
-            # 4096 can be any number, it's just a buffer
-            # Receive the player name and decode it
-            player_name = connection.recv(4096).decode()
-            print("We received a player name. It is:", player_name)
-
-            # It's important we append the name first, then create the player so that it has correct ID number...
-            player_names_list.append(player_name)
-
-            # Initialize a new Player object to store all the client's information, including name
-            new_player = Player(connection, player_name)
-            player_list.append(new_player)
+            logger.info("connection", "Connection received", address=client_address[0], port=client_address[1])
+            CONNECTIONS.inc()
+            # Send small messages right away rather than waiting for the
+            # previous ones to be acknowledged
+            connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
 
             try:
                 # Start a new thread to deal with this client
-                threading.Thread(target=self.__client_thread, args=(new_player,)).start()
+                threading.Thread(target=self.__client_thread, args=(connection,)).start()
             except:
-                print("Failed to create thread.")
-
-    def send_lobby(self, player):
-        """Send updated Lobby to client"""
-        data = pickle.dumps(game_list)
-        player.connection.send(data)
-
-    def send_stats(self, player):
-        """Send game stats to the client"""
-        print("Sending stats...")
-        stats = ""
-        for p in player_list:
-            stats += str(p.player_name) + " has won " + str(p.gamesWon) + " games and lost " + str(
-                p.gamesLost) + " games\n"
-        player.send(stats)
-
-    def process_lobby_input(self, player, lobby_input):
+                logger.error("connection", "Failed to create thread")
+
+    def send_lobby(self, player, version=0):
+        """Send the changes to the Lobby since the given version to client"""
+        update = lobby.changes_since(version)
+        player.lobby_version = update[0]
+        player.send("L", *update)
+
+    def send_stats(self, player, offset, limit):
+        """Send a page of the scoreboard and the rank of the player to the
+        client"""
+        logger.debug("lobby", "Sending stats", player=player.id)
+        rank, won, lost = scoreboard.rank(player.player_name)
+        player.send("S", scoreboard.size(), rank, won, lost, scoreboard.page(offset, limit))
+
+    def waiting_request(self, msg_type):
+        """Returns the method of the engine serving a lobby request that
+        waits on a game, a spectator stream or a replay, or None if the
+        request is answered at once"""
+        name = self.WAITING_REQUESTS.get(msg_type)
+        return getattr(self, name) if name is not None else None
+
+    def process_lobby_input(self, player, msg_type, values):
         """Processes lobby input from the client"""
-        global chatHistory
-        if lobby_input == 'c':
-            # Check for empty chat history
-            if len(chatHistory) == 0:
-                player.send(" ")
-            else:
-                player.send(chatHistory)
-        if lobby_input[0] == '>':
-            chatHistory += (player.player_name + ": " + lobby_input[1:] + "\n")
-            print("chat: " + lobby_input[1:])
-        if lobby_input == 'n':
-            # Create a new game with this client as player 1
-            self.create_game(player)
-
-        elif lobby_input == 's':
-            self.send_stats(player)
-
-        if lobby_input.isnumeric():
-            # Client wants to join an existing game
-            try:
-                gameFound = False
-                for game in game_list:
-                    if game.GameID != int(lobby_input):
-                        continue
-                    if game.Player2 == 'Waiting for player':
-                        player.send("1")
-                        gameFound = True
-                        self.join_game(player, game)
-                        player.is_waiting = True
-                        player.match.is_waiting = True
-                    else:
-                        player.send("-1")
-                if (not gameFound):
-                    player.send("-2")
-            except:
-                print("Client could not join game!")
-
-        if lobby_input == 'r':
-            self.send_lobby(player)
-        return
+        handler = self.waiting_request(msg_type)
+        if handler is not None:
+            handler(player, *values)
+        else:
+            self.answer_lobby_input(player, msg_type, values)
+
+    def answer_lobby_input(self, player, msg_type, values):
+        """Answers the lobby input from the client that waits on nothing"""
+        start = time.perf_counter()
+        if msg_type == "v":
+            # Send a page of the chat messages after the given sequence number
+            after, limit = values
+            player.send("M", *chat.read(after, limit))
+        elif msg_type == ">":
+            chat.post(player.player_name, values[0])
+            notifier.notify()
+            logger.info("chat", "Message posted", player=player.id, text=values[0])
+        elif msg_type == "s":
+            self.send_stats(player, *values)
+        elif msg_type == "r":
+            self.send_lobby(player, values[0])
+        elif msg_type == "u":
+            # Client wants the lobby changes and chat messages since the
+            # given ones pushed to it as they happen
+            player.subscribe(values)
+            notifier.notify()
+        # Games are timed by their turns, not as lobby requests
+        LOBBY_SECONDS.labels(msg_type).observe(time.perf_counter() - start)
+
+    def claim_seat(self, player, game_id):
+        """Atomically takes the second seat of the game with the given GameID
+        for this player, and sends the player the result. Returns the game
+        details if the seat was taken, or None."""
+        result, game = lobby.claim(game_id, player.id, player.player_name)
+        if result == 1:
+            MATCH_SECONDS.observe(time.monotonic() - game.Opened)
+            notifier.notify()
+        player.send("J", result)
+        return game if result == 1 else None
+
+    def release_host(self, player, gameDet):
+        """Lets the player that joined a game back into the lobby, and wakes
+        up the host of the game waiting in create_game"""
+        player.is_waiting = True
+        host = players.get(gameDet.Player1ID)
+        host.is_waiting = True
+        host.game_over.set()
+
+    def request_join(self, player, game_id):
+        """Client wants to join the game with the given GameID"""
+        try:
+            game = self.claim_seat(player, game_id)
+            if self.hosted_elsewhere(game):
+                self.hand_off(player, game, "j")
+            elif game is not None:
+                self.play_joined(player, game)
+        except:
+            logger.info("game", "Could not join game", player=player.id)
 
-    def create_game(self, player):
-        """Create a game with the other player"""
-        global game_count
+    def play_joined(self, player, game):
+        """Plays the game whose second seat the player has claimed, then
+        wakes up its host"""
+        try:
+            self.join_game(player, game)
+        finally:
+            self.release_host(player, game)
+
+    def request_watch(self, player, game_id):
+        """Client wants to watch the game with the given GameID"""
+        game = lobby.find(game_id)
+        if self.hosted_elsewhere(game):
+            self.hand_off(player, game, "w")
+        else:
+            self.watch_game(player, game_id)
+
+    def find_replay(self, game_id):
+        """Returns the game recorded in the replay log with the given GameID,
+        or None"""
+        if replays is None:
+            return None
+        return replays.find(game_id)
+
+    def replay_frames(self, player, game):
+        """Sends the player whether the game was recorded, and returns the
+        frames of the game as sent to spectators, each with the seconds to
+        wait before sending it"""
+        player.send("W", 1 if game else -2)
+        if game is None:
+            return []
+        frames = [(0, encode("B", 0, *game.dimensions, 0, 0))]
+        role = "X"
+        for seq, (position, delay) in enumerate(game.moves, 1):
+            frames.append((min(delay, REPLAY_DELAY) / 1000, encode("D", seq, position, role)))
+            role = "O" if role == "X" else "X"
+        frames.append((0, encode("F", game.result)))
+        return frames
+
+    def watch_replay(self, player, game_id):
+        """Sends the player the replay of the game recorded with the given
+        GameID, at the pace it was played"""
+        for delay, frame in self.replay_frames(player, self.find_replay(game_id)):
+            time.sleep(delay)
+            player.send_data(frame)
+
+    def subscribe_spectator(self, player, game_id, updates):
+        """Puts the updates of the game with the given GameID on the queue
+        of a spectator, and sends the player the result. Returns the
+        Broadcast of the game, or None if it cannot be watched."""
+        result, broadcast = broadcasts.subscribe(game_id, updates)
+        player.send("W", result)
+        return broadcast if result == 1 else None
+
+    def spectator_lagging(self, player):
+        """Returns True if a spectator falls behind, and is to skip the moves
+        until it has caught up, to then be sent the board as it is"""
+        if not player.congested():
+            return False
+        SLOW_CLIENTS.labels("spectator").inc()
+        return True
+
+    def watch_game(self, player, game_id):
+        """Sends the player the updates of a game being played until it is
+        over, from this thread, so that a slow spectator never holds up
+        the game"""
+        updates = SimpleQueue()
+        broadcast = self.subscribe_spectator(player, game_id, updates)
+        if broadcast is None:
+            return
+        try:
+            while True:
+                frame = updates.get()
+                if frame is None:
+                    break
+                if self.spectator_lagging(player):
+                    if not player.await_drained():
+                        player.drop()
+                        break
+                    broadcast.catch_up(updates)
+                    continue
+                player.send_data(frame)
+        finally:
+            broadcast.unsubscribe(updates)
+
+    def open_game(self, player, rows=ROWS, columns=COLUMNS, k=K, bot=None):
+        """Lists a new game with this client as player 1 on a board of the
+        given rows and columns, won with k in a row, and the bot as player 2
+        if given, and returns its game details"""
+        if not supported(rows, columns, k):
+            player.send("Q", "Games cannot be played on that board.")
+            raise ProtocolError("Unsupported board")
         # Create a new game with this client as player 1
-        print(str(player.player_name) + " just created a new game. Waiting for other player...")
-        game_count += 1
+        if bot is None:
+            logger.info("game", "Game created", player=player.id, rows=rows, columns=columns, k=k)
         game1 = gameDetails()
-        game1.GameID = game_count
         game1.Player1 = player.player_name
         game1.Player1ID = player.id
+        game1.Rows, game1.Columns, game1.K = rows, columns, k
+        if bot is not None:
+            game1.Player2 = bot.player_name
+            game1.Player2ID = bot.id
+        game1.Worker = self.worker
+        game1.Opened = time.monotonic()
         player.is_waiting = False
 
-        game_list.append(game1)
+        # The lobby may live in the broker process, so the GameID is only
+        # set on its copy of the game
+        game1.GameID = lobby.add(game1, bot is None)
+        notifier.notify()
+        return game1
+
+    def host_game(self, player, rows, columns, k):
+        """Lists a new game hosted by the player, waiting for a second
+        player, and returns its game details. The heartbeats of the client
+        keep it waiting."""
+        player.game_over.clear()
+        game1 = self.open_game(player, rows, columns, k)
+        player.watch("host")
+        return game1
+
+    def withdraw_game(self, game1):
+        """Withdraws a game whose host was lost while waiting, unless the
+        game was joined just then and is over once the host finds out.
+        Returns True if the game was withdrawn."""
+        if not lobby.withdraw(game1.GameID):
+            return False
+        broadcasts.unlist(game1)
+        return True
+
+    def pair_bot(self, player, difficulty):
+        """Lists a game of the player against a new bot of the given
+        difficulty, on the standard board the bots have solved, and returns
+        the Game and its game details"""
+        logger.info("game", "Playing a bot", player=player.id, difficulty=difficulty)
+        bot = self.bot_class(difficulty)
+        game1 = self.open_game(player, bot=bot)
+        game = self.game_class(player, bot, game1.GameID, broadcasts.get(game1.GameID), Board())
+        player.role = "X"
+        bot.role = "O"
+        return game, game1
+
+    def end_bot_game(self, player, game1):
+        """Lets the player back into the lobby after a game against a bot"""
+        player.is_waiting = True
+        broadcasts.unlist(game1)
+
+    def play_bot(self, player, difficulty):
+        """Plays a game of the player against a bot of the server, on this
+        thread"""
+        game, game1 = self.pair_bot(player, difficulty)
+        try:
+            game.start()
+        except:
+            logger.info("game", "Game against a bot abandoned", player=player.id)
+        finally:
+            self.end_bot_game(player, game1)
 
-        # Start Game
-        while True:
-            if player.is_waiting:
-                game_list.remove(game1)
-                return
-            else:
-                time.sleep(1)
+    def create_game(self, player, rows, columns, k):
+        """Create a game with the other player"""
+        game1 = self.host_game(player, rows, columns, k)
+        try:
+            # Read the heartbeats of the client until a second player joins
+            player.await_match()
+        except:
+            if self.withdraw_game(game1):
+                raise
+
+        # The joining player plays the game on its own thread, and wakes this
+        # one up once it is over, so a waiting host costs no CPU
+        player.game_over.wait()
+        broadcasts.unlist(game1)
+
+    def pair_players(self, player2, gameDet):
+        """Returns the Game between the two players of a game whose second
+        seat has been claimed"""
+        logger.info("game", "Joining game", player=player2.id, game=gameDet.GameID)
+        player1 = players.get(gameDet.Player1ID)
+        if player1.subscribed:
+            # Let the host know at once who joined, ahead of the match info
+            player1.push(encode("G", gameDet.GameID, player2.player_name))
+        board = Board(rows=gameDet.Rows, columns=gameDet.Columns, k=gameDet.K)
+        game = self.game_class(player1, player2, gameDet.GameID, broadcasts.get(gameDet.GameID), board)
+        player1.role = "X"
+        player2.role = "O"
+        return game
 
     def join_game(self, player2, gameDet):
         """Client wants join and existing game"""
-        print("Other player is joining game...")
         try:
-            gameDet.Player2 = player2.player_name
-            gameDet.Player2ID = player2.id
-            player1 = getPlayer(gameDet.Player1ID)
-            game = Game(getPlayer(gameDet.Player1ID), player2)
-            player1.role = "X"
-            player2.role = "O"
+            game = self.pair_players(player2, gameDet)
             game.start()
         except:
-            print("Player was unable to join game...")
+            logger.info("game", "Game abandoned", game=gameDet.GameID)
 
-    def __client_thread(self, player):
+    def __client_thread(self, connection):
         """(Private) This is the client thread."""
+        frames = FrameReader()
+        timer = timers.schedule(IDLE_TIMEOUTS["hello"], lambda: drop(connection))
+        try:
+            # Receive the hello message with the player name, or the
+            # resumption of a session
+            msg_type, values = decode_hello(frames.read_from(connection))
+        except ProtocolError as e:
+            connection.send(encode("Q", str(e)))
+            connection.close()
+            return
+        except:
+            logger.info("connection", "Disconnected before saying hello")
+            connection.close()
+            return
+        finally:
+            timers.cancel(timer)
+        if msg_type == "k":
+            self.resume_session(connection, frames, *values)
+            return
+
+        # Initialize a new Player object to store all the client's information, including name
+        player = Player(connection, values[0], frames)
+        if self.welcome(player):
+            self.__serve(player)
+
+    def welcome(self, player):
+        """Registers a player that said hello, and sends it its session token
+        and the lobby. Returns False, turning the client away, if its name
+        is already taken."""
+        logger.debug("connection", "Hello received", name=player.player_name)
+        if not players.register(player, self.worker):
+            player.send("Q", "The name " + player.player_name + " is already taken.")
+            player.close()
+            return False
+        scoreboard.add_player(player.player_name)
+        player.send("K", player.session)
+        self.send_lobby(player)
+        return True
+
+    def resume_session(self, connection, frames, received, session):
+        """Re-attaches a client resuming the session of a game on a new
+        connection, after receiving the given number of messages of the
+        game. The connection is passed to the worker process serving the
+        player if need be."""
+        if self.pass_session(connection.fileno(), frames, received, session):
+            connection.close()
+            return
+        player = players.find_session(session)
+        if player is None or not player.resume(connection, frames, received):
+            connection.send(encode("Q", "The session cannot be resumed."))
+            connection.close()
+            return
+        self.session_resumed(player)
+
+    def pass_session(self, fileno, frames, received, session):
+        """Passes the connection of a client resuming the session of a player
+        served by another worker process to that worker. Returns True if it
+        was passed, and is to be closed in this process."""
+        worker = players.directory.session_worker(session)
+        if worker is None or worker == self.worker:
+            return False
+        logger.info("handoff", "Passing a resumed session", to_worker=worker)
+        self.handoff.send(worker, fileno, ("k", bytes(frames.buffer), received, session))
+        return True
+
+    def session_resumed(self, player):
+        """Counts a session resumed"""
+        RESUMES.inc()
+        logger.info("connection", "Session resumed", player=player.id)
+
+    def __adopted_thread(self, player, game, msg_type):
+        """(Private) This is the thread of a client passed by another worker
+        process."""
+        if msg_type == "j":
+            self.play_joined(player, game)
+        else:
+            self.watch_game(player, game.GameID)
+        self.__serve(player)
+
+    def await_request(self, player):
+        """Starts timing a player idle in the lobby, before waiting for its
+        next request"""
+        logger.debug("lobby", "Waiting for input", player=player.id)
+        player.watch("lobby")
+
+    def lobby_request(self, player, msg_type):
+        """Takes a lobby request received from the player, every request
+        timing what it waits on itself. A player asking to exit leaves,
+        raising to finish its thread or coroutine."""
+        player.unwatch()
+        logger.debug("lobby", "Input received", player=player.id, type=msg_type)
+        # "E" means the client wants to exit
+        if msg_type == "e":
+            logger.info("connection", "Player exiting", player=player.id)
+            players.unregister(player)
+            player.close_thread()
+
+    def end_session(self, player):
+        """Cleans up after a player that left or moved to another worker
+        process, releasing its connection"""
+        player.unwatch()
+        self.forget(player)
+        player.close()
+
+    def __serve(self, player):
+        """(Private) Serves the lobby input of a client until it leaves."""
         # Wrap the whole client thread with a try and catch so that the
         # server would not be affected even if a client messes up
         try:
-            self.send_lobby(player)
             while player.is_waiting:
-                print("Waiting for input from: " + player.player_name)
-                incomingMessage = player.recvmessage()
-                print(player.player_name + " input:" + incomingMessage)
-                # "E" means the client wants to exit, close the thread
-                if incomingMessage == "e":
-                    # Client wants to Exit
-                    print("Player " + str(player.id) + " is exiting the game")
-                    player_names_list.remove(player.player_name)
-                    player_list.remove(player)
-
-                    # Kill the thread
-                    player.close_thread()
-                else:
-                    self.process_lobby_input(player, incomingMessage)
+                self.await_request(player)
+                msg_type, values = player.recvmessage()
+                self.lobby_request(player, msg_type)
+                self.process_lobby_input(player, msg_type, values)
         except:
-            print("Player " + str(player.id) + " disconnected")
+            logger.info("connection", "Player disconnected", player=player.id)
+        finally:
+            self.end_session(player)
 
 
 class Player:
     """Player class describes a client with connection to the server and
     as a player in the tic tac toe game."""
 
-    def __init__(self, connection, player_name):
-        """Initialize a player with its connection to the server"""
+    def __init__(self, connection, player_name, frames, player_id=None, session=None):
+        """Initialize a player with its connection to the server, and the
+        reader buffering the frames received from it. A player passed by
+        another worker process keeps its ID and session token."""
         # Generate a unique id for this player
-        self.id = len(player_list)
-        # Assign the corresponding connection
+        self.id = players.new_id() if player_id is None else player_id
+        # Assign the corresponding connection, and the queue of the bytes
+        # sent on it
         self.connection = connection
+        self.outbox = self.open_outbox(connection)
+        self.frames = frames
         # Assign a name to the player
         self.player_name = player_name
         # Set the player waiting status to True
         self.is_waiting = True
+        # Set once the player is passed to another worker process
+        self.moved = False
+        # The frames queued during a turn, written at once by flush
+        self.outgoing = []
+        # Set by the joining player when a game hosted by this player is over
+        self.game_over = threading.Event()
         self.match = None
-        self.gamesWon = 0
-        self.gamesLost = 0
-        print("Creating player name: " + str(player_name))
-        print("With ID number: " + str(self.id))
-
-    def send(self, msg):
+        # The game played, which answers the client asking for a snapshot of
+        # its board
+        self.game = None
+        # Whether the lobby changes and chat messages are pushed to the
+        # client, and the last lobby version and chat message it was sent
+        self.subscribed = False
+        self.lobby_version = 0
+        self.chat_seq = 0
+        # Keeps the frames logged in the order they are sent
+        self.send_lock = threading.Lock()
+        # The token the client resumes its session with after losing the
+        # connection, and the messages sent to it from the board snapshot of
+        # the game it plays on, until it is back in the lobby, sent again
+        # when it resumes
+        self.session = secrets.token_hex(16) if session is None else session
+        self.log = None
+        # The number of connections the client resumed its session on,
+        # notified when it resumes
+        self.generation = 0
+        # The generation of the last connection counted as lost
+        self.lost_generation = None
+        self.resumed = threading.Condition()
+        # Only one thread reads from the client at a time, a waiting host
+        # leaving the first frame that is not a heartbeat to its game
+        self.read_lock = threading.Lock()
+        self.unread = None
+        # The timer dropping the connection once idle for too long, the state
+        # it times, and whether every frame received starts it over
+        self.timer = None
+        self.state = None
+        self.restart = False
+        logger.info("connection", "Player created", player=self.id, name=player_name)
+
+    def send(self, msg_type, *values):
         """Sends a message to the client"""
+        self.send_data(encode(msg_type, *values))
+
+    def queue(self, msg_type, *values):
+        """Queues a message to the client, to be sent by the next flush"""
+        self.outgoing.append(encode(msg_type, *values))
+
+    def queue_data(self, data):
+        """Queues raw bytes to the client, to be sent by the next flush"""
+        self.outgoing.append(data)
+
+    def flush(self):
+        """Sends the queued messages to the client in a single write"""
+        if self.outgoing:
+            frames = self.outgoing
+            self.outgoing = []
+            self.write_frames(frames)
+
+    def fileno(self):
+        """Returns the file descriptor of the connection"""
+        return self.connection.fileno()
+
+    def send_data(self, data):
+        """Sends a raw frame to the client"""
+        self.write_frames([data])
+
+    def open_outbox(self, connection):
+        """Returns the outbox queuing the bytes sent on a connection"""
+        return Outbox(connection, outbox_writer, *watermarks, on_drained=notifier.notify)
+
+    def write(self, data):
+        """Sends raw bytes to the client without blocking, queuing what the
+        connection does not take at once. A client too slow to keep up is
+        dropped."""
+        try:
+            self.outbox.write(data)
+        except QueueFull:
+            SLOW_CLIENTS.labels("dropped").inc()
+            raise
+
+    def congested(self):
+        """Returns True if the client reads too slowly to be sent anything
+        that can wait"""
+        return self.outbox.congested
+
+    def await_drained(self, empty=False):
+        """Waits for a congested client to catch up, or for everything queued
+        to be sent if asked to. Returns False if it does not in time."""
+        return self.outbox.wait_drained(DRAIN_TIMEOUT, empty)
+
+    def close(self):
+        """Closes the connection, dropping the bytes still queued"""
+        self.outbox.close()
+        self.connection.close()
+
+    def drop(self):
+        """Shuts the connection down, waking up whatever waits on it"""
+        drop(self.connection)
+
+    def write_frames(self, frames):
+        """Sends raw frames to the client in a single write, logging them
+        while it plays a game"""
         try:
-            self.connection.send(msg.encode())
+            with self.send_lock:
+                if self.log is not None:
+                    self.log.extend(frames)
+                self.write(b"".join(frames))
         except:
-            # If any error occurred, the connection might be lost
-            self.__connection_lost()
+            # If any error occurred, the connection might be lost, unless
+            # the client may resume the game and be sent the frames again
+            if not self.resumable():
+                self.__connection_lost()
+
+    def resumable(self):
+        """Returns True if the client may resume its session after losing
+        the connection, which it may from the start of a game until it is
+        back in the lobby"""
+        return self.log is not None and grace_period > 0
+
+    def resume(self, connection, frames, received):
+        """Re-attaches the client on a new connection, and sends it again
+        the messages of the game sent after the given number it received.
+        Returns False if the session cannot be resumed."""
+        with self.send_lock:
+            if not self.resumable() or received > len(self.log):
+                return False
+            old_connection = self.connection
+            old_outbox = self.outbox
+            self.connection = connection
+            self.outbox = self.open_outbox(connection)
+            self.frames = frames
+            try:
+                self.write(b"".join([encode("K", self.session)] + self.log[received:]))
+            except:
+                # The client may resume again
+                pass
+        with self.resumed:
+            self.generation += 1
+            self.resumed.notify_all()
+        # Wake up the game waiting on the old connection
+        old_outbox.close()
+        drop(old_connection)
+        old_connection.close()
+        return True
+
+    def await_resume(self, generation):
+        """Waits up to the grace period for the client to resume its session
+        on a connection newer than the given generation, if it may. Returns
+        True if it has."""
+        if not self.resumable():
+            return False
+        with self.resumed:
+            self.resumed.wait_for(lambda: self.generation != generation or not self.resumable(),
+                                  grace_period)
+            return self.generation != generation
+
+    def watch(self, state, restart=True):
+        """Drops the connection unless the client leaves the given state
+        within its idle timeout, the timeout starting over with every frame
+        received if restarted"""
+        self.state = state
+        self.restart = restart
+        if self.timer is None:
+            self.timer = timers.schedule(IDLE_TIMEOUTS[state], self.expire)
+        else:
+            timers.reschedule(self.timer, IDLE_TIMEOUTS[state])
+
+    def unwatch(self):
+        """Stops timing the state of the client"""
+        self.restart = False
+        if self.timer is not None:
+            timers.cancel(self.timer)
+
+    def expire(self):
+        """Drops the connection of a client idle for longer than its state
+        allows, from the thread of the timer wheel. Whatever waits on the
+        client then fails and cleans up after it."""
+        logger.info("connection", "Player timed out", player=self.id, state=self.state)
+        TIMED_OUT.labels(self.state).inc()
+        # An idle client is not waited for to resume its session
+        self.log = None
+        with self.resumed:
+            self.resumed.notify_all()
+        drop(self.connection)
+
+    def push(self, data):
+        """Sends raw bytes pushed by the server to the client. A lost
+        connection is left to the client thread to find out."""
+        try:
+            self.write(data)
+        except:
+            pass
+
+    def subscribe(self, subscription):
+        """Pushes the lobby changes and chat messages after the given lobby
+        version and chat sequence number to the client, unless None"""
+        if subscription is not None:
+            self.lobby_version, self.chat_seq = subscription
+            self.subscribed = True
+
+    def subscription(self):
+        """Returns the last lobby version and chat sequence number pushed to
+        the client, or None if it is not subscribed"""
+        return (self.lobby_version, self.chat_seq) if self.subscribed else None
+
+    def read_frame(self):
+        """Receives the next frame from the client that is not a heartbeat.
+        A client losing the connection while it may resume its session is
+        waited for."""
+        with self.read_lock:
+            if self.unread is not None:
+                frame, self.unread = self.unread, None
+                return frame
+            return self.__read_frame()
+
+    def await_match(self):
+        """Reads the heartbeats of a host waiting for a second player, until
+        the client confirms the match info, leaving that frame to the game.
+        Raises ProtocolError if the client sends anything else, such as
+        quitting."""
+        with self.read_lock:
+            self.unread = self.__read_frame()
+            if self.unread[0] != "c":
+                raise ProtocolError("Unexpected message while hosting")
+
+    def __read_frame(self):
+        """(Private) Receives the next frame from the client that is not a
+        heartbeat, with the read lock held."""
+        while True:
+            generation = self.generation
+            try:
+                frame = self.frames.read_from(self.connection)
+            except OSError:
+                if not self.await_resume(generation):
+                    raise
+                continue
+            if self.restart:
+                timers.reschedule(self.timer, IDLE_TIMEOUTS[self.state])
+            # Heartbeats only keep the connection alive, and a snapshot asked
+            # for is sent right away
+            if frame[0] == "z":
+                self.resync()
+            elif frame[0] != "h":
+                return frame
+
+    def resync(self):
+        """Sends the client a snapshot of the board of the game it plays,
+        asked for once the deltas it received no longer follow each other.
+        Asked for after the game is over, none is sent."""
+        game = self.game
+        if game is not None:
+            self.send("B", *game.state())
 
     def recvmessage(self):
-        """Receives messages from the client"""
+        """Receives the next message from the client, as its command type
+        token and its values. Back in the lobby, the client can no longer
+        resume the last game it played."""
         try:
-            return self.connection.recv(4096).decode()
+            msg_type, payload = self.read_frame()
+            # A move sent again after resuming the session of a game that
+            # was over by then is not played
+            while msg_type == "i":
+                msg_type, payload = self.read_frame()
+            self.log = None
+            return msg_type, decode(msg_type, payload)
         except:
             self.__connection_lost()
 
-    def recv(self, size, expected_type):
-        """Receives a packet with specified size from the client and check
-        its integrity by comparing its command type token with the expected
-        one."""
+    def recv(self, expected_type):
+        """Receives the next message from the client and check its integrity
+        by comparing its command type token with the expected one."""
         try:
-            msg = self.connection.recv(size).decode()
-            # If received a quit signal from the client
-            if msg[0] == "q":
-                # Print why the quit signal
-                print(msg[1:])
-                # Connection lost
-                self.__connection_lost()
-            # If the message is not the expected type
-            elif msg[0] != expected_type:
-                # Connection lost
-                self.__connection_lost()
-            # If received an integer from the client
-            elif msg[0] == "i":
-                # Return the integer
-                return int(msg[1:])
-            # In other case
-            else:
-                # Return the message
-                return msg[1:]
-            # Simply return the raw message if anything unexpected happended
-            # because it shouldn't matter any more
-            return msg
+            frame = self.read_frame()
         except:
-            print("The message check failed, client probably disconnected...")
-            # If any error occurred, the connection might be lost
+            # A missing frame fails the check below
+            frame = None
+        return self.check_message(frame, expected_type)
+
+    def check_message(self, frame, expected_type):
+        """Checks the integrity of a received frame by comparing its command
+        type token with the expected one, and returns its value."""
+        try:
+            msg_type, payload = frame
+            values = decode(msg_type, payload)
+        except:
+            logger.debug("connection", "Message check failed", player=self.id)
+            msg_type = None
+        # If received a quit signal from the client
+        if msg_type == "q":
+            # Log why the quit signal
+            logger.info("connection", "Client quit", player=self.id, reason=values[0])
+        # If the message is not the expected type
+        if msg_type != expected_type:
+            # Connection lost
             self.__connection_lost()
-        return None
+        return values[0] if len(values) == 1 else values
 
     def close_thread(self):
         """Closes the client thread"""
         try:
-            self.send("Q" + "The other player has lost connection" +
+            self.send("Q", "The other player has lost connection" +
                       " with the server.\nGame over.")
         except:
-            print("Thread closing...")
+            logger.debug("connection", "Thread closing", player=self.id)
             pass
         # Raise an error so that the client thread can finish
         raise Exception
@@ -291,161 +995,723 @@ class Player:
         """Sends a the matched information to the client, which includes
         the assigned role and the matched player."""
         # Send to client the opponent id
-        self.send("A" + str(opponentID))
+        self.send("A", opponentID)
         # Waiting for client to confirm
-        if self.recv(2, "c") != "1":
+        if self.recv("c") != 1:
             self.__connection_lost()
         # Send to client the assigned role
-        self.send("R" + self.role)
+        self.send("R", self.role)
         # Waiting for client to confirm
-        if self.recv(2, "c") != "2":
+        if self.recv("c") != 2:
             self.__connection_lost()
         # Sent to client the matched player's ID
-        self.send("I" + str(self.match.id))
+        self.send("O", self.match.id)
         # Waiting for client to confirm
-        if self.recv(2, "c") != "3":
+        if self.recv("c") != 3:
             self.__connection_lost()
 
+    def connection_lost(self):
+        """Reports the connection as lost, for subclasses that detect it
+        themselves."""
+        self.__connection_lost()
+
     def __connection_lost(self):
         """(Private) This function will be called when the connection is lost."""
-        # This player has lost connection with the server
-        print("Player " + str(self.id) + " connection lost.")
-        # Tell the other player that the game is finished
-        try:
-            self.match.send("Q" + "The other player has lost connection" +
-                            " with the server.\nGame over.")
-        except:
-            print("Connection lost!")
-            pass
+        # The client can no longer resume its session
+        self.log = None
+        # Whatever serves the client may find the same connection lost more
+        # than once
+        if self.lost_generation != self.generation:
+            self.lost_generation = self.generation
+            DISCONNECTS.inc()
+            # This player has lost connection with the server
+            logger.info("connection", "Connection lost", player=self.id)
+            # Tell the other player of a game in progress that it is finished,
+            # a connection it has lost too being left to its own game to find
+            # out
+            if self.match is not None:
+                self.match.push(encode("Q", "The other player has lost connection" +
+                                       " with the server.\nGame over."))
         # Raise an error so that the client thread can finish
         raise Exception
 
 
-def getPlayer(playerID):
-    """Returns the player with their corresponding ID"""
-    for player in player_list:
-        if player.id == playerID:
-            return player
-    return None
+class BotPlayer:
+    """BotPlayer plays a game on the server in place of a second client. Its
+    moves are looked up in the solved game, so a bot costs no search and no
+    thread of its own."""
+
+    def __init__(self, difficulty):
+        """Initializes a bot of the given difficulty, 0 being the easiest"""
+        self.difficulty = min(difficulty, len(BOT_NAMES) - 1)
+        self.id = players.new_id()
+        self.player_name = BOT_NAMES[self.difficulty]
+        self.is_waiting = False
+        self.match = None
+        self.role = None
+        # The game the bot plays, whose board it moves on
+        self.game = None
+        # Bots are never sent anything to log
+        self.log = None
+
+    def send(self, msg_type, *values):
+        """Bots read the board of their game instead of being sent it"""
+        pass
+
+    def queue(self, msg_type, *values):
+        pass
+
+    def queue_data(self, data):
+        pass
+
+    def flush(self):
+        pass
+
+    def send_match_info(self, opponentID):
+        pass
+
+    def push(self, data):
+        pass
+
+    def watch(self, state, restart=True):
+        """Bots are never idle"""
+        pass
+
+    def unwatch(self):
+        pass
+
+    def recv(self, expected_type):
+        """Returns the bot's move, with its sequence number: a best move, or
+        a random one as often as its difficulty allows"""
+        board = self.game.board
+        if random.random() < BOT_SKILL[self.difficulty]:
+            return self.game.seq + 1, random.choice(board.best_moves())
+        return self.game.seq + 1, random.choice(board.empty())
+
+    def connection_lost(self):
+        """Bots never break the game, but fail it like a player would"""
+        raise Exception
+
+
+class AsyncBotPlayer(BotPlayer):
+    """AsyncBotPlayer is a BotPlayer playing an AsyncGame."""
+
+    async def send_match_info(self, opponentID):
+        pass
+
+    async def recv(self, expected_type):
+        return BotPlayer.recv(self, expected_type)
+
+
+class ChatLog:
+    """ChatLog keeps the latest chat messages in a ring buffer, each of them
+    with a sequence number, so that clients can page through the messages
+    after the last one they have seen."""
+
+    # The most messages sent in one page
+    PAGE_SIZE = 100
+    # The longest message kept
+    MAX_LENGTH = 500
+
+    def __init__(self, capacity=1000):
+        """Initializes an empty chat keeping the given number of messages."""
+        self.lock = threading.Lock()
+        self.capacity = capacity
+        # Message number seq is kept in slot seq % capacity
+        self.slots = [None] * capacity
+        self.latest = 0
+
+    def post(self, player_name, text):
+        """Adds a message, overwriting the oldest one once the buffer is
+        full, and returns its sequence number"""
+        with self.lock:
+            self.latest += 1
+            self.slots[self.latest % self.capacity] = (self.latest, player_name, text[:self.MAX_LENGTH])
+            return self.latest
+
+    def read(self, after, limit):
+        """Returns the latest sequence number and a page of at most limit
+        messages after the given sequence number, as (sequence number, player
+        name, text) tuples. Messages that have been overwritten are skipped."""
+        with self.lock:
+            first = max(after + 1, self.latest - self.capacity + 1, 1)
+            last = min(self.latest, first + min(limit, self.PAGE_SIZE) - 1)
+            return self.latest, [self.slots[seq % self.capacity] for seq in range(first, last + 1)]
+
+
+class Scoreboard:
+    """Scoreboard keeps the games won and lost by every player name, along
+    with a ranking kept sorted as results come in, so that a rank is found
+    with a binary search and the top of the scoreboard is only rebuilt when
+    a result changes it. It is the cache of the stats store, which every
+    change is written behind to."""
+
+    # The number of entries at the top of the scoreboard kept ready to send
+    TOP = 10
+    # The most entries sent in one page
+    PAGE_SIZE = 100
+
+    def __init__(self, stats_file=None):
+        """Initializes the scoreboard with the stats stored in the given
+        file, or an empty scoreboard kept in memory only."""
+        self.lock = threading.Lock()
+        self.store = StatsStore(stats_file, logger) if stats_file else None
+        # Games won and lost by player name
+        self.scores = self.store.load() if self.store else {}
+        # The (-won, lost, name) keys of every player, in rank order
+        self.ranking = sorted(self.__key(player_name) for player_name in self.scores)
+        # The cached top entries, None when they need to be rebuilt
+        self.top = None
+
+    def size(self):
+        """Returns the number of players on the scoreboard"""
+        return len(self.ranking)
+
+    def __key(self, player_name):
+        """(Private) Returns the ranking key of a player."""
+        won, lost = self.scores[player_name]
+        return -won, lost, player_name
+
+    def __set(self, player_name, won, lost):
+        """(Private) Sets the score of a player and moves it to its new rank,
+        with the lock held."""
+        if player_name in self.scores:
+            old = bisect_left(self.ranking, self.__key(player_name))
+            del self.ranking[old]
+        else:
+            old = len(self.ranking)
+        self.scores[player_name] = (won, lost)
+        key = self.__key(player_name)
+        insort(self.ranking, key)
+        if min(old, bisect_left(self.ranking, key)) < self.TOP:
+            self.top = None
+        if self.store:
+            self.store.save(player_name, won, lost)
+
+    def add_player(self, player_name):
+        """Adds a player with no games played, if it is not on the scoreboard
+        yet"""
+        with self.lock:
+            if player_name not in self.scores:
+                self.__set(player_name, 0, 0)
+
+    def record_result(self, winner_name, loser_name):
+        """Records a game won by one player against the other"""
+        with self.lock:
+            won, lost = self.scores.get(winner_name, (0, 0))
+            self.__set(winner_name, won + 1, lost)
+            won, lost = self.scores.get(loser_name, (0, 0))
+            self.__set(loser_name, won, lost + 1)
+
+    def rank(self, player_name):
+        """Returns the rank (1 being the first), games won and games lost of
+        a player, or zeros if it is not on the scoreboard"""
+        with self.lock:
+            if player_name not in self.scores:
+                return 0, 0, 0
+            won, lost = self.scores[player_name]
+            return bisect_left(self.ranking, self.__key(player_name)) + 1, won, lost
+
+    def page(self, offset, limit):
+        """Returns at most limit entries from the given rank on (0 being the
+        first), as (won, lost, player name) tuples"""
+        limit = min(limit, self.PAGE_SIZE)
+        with self.lock:
+            if offset == 0 and limit <= self.TOP:
+                if self.top is None:
+                    self.top = [(-won, lost, name) for won, lost, name in self.ranking[:self.TOP]]
+                return self.top[:limit]
+            return [(-won, lost, name) for won, lost, name in self.ranking[offset:offset + limit]]
+
+
+class PlayerDirectory:
+    """PlayerDirectory hands out player IDs that are never reused and keeps
+    the names taken and the worker process serving each session, which are
+    shared by the worker processes."""
+
+    def __init__(self):
+        """Initializes an empty directory."""
+        self.lock = threading.Lock()
+        self.ids = count()
+        self.names = set()
+        self.sessions = {}
+
+    def new_id(self):
+        """Returns a new unique player ID"""
+        with self.lock:
+            return next(self.ids)
+
+    def take_name(self, player_name):
+        """Takes the name. Returns False if it is already taken."""
+        with self.lock:
+            if player_name in self.names:
+                return False
+            self.names.add(player_name)
+            return True
+
+    def release_name(self, player_name):
+        """Releases the name"""
+        with self.lock:
+            self.names.discard(player_name)
+
+    def open_session(self, session, worker):
+        """Records the worker process serving the session with the given
+        token"""
+        with self.lock:
+            self.sessions[session] = worker
+
+    def session_worker(self, session):
+        """Returns the worker process serving the session with the given
+        token, or None if it is closed"""
+        return self.sessions.get(session)
+
+    def close_session(self, session):
+        """Closes the session with the given token"""
+        with self.lock:
+            self.sessions.pop(session, None)
+
+
+class PlayerRegistry:
+    """PlayerRegistry keeps the players connected to this process indexed
+    by ID and by name, with their IDs and names taken from a directory."""
+
+    def __init__(self, directory=None):
+        """Initializes an empty registry, with a directory of its own unless
+        one shared with other worker processes is given."""
+        self.lock = threading.Lock()
+        self.directory = PlayerDirectory() if directory is None else directory
+        self.by_id = {}
+        self.by_name = {}
+        self.by_session = {}
+
+    def new_id(self):
+        """Returns a new unique player ID"""
+        return self.directory.new_id()
+
+    def register(self, player, worker=0):
+        """Adds the player, served by the given worker process. Returns
+        False if the name is already taken."""
+        if not self.directory.take_name(player.player_name):
+            return False
+        self.attach(player, worker)
+        return True
+
+    def unregister(self, player):
+        """Removes the player, if it is registered, releasing its name and
+        closing its session"""
+        if self.detach(player):
+            self.directory.release_name(player.player_name)
+            self.directory.close_session(player.session)
+
+    def attach(self, player, worker=0):
+        """Adds a player whose name is already taken, passed by another
+        worker process, the given worker process serving its session from
+        then on"""
+        with self.lock:
+            self.by_id[player.id] = player
+            self.by_name[player.player_name] = player
+            self.by_session[player.session] = player
+        self.directory.open_session(player.session, worker)
+
+    def detach(self, player):
+        """Removes the player, if it is registered, keeping its name taken.
+        Returns True if it was registered."""
+        with self.lock:
+            if self.by_id.get(player.id) is not player:
+                return False
+            del self.by_id[player.id]
+            del self.by_name[player.player_name]
+            del self.by_session[player.session]
+            return True
+
+    def size(self):
+        """Returns the number of players registered"""
+        return len(self.by_id)
+
+    def get(self, player_id):
+        """Returns the player with the given ID, or None"""
+        return self.by_id.get(player_id)
+
+    def find(self, player_name):
+        """Returns the player with the given name, or None"""
+        return self.by_name.get(player_name)
+
+    def find_session(self, session):
+        """Returns the player whose session has the given token, or None"""
+        return self.by_session.get(session)
+
+    def snapshot(self):
+        """Returns a list of the registered players"""
+        with self.lock:
+            return list(self.by_id.values())
+
+
+class Notifier:
+    """Notifier pushes the lobby changes and the new chat messages to the
+    subscribed players of this process in the lobby, from a thread of its
+    own. Every update is encoded once for all the players that are up to
+    date, the others are caught up one by one. Changes made by this process
+    wake it up at once, those made by the other worker processes are found
+    every interval."""
+
+    def __init__(self, interval=None):
+        """Initializes the notifier, checking for changes every interval (in
+        seconds) if given, and only when woken up otherwise."""
+        self.interval = interval
+        self.wake = threading.Event()
+        # The lobby version and chat sequence number pushed last
+        self.lobby_version = 0
+        self.chat_seq = 0
+
+    def start(self, deliver):
+        """Starts the notifier thread, sending the updates of each player
+        with deliver(player, data)"""
+        self.deliver = deliver
+        threading.Thread(target=self.__push_loop, daemon=True).start()
+
+    def notify(self):
+        """Wakes up the notifier after a change to the lobby or the chat"""
+        self.wake.set()
+
+    def __push_loop(self):
+        """(Private) Pushes the updates whenever woken up."""
+        while True:
+            self.wake.wait(self.interval)
+            self.wake.clear()
+            try:
+                self.push()
+            except:
+                logger.error("lobby", "Failed to push the lobby updates")
+
+    def push(self):
+        """Pushes the updates since the last push to the subscribed players
+        in the lobby"""
+        update = lobby.changes_since(self.lobby_version)
+        lobby_frame = encode("U", *update)
+        latest, chat_frames = self.chat_frames(self.chat_seq)
+        for player in players.snapshot():
+            if not player.subscribed or not player.is_waiting:
+                continue
+            if player.congested():
+                # The player is caught up once it reads what it was sent
+                SLOW_CLIENTS.labels("push").inc()
+                continue
+            data = []
+            if player.lobby_version < update[0]:
+                if player.lobby_version == self.lobby_version:
+                    data.append(lobby_frame)
+                    player.lobby_version = update[0]
+                else:
+                    # The player missed some updates while playing
+                    caught_up = lobby.changes_since(player.lobby_version)
+                    data.append(encode("U", *caught_up))
+                    player.lobby_version = caught_up[0]
+            if player.chat_seq < latest:
+                if player.chat_seq == self.chat_seq:
+                    data += chat_frames
+                    player.chat_seq = latest
+                else:
+                    player.chat_seq, frames = self.chat_frames(player.chat_seq)
+                    data += frames
+            if data:
+                self.deliver(player, b"".join(data))
+        self.lobby_version = update[0]
+        self.chat_seq = latest
+
+    def chat_frames(self, after):
+        """Returns the sequence number of the last chat message sent and the
+        frames of the chat messages after the given one. Only the latest page
+        of them is sent, so that a player that fell behind is not sent more
+        than it can take, and pages back through the chat itself."""
+        latest, messages = chat.read(after, ChatLog.PAGE_SIZE)
+        if latest - after > ChatLog.PAGE_SIZE:
+            latest, messages = chat.read(latest - ChatLog.PAGE_SIZE, ChatLog.PAGE_SIZE)
+        if not messages:
+            return latest, []
+        return messages[-1][0], [encode("T", latest, messages)]
+
+
+class Broadcast:
+    """Broadcast fans the updates of a game out to its spectators. Every
+    update is encoded once and put on the queue of each spectator, whose
+    own thread or coroutine writes it, so the game never waits for them."""
+
+    def __init__(self):
+        """Initializes a broadcast with no spectators."""
+        self.lock = threading.Lock()
+        self.queues = []
+        # The number of moves played and the board as of the last update,
+        # None until the game starts
+        self.state = None
+        # The outcome sent to the spectators, None while the game goes on
+        self.outcome = None
+
+    def subscribe(self, updates):
+        """Adds a spectator's queue, catching it up with a snapshot of the
+        board if the game has started"""
+        with self.lock:
+            if self.state is not None:
+                updates.put_nowait(encode("B", *self.state))
+            if self.outcome is not None:
+                updates.put_nowait(encode("F", self.outcome))
+                updates.put_nowait(None)
+            self.queues.append(updates)
+
+    def catch_up(self, updates):
+        """Replaces the updates on a spectator's queue with a snapshot of the
+        board, for a spectator that fell behind"""
+        with self.lock:
+            while not updates.empty():
+                updates.get_nowait()
+            if self.state is not None:
+                updates.put_nowait(encode("B", *self.state))
+            if self.outcome is not None:
+                updates.put_nowait(encode("F", self.outcome))
+                updates.put_nowait(None)
+
+    def unsubscribe(self, updates):
+        """Removes a spectator's queue"""
+        with self.lock:
+            if updates in self.queues:
+                self.queues.remove(updates)
+
+    def publish(self, frame, state):
+        """Puts an update frame on every spectator's queue, along with the
+        state of the game after it. The first update of a game has no frame,
+        its spectators are sent a snapshot instead."""
+        with self.lock:
+            if frame is None:
+                frame = encode("B", *state)
+            self.state = state
+            for updates in self.queues:
+                updates.put_nowait(frame)
+
+    def finish(self, outcome):
+        """Tells every spectator the game is over, with its outcome, unless
+        they have been told already"""
+        with self.lock:
+            if self.outcome is not None:
+                return
+            self.outcome = outcome
+            frame = encode("F", outcome)
+            for updates in self.queues:
+                updates.put_nowait(frame)
+                updates.put_nowait(None)
+
+
+class BroadcastRegistry:
+    """BroadcastRegistry keeps the broadcast of each game hosted by this
+    process, by GameID."""
+
+    def __init__(self):
+        """Initializes an empty registry."""
+        # Synchronizes the broadcasts with the games listed in the lobby, so
+        # that no spectator waits on a game that is already gone
+        self.lock = threading.Lock()
+        self.broadcasts = {}
+
+    def get(self, game_id):
+        """Returns the broadcast of the game with the given GameID"""
+        with self.lock:
+            return self.broadcasts.setdefault(game_id, Broadcast())
+
+    def subscribe(self, game_id, updates):
+        """Adds a spectator's queue to the broadcast of a game. Returns 1 and
+        the broadcast if the game is being played, -1 and None if it is still
+        waiting for a second player, or -2 and None if it does not exist."""
+        with self.lock:
+            result = lobby.watch(game_id)
+            if result != 1:
+                return result, None
+            broadcast = self.broadcasts.setdefault(game_id, Broadcast())
+        broadcast.subscribe(updates)
+        return 1, broadcast
+
+    def unlist(self, game):
+        """Removes a game from the lobby and forgets its broadcast, telling
+        any spectator left that the game is over"""
+        with self.lock:
+            lobby.remove(game)
+            broadcast = self.broadcasts.pop(game.GameID, None)
+        notifier.notify()
+        if broadcast is not None:
+            broadcast.finish("-")
 
 
 class Game:
     """Game class describes a game with two different players."""
 
-    def __init__(self, player1, player2):
-        """Initializes the game class"""
+    def __init__(self, player1, player2, game_id, broadcast, board):
+        """Initializes the game class, with its GameID, the broadcast
+        sending its updates to the spectators and the empty board it is
+        played on"""
         player1.is_waiting = False
         player2.is_waiting = False
         self.player1 = player1
         self.player2 = player2
-        self.board_content = list("         ")
+        self.game_id = game_id
+        self.broadcast = broadcast
+        self.board = board
+        # The number of moves played, every move is sent as a delta
+        self.seq = 0
+        # The winning role, D for a draw, or - while the game is not over
+        self.outcome = "-"
+        self.winning_path = NO_PATH
+        # The moves played, as (position, milliseconds since the previous
+        # move), for the replay log
+        self.moves = []
+        self.started = self.last_move = time.time()
 
     def start(self):
         """Starts the game."""
         # Send both players the match info
-        print("Starting game...")
+        self.match_players()
+        try:
+            self.player1.send_match_info(self.player2.id)
+            self.player2.send_match_info(self.player1.id)
+
+            logger.info("game", "Players matched", game=self.game_id, x=self.player1.id, o=self.player2.id)
+            self.snapshot(self.player1)
+            self.snapshot(self.player2)
+            self.broadcast.publish(None, self.state())
+
+            try:
+                while True:
+                    # Player 1 move
+                    if self.move(self.player1, self.player2):
+                        return
+                    # Player 2 move
+                    if self.move(self.player2, self.player1):
+                        return
+            finally:
+                # Tell the spectators the game is over, even if abandoned
+                self.broadcast.finish(self.outcome)
+                self.record()
+        finally:
+            # A connection lost once the game is over is not told to the
+            # other player, who may be playing another game by then
+            self.unmatch_players()
+
+    def match_players(self):
+        """Makes the two players each other's match, playing this game."""
         self.player1.match = self.player2
         self.player2.match = self.player1
-        self.player1.send_match_info(self.player2.id)
-        self.player2.send_match_info(self.player1.id)
+        self.player1.game = self.player2.game = self
 
-        # Print the match info onto screen
-        print("Player " + str(self.player1.id) + " is matched with Player " + str(self.player2.id))
-
-        while True:
-            # Player 1 move
-            if self.move(self.player1, self.player2):
-                return
-            # Player 2 move
-            if self.move(self.player2, self.player1):
-                return
+    def unmatch_players(self):
+        """Leaves the two players without a match, once the game is over."""
+        self.player1.match = self.player2.match = None
+        self.player1.game = self.player2.game = None
 
     def move(self, moving_player, waiting_player):
         """Lets a player make a move."""
-        # Send both players the current board content
-        moving_player.send("B" + ("".join(self.board_content)))
-        waiting_player.send("B" + ("".join(self.board_content)))
+        self.begin_turn(moving_player, waiting_player)
+        # Receive the move from the moving player, skipping a move sent again
+        # after resuming a session that was already played
+        moving_player.watch("turn", restart=False)
+        seq, move = moving_player.recv("i")
+        while seq <= self.seq:
+            seq, move = moving_player.recv("i")
+        moving_player.unwatch()
+        return self.finish_turn(moving_player, waiting_player, move)
+
+    def record(self):
+        """Writes the game to the replay log"""
+        if replays is not None:
+            replays.record(GameRecord(self.game_id, self.started, time.time(), self.outcome,
+                                      self.winning_path, self.board.dimensions(),
+                                      self.player1.player_name, self.player2.player_name,
+                                      self.moves))
+
+    def state(self):
+        """Returns the number of moves played, the board dimensions and the
+        board masks"""
+        return (self.seq,) + self.board.dimensions() + self.board.masks()
+
+    def snapshot(self, player):
+        """Queues a snapshot of the board for a player, who applies the
+        deltas of the following moves to it. The messages sent to the player
+        are logged from then on, until it is back in the lobby, for its
+        client to resume the game. The player is only timed on its turns
+        from then on."""
+        player.log = []
+        player.unwatch()
+        player.queue("B", *self.state())
+
+    def begin_turn(self, moving_player, waiting_player):
+        """Tells both players whose turn it is, along with the outcome of the
+        last turn, in a single write to each player."""
+        self.turn_start = time.perf_counter()
         # Let the moving player move, Y stands for yes it's turn to move,
         # and N stands for no and waiting
-        moving_player.send("C" + "Y")
-        waiting_player.send("C" + "N")
-        # Receive the move from the moving player
-        move = int(moving_player.recv(2, "i"))
-        # Send the move to the waiting player
-        waiting_player.send("I" + str(move))
-        # Check if the position is empty
-        if self.board_content[move - 1] == " ":
-            # Write the it into the board
-            self.board_content[move - 1] = moving_player.role
-        else:
-            print("Player " + str(moving_player.id) +
-                  " is attempting to take a position that's already " +
-                  "been taken.")
+        moving_player.queue("C", "Y")
+        waiting_player.queue("C", "N")
+        self.flush()
+
+    def finish_turn(self, moving_player, waiting_player, move):
+        """Applies the move of the moving player and queues the outcome for
+        both players, only writing it if the game is over. Returns True if
+        the game is over."""
+        TURN_SECONDS.observe(time.perf_counter() - self.turn_start)
+        # Write the move into the board if the position is empty
+        if not self.board.place(moving_player.role, move):
+            logger.warning("game", "Position already taken", game=self.game_id, player=moving_player.id,
+                           position=move)
+            # The players' copies of the board would no longer match
+            moving_player.connection_lost()
+        now = time.time()
+        self.moves.append((move, int((now - self.last_move) * 1000)))
+        self.last_move = now
+        # Send the move to both players and the spectators as a delta of
+        # the board, encoded once
+        self.seq += 1
+        delta = encode("D", self.seq, move, moving_player.role)
+        moving_player.queue_data(delta)
+        waiting_player.queue_data(delta)
+        self.broadcast.publish(delta, self.state())
 
         # Check if this will result in a win
         result, winning_path = self.check_winner(moving_player)
         if result >= 0:
             # If there is a result
-            # Send back the latest board content
-            moving_player.send("B" + ("".join(self.board_content)))
-            waiting_player.send("B" + ("".join(self.board_content)))
-
             if result == 0:
                 # If this game ends with a draw
                 # Send the players the result
-                moving_player.send("C" + "D")
-                waiting_player.send("C" + "D")
-                print("Game between player " + str(self.player1.id) + " and player "
-                      + str(self.player2.id) + " ends with a draw.")
+                moving_player.queue("C", "D")
+                waiting_player.queue("C", "D")
+                self.outcome = "D"
+                logger.info("game", "Game drawn", game=self.game_id)
+                self.flush()
                 return True
             if result == 1:
                 # If this player wins the game
                 # Send the players the result
-                moving_player.send("C" + "W")
-                waiting_player.send("C" + "L")
-                moving_player.gamesWon += 1
-                waiting_player.gamesLost += 1
+                moving_player.queue("C", "W")
+                waiting_player.queue("C", "L")
+                self.outcome = moving_player.role
+                self.winning_path = winning_path
+                # Games against the bots are not ranked, so that wins cannot be
+                # farmed off the easy bot
+                if not isinstance(moving_player, BotPlayer) and not isinstance(waiting_player, BotPlayer):
+                    scoreboard.record_result(moving_player.player_name, waiting_player.player_name)
                 # Send the players the winning path
-                moving_player.send("P" + winning_path)
-                waiting_player.send("P" + winning_path)
-                print("Player " + str(self.player1.id) + " beats player "
-                      + str(self.player2.id) + " and finishes the game.")
+                moving_player.queue("P", *winning_path)
+                waiting_player.queue("P", *winning_path)
+                logger.info("game", "Game won", game=self.game_id, winner=moving_player.id,
+                            loser=waiting_player.id)
+                self.flush()
                 return True
             return False
 
+    def flush(self):
+        """Writes the messages queued for both players"""
+        self.player1.flush()
+        self.player2.flush()
+
     def check_winner(self, player):
         """Checks if the player wins the game. Returns 1 if wins,
         0 if it's a draw, -1 if there's no result yet."""
-        s = self.board_content
-
-        # Check columns
-        if len({s[0], s[1], s[2], player.role}) == 1:
-            return 1, "012"
-        if len({s[3], s[4], s[5], player.role}) == 1:
-            return 1, "345"
-        if len({s[6], s[7], s[8], player.role}) == 1:
-            return 1, "678"
-
-        # Check rows
-        if len({s[0], s[3], s[6], player.role}) == 1:
-            return 1, "036"
-        if len({s[1], s[4], s[7], player.role}) == 1:
-            return 1, "147"
-        if len({s[2], s[5], s[8], player.role}) == 1:
-            return 1, "258"
-
-        # Check diagonal
-        if len({s[0], s[4], s[8], player.role}) == 1:
-            return 1, "048"
-        if len({s[2], s[4], s[6], player.role}) == 1:
-            return 1, "246"
-
-        # If there's no empty position left, draw
-        if " " not in s:
-            return 0, ""
-
-        # The result cannot be determined yet
-        return -1, ""
+        return self.board.result(player.role)
 
 
 class gameDetails:
@@ -456,6 +1722,14 @@ class gameDetails:
         self.Player2 = 'Waiting for player'
         self.Player1ID = 0
         self.Player2ID = 1
+        # The worker process serving the host
+        self.Worker = 0
+        # When the game was listed, on a clock shared by the worker processes
+        self.Opened = 0
+        # The board rows and columns, and the number in a row that wins
+        self.Rows = ROWS
+        self.Columns = COLUMNS
+        self.K = K
 
     def __str__(self):
         return str(self.GameID) + ', ' + self.Player1 + ', ' + self.Player2
@@ -463,35 +1737,636 @@ class gameDetails:
     def __repr__(self):
         return str(self)
 
+    def record(self):
+        """Returns the game details as a lobby record"""
+        return (self.GameID, self.Player1ID, self.Player2ID, self.Rows, self.Columns, self.K,
+                self.Player1, self.Player2)
+
+
+class Lobby:
+    """Lobby keeps the listed games along with a version number, bumped on
+    every change, and a log of the latest changes, so that a client can be
+    sent only the games that changed since the version it last saw."""
+
+    def __init__(self, log_size=1024, game_count=0):
+        """Initializes an empty lobby keeping the given number of changes,
+        handing out the GameIDs after the given one."""
+        # Synchronizes changes to the lobby, including matching players
+        self.lock = threading.Lock()
+        # Open and in-progress games by GameID
+        self.games = {}
+        # The games still waiting for a second player, by GameID
+        self.waiting = {}
+        self.game_count = game_count
+        self.version = 0
+        # (version, GameID, record) of each change, record is None when the
+        # game was removed
+        self.changes = deque(maxlen=log_size)
+
+    def __log(self, game, record):
+        """(Private) Records a change to a game, with the lock held."""
+        self.version += 1
+        self.changes.append((self.version, game.GameID, record))
+
+    def add(self, game, waiting=True):
+        """Gives the game a new GameID, lists it, waiting for a second
+        player unless it already has one, and returns the GameID"""
+        with self.lock:
+            self.game_count += 1
+            game.GameID = self.game_count
+            self.games[game.GameID] = game
+            if waiting:
+                self.waiting[game.GameID] = game
+            self.__log(game, game.record())
+            return game.GameID
+
+    def claim(self, game_id, player_id, player_name):
+        """Atomically takes the second seat of a waiting game for the
+        player. Returns 1 and the game if the seat was taken, -1 and None
+        if the game is already full, or -2 and None if it does not exist."""
+        with self.lock:
+            game = self.waiting.pop(game_id, None)
+            if game is None:
+                return (-1 if game_id in self.games else -2), None
+            game.Player2 = player_name
+            game.Player2ID = player_id
+            self.__log(game, game.record())
+            return 1, game
+
+    def withdraw(self, game_id):
+        """Atomically stops a game waiting for a second player from being
+        joined. Returns False if it is no longer waiting."""
+        with self.lock:
+            return self.waiting.pop(game_id, None) is not None
+
+    def remove(self, game):
+        """Removes the game from the lobby"""
+        with self.lock:
+            del self.games[game.GameID]
+            self.waiting.pop(game.GameID, None)
+            self.__log(game, None)
+
+    def watch(self, game_id):
+        """Returns 1 if the game with the given GameID is being played, -1 if
+        it is waiting for a second player, or -2 if it does not exist"""
+        with self.lock:
+            if game_id not in self.games:
+                return -2
+            return -1 if game_id in self.waiting else 1
+
+    def counts(self):
+        """Returns the number of games waiting for a second player and the
+        number of games being played"""
+        with self.lock:
+            return len(self.waiting), len(self.games) - len(self.waiting)
+
+    def find(self, game_id):
+        """Returns the game with the given GameID, or None"""
+        return self.games.get(game_id)
+
+    def changes_since(self, version):
+        """Returns the lobby update for a client that last saw the given
+        version: the current version, whether it is a full snapshot, the
+        GameIDs of removed games and the records of added or updated games"""
+        with self.lock:
+            # Versions are consecutive, so this is the index of the first
+            # change the client has not seen
+            first = version + 1 - self.changes[0][0] if self.changes else 0
+            if version == 0 or version > self.version or first < 0:
+                # First connect, unknown version or a gap larger than the log
+                return self.version, True, [], [game.record() for game in self.games.values()]
+            removed = {}
+            updated = {}
+            for i in range(first, len(self.changes)):
+                change_version, game_id, record = self.changes[i]
+                if record is None:
+                    updated.pop(game_id, None)
+                    removed[game_id] = True
+                else:
+                    removed.pop(game_id, None)
+                    updated[game_id] = record
+            return self.version, False, list(removed), list(updated.values())
+
+
+class AsyncTTTServerGame(TTTServerGame):
+    """AsyncTTTServerGame runs the same game logic as TTTServerGame, but
+    serves every client as a coroutine on a single asyncio event loop
+    instead of with one thread per client. It runs in a single process, the
+    state shared by worker processes only being reached with blocking
+    calls."""
+
+    def __init__(self):
+        """Initializes the asyncio server game object."""
+        TTTServerGame.__init__(self)
+        # Matched games are played as coroutines too
+        self.game_class = AsyncGame
+        self.bot_class = AsyncBotPlayer
+
+    def start(self):
+        """Starts the event loop and let it accept clients."""
+        asyncio.run(self.__main_loop())
+
+    async def __main_loop(self):
+        """(Private) The main loop, accepting clients on the event loop."""
+        self.loop = asyncio.get_running_loop()
+        notifier.start(self.push)
+        timers.start()
+        server = await asyncio.start_server(self.__client_task,
+                                            sock=self.server_socket,
+                                            backlog=socket.SOMAXCONN)
+        async with server:
+            await server.serve_forever()
+
+    def push(self, player, data):
+        """Sends a player the updates pushed by the notifier thread, from
+        the event loop"""
+        self.loop.call_soon_threadsafe(player.push, data)
+
+    async def create_game(self, player, rows, columns, k):
+        """Create a game with the other player and wait, without holding a
+        thread, until the game is over"""
+        game1 = self.host_game(player, rows, columns, k)
+        try:
+            # Read the heartbeats of the client until a second player joins
+            await player.await_match()
+        except:
+            if self.withdraw_game(game1):
+                raise
+        await player.game_over.wait()
+        broadcasts.unlist(game1)
+
+    async def request_join(self, player, game_id):
+        """Client wants to join the game with the given GameID"""
+        try:
+            game = self.claim_seat(player, game_id)
+            if game is not None:
+                await self.play_joined(player, game)
+        except:
+            logger.info("game", "Could not join game", player=player.id)
+
+    async def play_joined(self, player, game):
+        """Plays the game whose second seat the player has claimed, then
+        wakes up its host"""
+        try:
+            await self.join_game(player, game)
+        finally:
+            self.release_host(player, game)
+
+    async def request_watch(self, player, game_id):
+        """Client wants to watch the game with the given GameID"""
+        await self.watch_game(player, game_id)
+
+    async def watch_replay(self, player, game_id):
+        """Sends the player the replay of the game recorded with the given
+        GameID, at the pace it was played, reading the log off the event
+        loop"""
+        game = await asyncio.get_running_loop().run_in_executor(None, self.find_replay, game_id)
+        for delay, frame in self.replay_frames(player, game):
+            await asyncio.sleep(delay)
+            player.send_data(frame)
+            await player.connection.drain()
+
+    async def watch_game(self, player, game_id):
+        """Sends the player the updates of a game being played until it is
+        over, from this coroutine, so that a slow spectator never holds up
+        the game"""
+        updates = asyncio.Queue()
+        broadcast = self.subscribe_spectator(player, game_id, updates)
+        if broadcast is None:
+            return
+        try:
+            while True:
+                frame = await updates.get()
+                if frame is None:
+                    break
+                if self.spectator_lagging(player):
+                    if not await player.await_drained():
+                        player.drop()
+                        break
+                    broadcast.catch_up(updates)
+                    continue
+                player.send_data(frame)
+        finally:
+            broadcast.unsubscribe(updates)
+
+    async def play_bot(self, player, difficulty):
+        """Plays a game of the player against a bot of the server, as this
+        coroutine"""
+        game, game1 = self.pair_bot(player, difficulty)
+        try:
+            await game.start()
+        except:
+            logger.info("game", "Game against a bot abandoned", player=player.id)
+        finally:
+            self.end_bot_game(player, game1)
+
+    async def join_game(self, player2, gameDet):
+        """Client wants join and existing game"""
+        try:
+            game = self.pair_players(player2, gameDet)
+            await game.start()
+        except:
+            logger.info("game", "Game abandoned", game=gameDet.GameID)
+
+    async def process_lobby_input(self, player, msg_type, values):
+        """Processes lobby input from the client"""
+        handler = self.waiting_request(msg_type)
+        if handler is not None:
+            await handler(player, *values)
+        else:
+            self.answer_lobby_input(player, msg_type, values)
+
+    async def __client_task(self, reader, writer):
+        """(Private) This is the client coroutine."""
+        logger.info("connection", "Connection received", address=writer.get_extra_info("peername")[0],
+                    port=writer.get_extra_info("peername")[1])
+        CONNECTIONS.inc()
+        # Send small messages right away, asyncio leaves it to the socket
+        writer.get_extra_info("socket").setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        frames = FrameReader()
+        timer = timers.schedule(IDLE_TIMEOUTS["hello"],
+                                lambda: self.loop.call_soon_threadsafe(writer.transport.abort))
+        try:
+            # Receive the hello message with the player name, or the
+            # resumption of a session
+            msg_type, values = decode_hello(await frames.read_from_stream(reader))
+        except ProtocolError as e:
+            writer.write(encode("Q", str(e)))
+            writer.close()
+            return
+        except:
+            logger.info("connection", "Disconnected before saying hello")
+            writer.close()
+            return
+        finally:
+            timers.cancel(timer)
+        if msg_type == "k":
+            self.resume_session(reader, writer, frames, *values)
+            return
+
+        player = AsyncPlayer(reader, writer, values[0], frames)
+        if self.welcome(player):
+            await self.__serve(player)
+
+    def resume_session(self, reader, writer, frames, received, session):
+        """Re-attaches a client resuming the session of a game on a new pair
+        of streams, after receiving the given number of messages of the
+        game."""
+        player = players.find_session(session)
+        if player is None or not player.resume(reader, writer, frames, received):
+            writer.write(encode("Q", "The session cannot be resumed."))
+            writer.close()
+            return
+        self.session_resumed(player)
+
+    async def __serve(self, player):
+        """(Private) Serves the lobby input of a client until it leaves."""
+        # Wrap the whole client coroutine with a try and catch so that the
+        # server would not be affected even if a client messes up
+        try:
+            while player.is_waiting:
+                self.await_request(player)
+                msg_type, values = await player.recvmessage()
+                self.lobby_request(player, msg_type)
+                await self.process_lobby_input(player, msg_type, values)
+        except:
+            logger.info("connection", "Player disconnected", player=player.id)
+        finally:
+            # Release the transport so idle disconnected clients cost nothing
+            self.end_session(player)
+
+
+class AsyncPlayer(Player):
+    """AsyncPlayer is a Player whose connection is a pair of asyncio streams."""
+
+    def __init__(self, reader, writer, player_name, frames, player_id=None, session=None):
+        """Initialize a player with its stream reader and writer"""
+        Player.__init__(self, writer, player_name, frames, player_id, session)
+        self.stream_reader = reader
+        # Waited on by create_game without blocking the event loop
+        self.game_over = asyncio.Event()
+        self.resumed = asyncio.Event()
+        self.read_lock = asyncio.Lock()
+        # The timer wheel expires the player from a thread of its own
+        self.loop = asyncio.get_running_loop()
+        # Whether the transport has more bytes queued than the high
+        # watermark, and has yet to drain below the low one
+        self.is_congested = False
+
+    def open_outbox(self, writer):
+        """The transport queues the bytes sent on it itself, and is only
+        given the watermarks"""
+        writer.transport.set_write_buffer_limits(*watermarks)
+        return None
+
+    def write(self, data):
+        """Queues raw bytes on the transport to the client. A client too slow
+        to keep up is dropped."""
+        if self.connection.is_closing():
+            raise ConnectionError("Connection closed")
+        transport = self.connection.transport
+        if transport.get_write_buffer_size() + len(data) > watermarks[0] * LIMIT_FACTOR:
+            SLOW_CLIENTS.labels("dropped").inc()
+            transport.abort()
+            raise QueueFull("Client too slow")
+        self.connection.write(data)
+
+    def congested(self):
+        """Returns True if the client reads too slowly to be sent anything
+        that can wait. The notifier is woken up once it catches up."""
+        size = self.connection.transport.get_write_buffer_size()
+        if size <= watermarks[1]:
+            self.is_congested = False
+        elif size >= watermarks[0] and not self.is_congested:
+            self.is_congested = True
+            self.loop.call_soon_threadsafe(self.loop.create_task, self.__await_caught_up())
+        return self.is_congested
+
+    async def __await_caught_up(self):
+        """(Private) Wakes up the notifier once the transport drains below
+        the low watermark."""
+        if await self.await_drained():
+            notifier.notify()
+
+    async def await_drained(self):
+        """Waits for the transport to drain below the low watermark. Returns
+        False if it does not in time."""
+        try:
+            await asyncio.wait_for(self.connection.drain(), DRAIN_TIMEOUT)
+            return True
+        except:
+            return False
+
+    def close(self):
+        """Closes the transport, dropping the bytes still queued"""
+        self.connection.close()
+
+    def drop(self):
+        """Aborts the transport, waking up whatever waits on it"""
+        self.connection.transport.abort()
+
+    def resume(self, reader, writer, frames, received):
+        """Re-attaches the client on a new pair of streams, and sends it
+        again the messages of the game sent after the given number it
+        received. Returns False if the session cannot be resumed."""
+        if not self.resumable() or received > len(self.log):
+            return False
+        # Closing the old transport wakes up the game waiting on it
+        self.connection.close()
+        self.stream_reader = reader
+        self.connection = writer
+        self.open_outbox(writer)
+        self.frames = frames
+        writer.write(b"".join([encode("K", self.session)] + self.log[received:]))
+        self.generation += 1
+        self.resumed.set()
+        return True
+
+    async def await_resume(self, generation):
+        """Waits up to the grace period for the client to resume its session
+        on a connection newer than the given generation, if it may. Returns
+        True if it has."""
+        if not self.resumable():
+            return False
+        if self.generation == generation:
+            self.resumed.clear()
+            try:
+                await asyncio.wait_for(self.resumed.wait(), grace_period)
+            except asyncio.TimeoutError:
+                return False
+        return self.generation != generation
+
+    def expire(self):
+        """Drops the connection of a client idle for longer than its state
+        allows, on the event loop"""
+        self.loop.call_soon_threadsafe(self.__expire)
+
+    def __expire(self):
+        """(Private) Drops the connection of an idle client."""
+        logger.info("connection", "Player timed out", player=self.id, state=self.state)
+        TIMED_OUT.labels(self.state).inc()
+        # An idle client is not waited for to resume its session
+        self.log = None
+        self.resumed.set()
+        self.connection.transport.abort()
+
+    async def read_frame(self):
+        """Receives the next frame from the client that is not a heartbeat.
+        A client losing the connection while it may resume its session is
+        waited for."""
+        async with self.read_lock:
+            if self.unread is not None:
+                frame, self.unread = self.unread, None
+                return frame
+            return await self.__read_frame()
+
+    async def await_match(self):
+        """Reads the heartbeats of a host waiting for a second player, until
+        the client confirms the match info, leaving that frame to the game.
+        Raises ProtocolError if the client sends anything else, such as
+        quitting."""
+        async with self.read_lock:
+            self.unread = await self.__read_frame()
+            if self.unread[0] != "c":
+                raise ProtocolError("Unexpected message while hosting")
+
+    async def __read_frame(self):
+        """(Private) Receives the next frame from the client that is not a
+        heartbeat, with the read lock held."""
+        while True:
+            generation = self.generation
+            try:
+                frame = await self.frames.read_from_stream(self.stream_reader)
+            except OSError:
+                if not await self.await_resume(generation):
+                    raise
+                continue
+            if self.restart:
+                timers.reschedule(self.timer, IDLE_TIMEOUTS[self.state])
+            # Heartbeats only keep the connection alive, and a snapshot asked
+            # for is sent right away
+            if frame[0] == "z":
+                self.resync()
+            elif frame[0] != "h":
+                return frame
+
+    async def recvmessage(self):
+        """Receives the next message from the client, as its command type
+        token and its values. Back in the lobby, the client can no longer
+        resume the last game it played."""
+        try:
+            msg_type, payload = await self.read_frame()
+            # A move sent again after resuming the session of a game that
+            # was over by then is not played
+            while msg_type == "i":
+                msg_type, payload = await self.read_frame()
+            self.log = None
+            return msg_type, decode(msg_type, payload)
+        except:
+            self.connection_lost()
+
+    async def recv(self, expected_type):
+        """Receives the next message from the client and check its integrity
+        by comparing its command type token with the expected one."""
+        try:
+            frame = await self.read_frame()
+        except:
+            # A missing frame fails the check
+            frame = None
+        return self.check_message(frame, expected_type)
+
+    async def send_match_info(self, opponentID):
+        """Sends a the matched information to the client, which includes
+        the assigned role and the matched player."""
+        # Send to client the opponent id, the assigned role and the matched
+        # player's ID, waiting for the client to confirm each of them
+        for confirmation, msg_type, value in ((1, "A", opponentID),
+                                              (2, "R", self.role),
+                                              (3, "O", self.match.id)):
+            self.send(msg_type, value)
+            if await self.recv("c") != confirmation:
+                self.connection_lost()
+
+
+class AsyncGame(Game):
+    """AsyncGame is a Game played as a coroutine on the event loop."""
+
+    async def start(self):
+        """Starts the game."""
+        # Send both players the match info
+        self.match_players()
+        try:
+            await self.player1.send_match_info(self.player2.id)
+            await self.player2.send_match_info(self.player1.id)
+
+            logger.info("game", "Players matched", game=self.game_id, x=self.player1.id, o=self.player2.id)
+            self.snapshot(self.player1)
+            self.snapshot(self.player2)
+            self.broadcast.publish(None, self.state())
+
+            try:
+                while True:
+                    # Player 1 move
+                    if await self.move(self.player1, self.player2):
+                        return
+                    # Player 2 move
+                    if await self.move(self.player2, self.player1):
+                        return
+            finally:
+                # Tell the spectators the game is over, even if abandoned
+                self.broadcast.finish(self.outcome)
+                self.record()
+        finally:
+            # A connection lost once the game is over is not told to the
+            # other player, who may be playing another game by then
+            self.unmatch_players()
+
+    async def move(self, moving_player, waiting_player):
+        """Lets a player make a move."""
+        self.begin_turn(moving_player, waiting_player)
+        # Receive the move from the moving player, skipping a move sent again
+        # after resuming a session that was already played
+        moving_player.watch("turn", restart=False)
+        seq, move = await moving_player.recv("i")
+        while seq <= self.seq:
+            seq, move = await moving_player.recv("i")
+        moving_player.unwatch()
+        return self.finish_turn(moving_player, waiting_player, move)
+
 
 # Define the main program
 def main():
     """The start of the server program"""
-    global player_names_list
-    global player_list
-    global game_list
-    global game_count
-    global chatHistory
-
-    player_names_list = []
-    player_list = []
-    game_list = []
-    game_count = 0
-    chatHistory = ""
-
-    # If there are more than 2 arguments
-    if len(argv) >= 2:
-        # Set port number to argument 1
-        port_number = argv[1]
+    global players
+    global lobby
+    global chat
+    global scoreboard
+    global broadcasts
+    global replays
+    global replay_index
+    global notifier
+    global grace_period
+    global timers
+    global outbox_writer
+    global watermarks
+    global logger
+
+    # The spectators of the games hosted by this process
+    broadcasts = BroadcastRegistry()
+
+    args = parse_arguments()
+    if args.port is not None:
+        port_number = args.port
     else:
         # Ask the user to input port number
         port_number = input("Please enter the port: ")
+    engine = args.engine
+    workers = args.workers
+    metrics_port = args.metrics_port
+    stats_file = args.stats_file if args.stats_file != "-" else None
+    replay_directory = args.replay_dir if args.replay_dir != "-" else None
+    grace_period = args.grace_period
+    high = int(args.outbox_high * 1024)
+    low = int(args.outbox_low * 1024) if args.outbox_low is not None else min(LOW_WATERMARK, high // 4)
+    watermarks = (high, low)
+    log_level = LEVELS[args.log_level]
+    logger = make_logger(log_level)
+    if workers > 1 and not prefork.supported():
+        logger.warning("server", "Worker processes are not supported on this platform, running a single process")
+        workers = 1
+    if workers > 1 and engine == "async":
+        # The state shared by the workers is reached through the broker with
+        # blocking calls, which would stall every client of the event loop
+        logger.warning("server", "Worker processes are not supported by the async engine, running a single process")
+        workers = 1
+
+    # The GameIDs carry on from the last run, so that every game in the
+    # replay log keeps its own
+    if workers > 1:
+        # The lobby, chat, scoreboard, player names and the index of the
+        # replay log are kept by a broker process shared by the workers
+        broker = start_broker()
+        replay_index = broker.ReplayIndex(replay_directory) if replay_directory else None
+        players = PlayerRegistry(broker.PlayerDirectory())
+        lobby = broker.Lobby(game_count=replay_index.last_id() if replay_index else 0)
+        chat = broker.ChatLog()
+        scoreboard = broker.Scoreboard(stats_file)
+    else:
+        replay_index = ReplayIndex(replay_directory) if replay_directory else None
+        players = PlayerRegistry()
+        lobby = Lobby(game_count=replay_index.last_id() if replay_index else 0)
+        chat = ChatLog()
+        scoreboard = Scoreboard(stats_file)
+    # The names of the bots are not given to players, and their moves are
+    # solved once, before any worker process is started
+    for bot_name in BOT_NAMES:
+        players.directory.take_name(bot_name)
+    solve()
 
     # Initialize the server object
-    server = TTTServerGame()
+    server = make_server(engine)
 
     # Bind the server with the port
-    server.bind(port_number)
+    server.bind(port_number, workers > 1 and prefork.reuse_port_supported())
+
+    if workers > 1:
+        # Start the workers, then close the socket here so that only the
+        # workers accept the clients. The workers log from threads of their
+        # own, once the records logged so far are written.
+        logger.close()
+        processes = prefork.start_workers(workers, run_worker, engine, server.server_socket,
+                                          metrics_port, replay_directory, log_level)
+        server.close()
+        for process in processes:
+            process.join()
+        return
+
+    if metrics_port is not None:
+        metrics.serve(metrics_port, logger)
+    replays = ReplayLog(replay_directory, index=replay_index) if replay_directory else None
+    notifier = Notifier()
+    timers = TimerWheel(logger)
+    outbox_writer = OutboxWriter()
 
     # Start the server
     server.start()
@@ -500,6 +2375,102 @@ def main():
     server.close()
 
 
+def parse_arguments():
+    """Returns the options the server is run with, the port being asked for
+    if it is not given"""
+    parser = argparse.ArgumentParser(description="Runs the tic tac toe server.")
+    parser.add_argument("port", nargs="?",
+                        help="the port the server listens on")
+    # Either one thread per client, or a single asyncio event loop for many
+    # concurrent clients
+    parser.add_argument("--engine", choices=("thread", "async"), default="thread",
+                        help="the server engine, one thread per client (the default) or an asyncio event loop")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="the number of worker processes sharing the port, each of them running the "
+                             "thread engine on a core of its own")
+    parser.add_argument("--metrics-port", type=int,
+                        help="the local port the metrics are exported on, each worker process exporting "
+                             "its own on the following ports")
+    parser.add_argument("--stats-file", default=STATS_FILE,
+                        help="the file the scoreboard is kept in, or - to keep it in memory only")
+    parser.add_argument("--replay-dir", default=REPLAY_DIRECTORY,
+                        help="the directory the finished games are logged to, or - not to log them")
+    parser.add_argument("--grace-period", type=float, default=GRACE_PERIOD,
+                        help="how long the seat of a player losing its connection in the middle of a game "
+                             "is kept for the client to resume its session, in seconds, 0 not to keep it")
+    # A client with more bytes queued than the high watermark is sent no
+    # pushes and skips the moves of the games it watches until it drains
+    # below the low watermark, and is dropped with LIMIT_FACTOR times the
+    # high watermark queued
+    parser.add_argument("--outbox-high", type=float, default=HIGH_WATERMARK / 1024,
+                        help="the high watermark of the bytes queued for each client, in KiB")
+    parser.add_argument("--outbox-low", type=float,
+                        help="the low watermark of the bytes queued for each client, in KiB")
+    parser.add_argument("--log-level", choices=tuple(LEVELS), default=LOG_LEVEL, type=str.lower,
+                        help="the level of the records logged")
+    return parser.parse_args()
+
+
+def make_logger(level, **fields):
+    """Returns the logger of the process, keeping the records of the given
+    level and above, with the given fields added to every record"""
+    log = Logger(level, **fields)
+    for category, every in LOG_SAMPLING.items():
+        log.sample(category, every)
+    for category, rate in LOG_RATE_LIMITS.items():
+        log.limit(category, rate)
+    return log
+
+
+def make_server(engine):
+    """Returns the server object running the given engine"""
+    if engine == "async":
+        return AsyncTTTServerGame()
+    return TTTServerGame()
+
+
+def start_broker():
+    """Starts the broker process keeping the state shared by the worker
+    processes, and returns it"""
+    for shared in (PlayerDirectory, Lobby, ChatLog, Scoreboard, ReplayIndex):
+        prefork.StateManager.register(shared.__name__, shared)
+    broker = prefork.StateManager(ctx=prefork.FORK)
+    broker.start()
+    return broker
+
+
+def run_worker(worker, handoff, engine, listener, metrics_port, replay_directory, log_level):
+    """The start of a worker process, accepting clients on the port of the
+    listening socket"""
+    global replays
+    global notifier
+    global timers
+    global outbox_writer
+    global logger
+    logger = make_logger(log_level, worker=worker)
+    # Every worker logs the games it hosts to segments of its own
+    replays = ReplayLog(replay_directory, "worker" + str(worker), replay_index) if replay_directory else None
+    # The lobby and the chat are also changed by the other workers
+    notifier = Notifier(PUSH_INTERVAL)
+    timers = TimerWheel(logger)
+    outbox_writer = OutboxWriter()
+    server = make_server(engine)
+    server.worker = worker
+    server.handoff = handoff
+    if prefork.reuse_port_supported():
+        # Accept on a socket of its own, bound to the same port
+        server.bind(listener.getsockname()[1], True)
+        listener.close()
+    else:
+        # Accept on the listening socket shared by all the workers
+        server.close()
+        server.server_socket = listener
+    logger.info("server", "Worker started")
+    if metrics_port is not None:
+        metrics.serve(metrics_port + worker, logger)
+    server.start()
+
+
 if __name__ == "__main__":
     # If this script is running as a standalone program,
     # start the main program.
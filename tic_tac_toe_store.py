@@ -0,0 +1,82 @@
+#! /usr/bin/python3
+
+# Import the sqlite3 module the stats are stored with
+import sqlite3
+# Import multi-threading module for the writer thread
+import threading
+# Import the time module to let the results pile up into a batch
+import time
+# Import the queue between the game threads and the writer thread
+from queue import SimpleQueue
+# Import the finalizers run when the process exits, including the broker
+# process of the worker processes
+from multiprocessing.util import Finalize
+
+# How long the writer waits after a result for more results to write in the
+# same transaction, in seconds
+BATCH_DELAY = 0.05
+
+
+class StatsStore:
+    """StatsStore persists the games won and lost by every player name in a
+    SQLite file. Saves are queued and written behind by a thread of its own,
+    many of them in a single transaction, so saving never waits on the
+    disk."""
+
+    def __init__(self, path, logger):
+        """Opens the store in the file at the given path, creating it if
+        needed, and starts its writer thread, logging the writes that fail
+        to the given logger."""
+        self.path = path
+        self.logger = logger
+        with sqlite3.connect(path) as db:
+            db.execute("CREATE TABLE IF NOT EXISTS stats ("
+                       "name TEXT PRIMARY KEY, won INTEGER NOT NULL, lost INTEGER NOT NULL)")
+        self.queue = SimpleQueue()
+        self.writer = threading.Thread(target=self.__write_loop, daemon=True)
+        self.writer.start()
+        # Write the results still queued when the process exits
+        Finalize(self, self.close, exitpriority=10)
+
+    def load(self):
+        """Returns the games won and lost by every player name stored"""
+        with sqlite3.connect(self.path) as db:
+            return {name: (won, lost) for name, won, lost in db.execute("SELECT name, won, lost FROM stats")}
+
+    def save(self, player_name, won, lost):
+        """Queues the games won and lost by a player to be written"""
+        self.queue.put((player_name, won, lost))
+
+    def close(self):
+        """Writes the results still queued and stops the writer thread"""
+        if self.writer.is_alive():
+            self.queue.put(None)
+            self.writer.join()
+
+    def __write_loop(self):
+        """(Private) Writes the queued results, the results piling up while
+        a batch is written going into the next one."""
+        db = sqlite3.connect(self.path)
+        running = True
+        while running:
+            batch = {}
+            item = self.queue.get()
+            time.sleep(BATCH_DELAY)
+            while True:
+                if item is None:
+                    running = False
+                    break
+                # Only the latest result of each player is written
+                player_name, won, lost = item
+                batch[player_name] = (won, lost)
+                if self.queue.empty():
+                    break
+                item = self.queue.get()
+            if batch:
+                try:
+                    with db:
+                        db.executemany("INSERT OR REPLACE INTO stats (name, won, lost) VALUES (?, ?, ?)",
+                                       [(name, won, lost) for name, (won, lost) in batch.items()])
+                except sqlite3.Error as e:
+                    self.logger.error("stats", "Failed to save the stats", error=str(e))
+        db.close()
@@ -0,0 +1,114 @@
+#! /usr/bin/python3
+
+# Import multi-threading module for the thread turning the wheel
+import threading
+# Import the time module to keep the wheel in step with the clock
+import time
+# Import the ceiling used to round the delays up to whole ticks
+from math import ceil
+
+# How often the wheel turns, in seconds, and its number of slots. A turn of
+# the whole wheel takes TICK * SLOTS seconds, longer delays wait for some
+# more turns
+TICK = 0.5
+SLOTS = 512
+
+
+class Timer:
+    """Timer is a callback scheduled on a TimerWheel."""
+
+    __slots__ = ("callback", "slot", "rounds")
+
+    def __init__(self, callback):
+        """Initializes a timer running the callback, not scheduled yet."""
+        self.callback = callback
+        # The slot of the wheel the timer is in, None if it is not
+        # scheduled, and the number of turns of the wheel it waits for
+        self.slot = None
+        self.rounds = 0
+
+
+class TimerWheel:
+    """TimerWheel runs callbacks after a delay, to the nearest tick. Every
+    timer is hashed into the slot of the wheel its expiry falls on, so that
+    scheduling, moving and cancelling a timer take the same time however
+    many timers are pending, and each tick only goes through one slot. The
+    callbacks run on the thread turning the wheel, and must not block."""
+
+    def __init__(self, logger, tick=TICK, slots=SLOTS):
+        """Initializes a wheel of the given number of slots, turning a slot
+        every tick seconds, and logging the callbacks that fail to the given
+        logger."""
+        self.logger = logger
+        self.tick = tick
+        self.slots = [set() for i in range(slots)]
+        self.lock = threading.Lock()
+        # The slot of the last tick
+        self.current = 0
+        self.thread = None
+
+    def start(self):
+        """Starts turning the wheel on a thread of its own"""
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.__turn_loop, daemon=True)
+            self.thread.start()
+
+    def schedule(self, delay, callback):
+        """Runs the callback after the given delay, in seconds, and returns
+        its Timer"""
+        timer = Timer(callback)
+        with self.lock:
+            self.__insert(timer, delay)
+        return timer
+
+    def reschedule(self, timer, delay):
+        """Runs the callback of a timer after the given delay instead,
+        whether the timer is still pending or not"""
+        with self.lock:
+            self.__remove(timer)
+            self.__insert(timer, delay)
+
+    def cancel(self, timer):
+        """Cancels a timer, unless it has already run"""
+        with self.lock:
+            self.__remove(timer)
+
+    def __insert(self, timer, delay):
+        """(Private) Puts a timer in the slot of its expiry, with the lock
+        held."""
+        ticks = max(1, ceil(delay / self.tick))
+        timer.slot = (self.current + ticks) % len(self.slots)
+        # The slot comes round once every turn of the wheel
+        timer.rounds = (ticks - 1) // len(self.slots)
+        self.slots[timer.slot].add(timer)
+
+    def __remove(self, timer):
+        """(Private) Takes a timer out of its slot, with the lock held."""
+        if timer.slot is not None:
+            self.slots[timer.slot].discard(timer)
+            timer.slot = None
+
+    def __turn_loop(self):
+        """(Private) Turns the wheel a slot every tick, running the callbacks
+        of the timers expiring in it. A late tick catches up on the ones it
+        missed."""
+        next_tick = time.monotonic()
+        while True:
+            next_tick += self.tick
+            time.sleep(max(0, next_tick - time.monotonic()))
+            expired = []
+            with self.lock:
+                self.current = (self.current + 1) % len(self.slots)
+                slot = self.slots[self.current]
+                for timer in list(slot):
+                    if timer.rounds:
+                        timer.rounds -= 1
+                    else:
+                        slot.discard(timer)
+                        timer.slot = None
+                        expired.append(timer)
+            for timer in expired:
+                try:
+                    timer.callback()
+                except Exception as e:
+                    self.logger.error("timers", "A timer failed", error=repr(e))